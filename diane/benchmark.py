@@ -0,0 +1,181 @@
+import sys
+import copy
+import json
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import multiprocessing
+from os.path import dirname, abspath, join
+
+# the components import each other from src: metrics has to come from the
+# same modules, not from the src package, or the registry is another one
+sys.path.append(join(dirname(abspath(__file__)), 'src'))
+
+from run import IoTFuzzer
+from simulator import SimulatedBackend
+from metrics import get_registry
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+logging.basicConfig()
+log = logging.getLogger("Benchmark")
+log.setLevel(logging.DEBUG)
+
+# everything the components read from the config, for a simulated device
+BENCH_CONFIG = {
+    'android_ip': '10.0.0.2',
+    'device_ip': '10.0.0.3',
+    'ip_hot_spot': '10.0.0.1',
+    'pass_ap': '',
+    'device_id': 'sim0',
+    'android_sdk_platforms': None,
+    'skip_methods': [],
+    'skip_classes': [],
+    'bad_functions': [],
+    'comb_budget': 2000,
+    'metrics_interval': 1,
+}
+
+# simulator profile overrides, see src/simulator/app.py
+SCENARIOS = {
+    'baseline': {},
+    'slow_rpc': {'rpc_sec': 0.005},
+    'slow_spawn': {'spawn_sec': 0.5, 'java_sec': 0.1},
+    'low_hit_rate': {'hit_rate': 0.1},
+    # crash_rate is per value consumed: fast_fuzz windows send every prepared
+    # value on each hook hit, thousands per replay, and most windows still complete
+    'crashy': {'crash_rate': 0.0001},
+}
+# a scenario still running after this long is stopped and reported as not finished
+SCENARIO_TIMEOUT_SEC = 600
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+def totals():
+    return dict(get_registry().snapshot()['totals'])
+
+
+def run_scenario(name, base_config, keep=False):
+    config = copy.deepcopy(base_config)
+    config['simulator'] = dict(config.get('simulator', {}), **SCENARIOS[name])
+    work_dir = tempfile.mkdtemp(prefix='diane_bench_{}_'.format(name))
+    backend = SimulatedBackend(config)
+    backend.install(config, work_dir)
+
+    res = {'scenario': name, 'work_dir': work_dir, 'finished': True}
+    rss = max_rss_kb()
+    start = time.time()
+    fuzzer = IoTFuzzer(config, backend=backend)
+    res['setup_sec'] = time.time() - start
+
+    before = totals()
+    for phase, fun in (('reran', fuzzer.run_reran_phase), ('fuzzing', fuzzer.run_fuzzing_phase)):
+        start = time.time()
+        fun()
+        res[phase + '_sec'] = time.time() - start
+    after = totals()
+
+    # window stats cover the values fuzzed on every device of a pool
+    stats = fuzzer.pool.get_window_stats() if fuzzer.pool else fuzzer.arg_fuzzer.get_window_stats()
+    res['consumed'] = sum(st['consumed'] for st in stats.values())
+    res['prepared'] = sum(st['prepared'] for st in stats.values())
+    res['windows'] = sum(st['windows'] for st in stats.values())
+    res['crashes'] = after.get('crashes', 0) - before.get('crashes', 0)
+    res['rpcs'] = after.get('rpcs', 0) - before.get('rpcs', 0)
+    # where the fuzzing time goes
+    for name in ('idle_time', 'replay_time', 'rpc_time'):
+        res[name.replace('_time', '_sec')] = after.get(name, 0) - before.get(name, 0)
+    res['iterations_per_sec'] = res['consumed'] / res['fuzzing_sec'] if res['fuzzing_sec'] else 0.0
+    res['windows_per_sec'] = res['windows'] / res['fuzzing_sec'] if res['fuzzing_sec'] else 0.0
+    res['max_rss_kb'] = max_rss_kb()
+    res['rss_growth_kb'] = res['max_rss_kb'] - rss
+
+    if not keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return res
+
+
+def scenario_worker(name, base_config, keep, results):
+    try:
+        res = run_scenario(name, base_config, keep=keep)
+    except Exception as e:
+        log.exception("Scenario {} failed".format(name))
+        res = {'scenario': name, 'finished': False, 'error': str(e)}
+    results.put(res)
+
+
+def run_bounded(name, base_config, keep=False, timeout=SCENARIO_TIMEOUT_SEC):
+    # every scenario runs in a process of its own: it can be stopped when
+    # it does not finish in time, and its memory is measured alone
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=scenario_worker, args=(name, base_config, keep, results))
+    p.start()
+    try:
+        res = results.get(timeout=timeout)
+    except Empty:
+        log.error("Scenario {} did not finish in {} s".format(name, timeout))
+        p.terminate()
+        res = {'scenario': name, 'finished': False, 'error': 'timeout'}
+    p.join()
+    return res
+
+
+def print_results(results):
+    cols = ['scenario', 'setup_sec', 'fuzzing_sec', 'idle_sec', 'consumed', 'windows', 'crashes',
+            'iterations_per_sec', 'windows_per_sec', 'max_rss_kb']
+    print(' '.join('{:>18}'.format(c) for c in cols))
+    for res in results:
+        if not res['finished']:
+            print('{:>18} did not finish ({})'.format(res['scenario'], res['error']))
+            continue
+        print(' '.join('{:>18.3f}'.format(res[c]) if isinstance(res[c], float) else '{:>18}'.format(res[c])
+                       for c in cols))
+
+
+if __name__ == "__main__":
+    # python benchmark.py [config_path] [--scenario name]... [--json out_path] [--timeout sec] [--keep] [--verbose]
+    argv = sys.argv[1:]
+    scenarios = []
+    out_path = None
+    timeout = SCENARIO_TIMEOUT_SEC
+    keep = '--keep' in argv
+    if '--verbose' not in argv:
+        logging.disable(logging.INFO)
+    argv = [a for a in argv if a not in ('--keep', '--verbose')]
+    while '--scenario' in argv:
+        i = argv.index('--scenario')
+        scenarios.append(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+    if '--json' in argv:
+        i = argv.index('--json')
+        out_path = argv[i + 1]
+        argv = argv[:i] + argv[i + 2:]
+    if '--timeout' in argv:
+        i = argv.index('--timeout')
+        timeout = float(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+
+    base_config = dict(BENCH_CONFIG)
+    if argv:
+        with open(argv[0]) as fp:
+            base_config.update(json.load(fp))
+
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        print("Unknown scenarios {}, options are: {}".format(unknown, sorted(SCENARIOS)))
+        sys.exit(1)
+
+    results = [run_bounded(name, base_config, keep=keep, timeout=timeout) for name in scenarios or sorted(SCENARIOS)]
+    print_results(results)
+    if out_path:
+        with open(out_path, 'w') as fp:
+            json.dump(results, fp, indent=2)
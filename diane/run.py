@@ -1,17 +1,17 @@
+import os
 import sys
 import json
 import time
 import signal
 from enum import Enum
 from fuzzcounter import FuzzCounterArgFuzzer
-from src.sniffer.sniffer import Sniffer
-from src.sniffer.bltlog_analyzer import BltLogAnalyzer
 from src.methods_finder import SendFinder, SweetSpotFinder
-from src.frida_hooker.frida_hooker import FridaHooker, FridaRunner
-from src.ui.core import ADBDriver
+from src.frida_hooker.frida_hooker import FridaRunner
 from src.arg_fuzzer.arg_fuzzer import ArgFuzzer
-from pysoot.lifter import Lifter
+from src.arg_fuzzer.journal import FuzzJournal, JOURNAL_FILE_NAME
+from src.scheduler import DevicePool, DeviceBackend, PowerScheduler
 from node_filter.node_filter import NodeFilter
+from lifter_utils import release_lifter
 
 import logging
 
@@ -49,8 +49,10 @@ class Phase(Enum):
 
 @FridaRunner
 class IoTFuzzer:
-    def __init__(self, config):
+    def __init__(self, config, backend=None):
         self.config = config
+        # real devices unless given e.g. a simulated backend
+        self.backend = backend if backend else DeviceBackend()
         self.reran_record_path = config['reran_record_path']
         self.senders = config['send_functions'] if 'send_functions' in config else []
         self.automated_senders = []
@@ -67,29 +69,24 @@ class IoTFuzzer:
         self.nf = NodeFilter(self.config, lifter=self.lifter)
 
         log.debug("Building Reran Object")
-        self.adbd = ADBDriver(device_id=config['device_id'])
+        self.adbd = self.backend.adb_driver(config)
         log.debug("Done.")
 
         log.debug("Building Sniffer")
-        sniffer_config = {
-            'android_ip': config['android_ip'],
-            'device_ip': config['device_ip'],
-            'ip_hot_spot': config['ip_hot_spot'],
-            'pass_ap': config['pass_ap']
-            }
-        self.sniffer = Sniffer(sniffer_config)
+        self.sniffer = self.backend.sniffer(config)
         log.debug("Done.")
 
         log.debug("Building BltLogAnalyzer")
-        self.bltlog_analyzer = BltLogAnalyzer()
+        self.bltlog_analyzer = self.backend.bltlog_analyzer(config)
         log.debug("Done.")
 
         log.debug("Building Hooker")
-        self.hooker = FridaHooker(config, node_filter=self.nf)
+        self.hooker = self.backend.hooker(config, node_filter=self.nf)
         log.debug("Done.")
 
         log.debug("Building SendFinder")
-        self.send_finder = SendFinder(config, sniffer=self.sniffer, hooker=self.hooker, bltlog_analyzer=self.bltlog_analyzer)
+        self.send_finder = SendFinder(config, sniffer=self.sniffer, hooker=self.hooker, bltlog_analyzer=self.bltlog_analyzer,
+                                      adb_driver=self.adbd)
         log.debug("Done.")
 
         log.debug("Building SweetSpotFinder")
@@ -100,6 +97,18 @@ class IoTFuzzer:
         self.arg_fuzzer = ArgFuzzer(config, hooker=self.hooker)
         log.debug("Done.")
         
+        log.debug("Opening campaign journal")
+        self.journal = FuzzJournal(os.path.join(self.arg_fuzzer.fuzz_res_dir, JOURNAL_FILE_NAME),
+                                   resume=config.get('resume', False))
+        self.arg_fuzzer.journal = self.journal
+        log.debug("Done.")
+
+        self.pool = None
+        if len(config.get('device_ids', [])) > 1:
+            log.debug("Building Device Pool")
+            self.pool = DevicePool(config, config['device_ids'], self.arg_fuzzer, backend_factory=self.backend)
+            log.debug("Done.")
+
         log.debug("Building Fuzz Counter ArgFuzzer")
         self.fuzz_counter_arg_fuzzer = FuzzCounterArgFuzzer(config, hooker=self.hooker)
         log.debug("Done.")
@@ -108,7 +117,14 @@ class IoTFuzzer:
 
     def create_lifter(self):
         log.info("Creating Lifter")
-        self.lifter = Lifter(self.config['apk_path'], input_format="apk", android_sdk=self.config['android_sdk_platforms'])
+        self.lifter = self.backend.lifter(self.config)
+
+    def release_lifter(self):
+        # fuzzing reads the class index, the Soot IR is not needed anymore
+        self.lifter = None
+        self.nf.lifter = None
+        self.sp_finder.release_lifter()
+        release_lifter(self.config)
 
     def run_reran(self):
         if not self.reran_record_path:
@@ -135,7 +151,11 @@ class IoTFuzzer:
         elif self.phase == Phase.MESSAGE_SENDER:
             self.send_finder.terminate()
         elif self.phase == Phase.FUZZING:
-            self.arg_fuzzer.terminate()
+            if self.pool:
+                # run_fuzzing_phase terminates the workers once the pool returns
+                self.pool.stop()
+            else:
+                self.arg_fuzzer.terminate()
 
     def run_reran_phase(self):
         log.info("Recording user interactions")
@@ -165,21 +185,61 @@ class IoTFuzzer:
             eval_stats.write('Time (s): {}\nsweet spots: {}\n'.format(str(elapsed_time), str(self.sp)))
         log.debug("Sweet spots: {}".format(str(self.sp)))
 
+    def restore_targets(self):
+        # methods found by a previous run of the campaign
+        targets = self.journal.targets
+        if targets:
+            log.info("Restoring senders and sweet spots from the journal")
+            self.senders = targets['senders']
+            self.sp = targets['sweet_spots']
+            self.automated_senders = targets['automated_senders']
+
     def run_fuzzing_phase(self):
         log.info("Starting fuzzing")
         self.phase = Phase.FUZZING
+        self.release_lifter()
+        self.journal.record_targets({'senders': self.senders,
+                                     'sweet_spots': self.sp,
+                                     'automated_senders': self.automated_senders})
+
+        targets = [('fast_senders', m, True) for m in self.senders] + \
+                  [('senders', m, False) for m in self.senders] + \
+                  [('sweet_spots', m, False) for m in self.sp] + \
+                  [('automated_senders', m, False) for m in self.automated_senders]
+
+        # with a global budget, the units of all the targets share it as their yield goes
+        scheduler = None
+        if self.config.get('fuzz_budget'):
+            units = [(fuzz_list, m, unit, fast_fuzz) for fuzz_list, m, fast_fuzz in targets
+                     for unit in self.arg_fuzzer.get_fuzz_units(m)]
+            scheduler = PowerScheduler(units, self.config['fuzz_budget'], journal=self.journal)
+
+        if self.pool:
+            self.pool.lifter = self.lifter
+            fuzz_counts = self.pool.run_scheduled(scheduler) if scheduler else self.pool.run(targets)
+            self.pool.terminate()
+            log.info("Fuzz count per function over all devices:")
+            log.info(fuzz_counts)
+            window_stats = self.pool.get_window_stats()
+        elif scheduler:
+            for task in scheduler:
+                fuzz_list, function_to_fuzz, unit, fast_fuzz, n_fuzz = task
+                starting_time = time.time()
+                fuzzed, count, _ = self.arg_fuzzer.fuzz_unit(function_to_fuzz, unit, ran_fun=self.adbd.replay_ui_async,
+                                                             fast_fuzz=fast_fuzz, lifter=self.lifter,
+                                                             fuzz_list=fuzz_list, n_fuzz=n_fuzz)
+                scheduler.record(task, fuzzed, count, self.arg_fuzzer.unit_stats, time.time() - starting_time)
+            window_stats = self.arg_fuzzer.get_window_stats()
+        else:
+            for fuzz_list, function_to_fuzz, fast_fuzz in targets:
+                self.arg_fuzzer.start(function_to_fuzz, fast_fuzz=fast_fuzz, ran_fun=self.adbd.replay_ui_async,
+                                      lifter=self.lifter, fuzz_list=fuzz_list)
+            window_stats = self.arg_fuzzer.get_window_stats()
 
-        for function_to_fuzz in self.senders:
-            self.arg_fuzzer.start(function_to_fuzz, fast_fuzz=True, ran_fun=self.adbd.replay_ui_async, lifter=self.lifter)
-
-        for function_to_fuzz in self.senders:
-            self.arg_fuzzer.start(function_to_fuzz, ran_fun=self.adbd.replay_ui_async, lifter=self.lifter)
-
-        for function_to_fuzz in self.sp:
-            self.arg_fuzzer.start(function_to_fuzz, ran_fun=self.adbd.replay_ui_async, lifter=self.lifter)
-
-        for function_to_fuzz in self.automated_senders:
-            self.arg_fuzzer.start(function_to_fuzz, ran_fun=self.adbd.replay_ui_async, lifter=self.lifter)
+        with open('/tmp/stats_' + self.config['proc_name'], 'a') as eval_stats:
+            for method, stats in window_stats.items():
+                eval_stats.write('Windows {}: prepared {}, consumed {} ({:.0%})\n'.format(
+                    method, stats['prepared'], stats['consumed'], stats['efficiency']))
 
         # Print the fuzz count for each function
         log.info("Fuzz count for each function:")
@@ -188,6 +248,9 @@ class IoTFuzzer:
         log.info("Fuzzing done!")
 
     def run(self, phase=Phase.FUZZING):
+        if self.config.get('resume', False):
+            self.restore_targets()
+
         if phase >= Phase.RERAN:
             self.run_reran_phase()
 
@@ -201,25 +264,31 @@ class IoTFuzzer:
             self.run_fuzzing_phase()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python run.py <config_path> [phase]")
+    # --resume continues the campaign recorded in the journal
+    resume = '--resume' in sys.argv
+    argv = [a for a in sys.argv if a != '--resume']
+
+    if len(argv) < 2:
+        print("Usage: python run.py <config_path> [phase] [--resume]")
         sys.exit(1)
 
-    config_path = sys.argv[1]
+    config_path = argv[1]
 
     try:
         with open(config_path) as fp:
             config = json.load(fp)
-    except FileNotFoundError:
-        print(f"Error: Config file '{config_path}' not found.")
+    except IOError:
+        print("Error: Config file '{}' not found.".format(config_path))
         sys.exit(1)
-    except json.JSONDecodeError:
-        print(f"Error: Invalid JSON format in config file '{config_path}'.")
+    except ValueError:
+        print("Error: Invalid JSON format in config file '{}'.".format(config_path))
         sys.exit(1)
 
+    config['resume'] = resume
+
     phase = Phase.FUZZING
-    if len(sys.argv) > 2:
-        phase = [value for name, value in vars(Phase).items() if name == sys.argv[2]]
+    if len(argv) > 2:
+        phase = [value for name, value in vars(Phase).items() if name == argv[2]]
         if not phase:
             print("Invalid phase, options are: " + str([x[6:] for x in list(map(str, Phase))]))
             sys.exit(0)
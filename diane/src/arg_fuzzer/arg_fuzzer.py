@@ -3,9 +3,14 @@ import time
 import logging
 import os
 import signal
-import itertools
+import random
 from values import Values
-from pysoot.lifter import Lifter
+from journal import get_rng_state, set_rng_state
+from comb_scheduler import CombinationScheduler
+from window_controller import WindowController
+from trace_format import TraceWriter, TraceReader, ReplayStream, is_trace_file, value_str
+from dedup import DedupFilter, DEDUP_DIR_NAME
+from minimizer import Minimizer, MAX_MINIMIZE_RUNS
 import sys
 from os.path import dirname, abspath
 
@@ -14,6 +19,8 @@ sys.path.append(dirname(dirname(abspath(__file__))))
 from frida_hooker import FridaHooker, ApkExploded, TransportError, FridaRunner, FridaRunnerMeta
 from crash_detector.pcap_base_detector import PcapBasedDetector
 from ui.core import ADBDriver
+from lifter_utils import get_field_resolver, get_lifter, get_class_index
+from metrics import get_registry
 
 logging.basicConfig()
 log = logging.getLogger("ArgFuzzer")
@@ -23,9 +30,16 @@ PRIMITIVE_TYPES = ["byte", "short", "int", "long", "char", "float", "double", "b
 KNOWN_OBJ = ["java.lang.String", "java.lang.Integer", "java.lang.Float", "java.lang.Double", "java.nio.ByteBuffer"]
 FUZZ_RES_PATH = "{}/{}_IoTFuzz/"
 FUZZ_RES_FILE_NAME = "{}_0"
+CRASH_FILE_NAME = "{}_crash_{}"
 
 N_FUZZ = 1000
 WINDOW_FUZZ = 350
+MAX_WINDOW_FUZZ = 4 * WINDOW_FUZZ
+WINDOW_STATS_FILE_NAME = "window_stats.json"
+METRICS_FILE_NAME = "metrics"
+REPETITION_GRACE_SEC = 1
+# windows in a row that crash the app before a unit is given up
+MAX_CRASHES_IN_ROW = 10
 
 
 class FuzzTerminate(Exception):
@@ -44,14 +58,44 @@ class ArgFuzzer:
         self.reran_proc = None
         self.fuzz_history = {}
 
+        # values generated by the agent from a seed, see spawn_and_seed_param
+        self.seeded_fuzz = config.get('seeded_fuzz', False)
+        self.seed_rng = random.Random(config.get('fuzz_seed'))
+        self.seeded_window = None
+
+        # campaign journal, set by the caller to make the fuzzing resumable
+        self.journal = None
+        self.fuzz_list = None
+        # number of values fuzzed per method
+        self.fuzz_counts = {}
+        # values fuzzed per method by the combination scheduler, None for the default
+        self.comb_budget = config.get('comb_budget')
+        # outcome of the last do_fuzz, used to rank parameter combinations
+        self.unit_stats = None
+        # window size controller per method
+        self.window_controllers = {}
+
         self.fuzz_res_dir = FUZZ_RES_PATH.format(config["results_path"], config["proc_name"])
         os.system('mkdir -p ' + self.fuzz_res_dir)
+        self.metrics = get_registry()
+        self.metrics.configure(config.get('metrics_path', self.fuzz_res_dir + METRICS_FILE_NAME),
+                               config.get('metrics_interval', self.metrics.interval))
+        # values already tried in this campaign are not sent again
+        if config.get('dedup', True):
+            self.vals.dedup = DedupFilter(config.get('dedup_path', self.fuzz_res_dir + DEDUP_DIR_NAME))
         self.fp = None
+        self.window_id = 0
+        # (dedup key, value) of every list of the window being fuzzed
+        self.window_values = []
 
         self.traces = {}
-        self.pos_trace = 0
+        self.replay_stream = None
         self.replaying = False
 
+        # crashing windows are replayed to find the values that make the app crash
+        self.minimize_crashes = config.get('minimize_crashes', True)
+        self.minimize_runs = config.get('minimize_runs', MAX_MINIMIZE_RUNS)
+
         # debug fields
         self.pos_fun_param_to_fuzz = None
         self.fields = []
@@ -102,12 +146,18 @@ class ArgFuzzer:
         log.info("Interesting run  detected.")
         if self.fp is not None:
             log.info("Saving it...")
+            # every value is written once, under the window it was fuzzed in
+            self.window_id += 1
+            self.fp.start_window(self.window_id)
             for key, vals in self.fuzz_history.items():
+                # parameters are logged as (combination, position, type), class fields as (name, type)
+                comb, pos, type_obj = key if len(key) == 3 else (None,) + key
                 for val in vals:
-                    self.fp.write("Fuzzed Args: {}, Arg pos: {}, type: {}, val: {}\n".format(
-                        key[0], key[1], key[2], str(val))
-                    )
-        self.fp.flush()
+                    self.fp.write_value(comb, pos, type_obj, val)
+            if self.is_journaled():
+                # the journal must not get ahead of the results
+                self.fp.flush()
+        self.fuzz_history = {}
 
     def kill_reran(self):
         try:
@@ -115,6 +165,20 @@ class ArgFuzzer:
         except:
             pass
 
+    def get_window_controller(self, method):
+        key = str(method)
+        if key not in self.window_controllers:
+            self.window_controllers[key] = WindowController(WINDOW_FUZZ, MAX_WINDOW_FUZZ)
+        return self.window_controllers[key]
+
+    def get_window_stats(self):
+        return {key: c.stats() for key, c in self.window_controllers.items()}
+
+    def save_window_stats(self):
+        # prepared vs consumed values, per method
+        with open(self.fuzz_res_dir + WINDOW_STATS_FILE_NAME, 'w') as fp:
+            json.dump(self.get_window_stats(), fp, indent=2)
+
     def is_known_type(self, p):
         return any([p.startswith(pt) for pt in PRIMITIVE_TYPES + KNOWN_OBJ])
 
@@ -122,24 +186,35 @@ class ArgFuzzer:
         return any([p.startswith(pt) for pt in PRIMITIVE_TYPES])
 
     def hook_new_methods(self, methods):
-        time.sleep(5)
+        # start kills the previous instance of the app and waits for it to go away
         log.debug("Hooking {} methods".format(len(methods)))
         self.hooker.start(methods, force_hook=True)
 
-    def wait_for_repetition(self):
-        while not self.hooker.is_repetition_done():
-            time.sleep(1)
-            # return if reran finished
-            if self.reran_proc.poll() is not None:
-                log.debug("Stop waiting, reran finished. Might not be the correct send")
-                return
+    def replay(self, ran_fun, stop_on_repetition=False):
+        # run the replay until the window ends
+        with self.metrics.timer('replay_time'):
+            self.reran_proc = self.hooker.watch_process(ran_fun())
+            self.wait_for_reran(stop_on_repetition=stop_on_repetition)
 
-    def wait_for_reran(self):
-        while True:
-            time.sleep(1)
-            # return if reran finished
-            if self.reran_proc.poll() is not None:
-                return
+    def reran_done(self):
+        return self.reran_proc.poll() is not None
+
+    def wait_for_repetition(self):
+        self.hooker.wait_event(lambda: self.hooker.is_repetition_done() or self.reran_done())
+        if not self.hooker.is_repetition_done():
+            log.debug("Stop waiting, reran finished. Might not be the correct send")
+
+    def wait_for_reran(self, stop_on_repetition=False):
+        if not stop_on_repetition:
+            self.hooker.wait_event(self.reran_done, metric=None)
+            return
+
+        self.hooker.wait_event(lambda: self.hooker.is_repetition_done() or self.reran_done(), metric=None)
+        if not self.reran_done():
+            # every fuzzed value was consumed, the rest of the replay is useless.
+            # Leave the app a moment to crash on the last values
+            self.hooker.wait_event(lambda: not self.hooker.is_running, timeout=REPETITION_GRACE_SEC, metric=None)
+            self.kill_reran()
 
     def equal_types(self, a, b):
         #FIXME: fix this!!! Use the frida_hooker approach instead
@@ -159,58 +234,40 @@ class ArgFuzzer:
         obj_type = finfo[1]
 
         self.hook_new_methods([method])
-        self.hooker.prepare_new_fuzzing(cls, m, times, 0, fast_fuzz)
 
         log.info("Setting up {} different values for the field {}. "
                   "This might take a while".format(str(times), str(field_name)))
 
-        for _ in xrange(times):
-            self.hooker.next_fields_list()
-            field_val = self.vals.create_value(obj_type, self.hooker.modify_class_field, field_name)
+        batch = self.hooker.new_batch(fields=True)
+        dedup_key = DedupFilter.key(method, field_name, obj_type)
+        for field_val, calls, duplicate in self.vals.create_values(obj_type, times, field_name, dedup_key=dedup_key):
+            batch.next_fields_list()
             if field_val is None:
                 log.error("fuzz_primitive has does not have a function for type {}".format(obj_type))
+                self.window_values.append([])
                 continue
+            if duplicate:
+                batch.discard_list()
+                continue
+            for a, kw in calls:
+                batch.modify_class_field(*a, **kw)
+            self.window_values.append([(dedup_key, field_val)])
 
             key_h = (field_name, obj_type)
             if key_h not in self.fuzz_history:
                 self.fuzz_history[key_h] = []
             self.fuzz_history[key_h].append(field_val)
-        log.info("Done.")
-        self.hooker.fuzz_prepare_done(True)
+        return self.upload_window(method, batch, times, 0, fast_fuzz)
 
     def get_class_fields(self, cls, extended=True):
-        def rename_for_frida(f):
-            f_name = f[0]
-            f_info = f[1]
-            if any([str(m.name) == f_name for m in self.lifter.classes[cls].methods]):
-                f_name = '_' + f_name
-            return (f_name, f_info)
-
         if self.fields:
             # for debugging
             return self.fields
-        if not self.lifter:
-            log.info("Building lifter")
-            apk_path = self.config["apk_path"]
-            android_sdk = self.config["android_sdk_platforms"]
-            self.lifter = Lifter(apk_path, input_format="apk", android_sdk=android_sdk)
+        # without a lifter at hand, the class index is enough and much lighter
+        classes = self.lifter if self.lifter else get_class_index(self.config)
 
         # get all the fields: own and inherited boths
-        clx = self.lifter.classes[cls]
-        fields = map(rename_for_frida, clx.fields.items())
-
-        if extended:
-            worklist = [clx.super_class]
-            while worklist:
-                cls = worklist[0]
-                worklist = worklist[1:]
-                if cls == 'java.lang.Object':
-                    break
-                clx = self.lifter.classes[cls]
-                fields += map(rename_for_frida, clx.fields.items())
-                worklist.append(clx.super_class)
-
-        return fields
+        return get_field_resolver(classes).get_fields(cls, extended)
 
     def spawn_and_fuzz_param(self, method, times, pos_to_fuzz, fast_fuzz=False, single_call_fuzz=False, curr_call=0 ):
         cls = method[0]
@@ -219,15 +276,34 @@ class ArgFuzzer:
 
         self.fuzz_history = {}
         self.hook_new_methods([method])
-        self.hooker.prepare_new_fuzzing(cls, m, times, len(params), fast_fuzz, single_call_fuzz, curr_call)
 
         log.info("Setting up {} different values for the {}-th parameters of {}:{}"
                     " This might take a while".format(str(times),
                                                       ', '.join(map(lambda x: str(x + 1), pos_to_fuzz)),
                                                       cls, m))
-        for _ in xrange(times):
+        # fields of the object parameters, the same for every call
+        obj_fields = {}
+        for i in pos_to_fuzz:
+            if not self.is_known_type(params[i]):
+                try:
+                    obj_fields[i] = self.get_class_fields(params[i])
+                except KeyError:
+                    log.warning('Cannot find class {}'.format(params[i]))
+                    obj_fields[i] = None
+
+        # values of the known types, drawn for the whole window at once
+        columns = {}
+        for i in pos_to_fuzz:
+            if self.is_known_type(params[i]):
+                columns[i] = self.vals.create_values(params[i], times, dedup_key=DedupFilter.key(method, i, params[i]))
+
+        batch = self.hooker.new_batch()
+        for j in xrange(times):
             # add new param list
-            self.hooker.next_param_list()
+            batch.next_param_list()
+            row = []
+            tried = []
+            novel = False
 
             for i, p_type in enumerate(params):
                 if i in pos_to_fuzz:
@@ -236,32 +312,98 @@ class ArgFuzzer:
                         # we gotta retrieve the object fields
                         # and fuzz them
                         par_val = "Class Obj"
-                        try:
-                            class_fields = self.get_class_fields(p_type)
-                        except KeyError:
-                            log.warning('Cannot find class {}'.format(p_type))
+                        class_fields = obj_fields[i]
+                        if class_fields is None:
                             continue
                         for fname, finfo in class_fields:
                             obj_type = finfo[1]
-                            self.vals.create_value(obj_type, self.hooker.modify_class_field, fname)
-                            self.hooker.set_arg_simple_obj()
+                            dedup_key = DedupFilter.key(method, (i, fname), obj_type)
+                            field_val = self.vals.create_value(obj_type, batch.modify_class_field, fname,
+                                                               dedup_key=dedup_key)
+                            if field_val is not None and not self.vals.duplicate:
+                                novel = True
+                                tried.append((dedup_key, field_val))
+                            batch.set_arg_simple_obj()
                     else:
-                        par_val = self.vals.create_value(p_type, self.hooker.create_obj)
+                        par_val, calls, duplicate = columns[i][j]
                         if par_val is None:
                             log.error("fuzz_primitive does not have a function for type {}".format(p_type))
-                            self.hooker.set_unfuzzed_obj()
+                            batch.set_unfuzzed_obj()
                             continue
+                        for a, kw in calls:
+                            batch.create_obj(*a, **kw)
+                        if not duplicate:
+                            novel = True
+                            tried.append((DedupFilter.key(method, i, p_type), par_val))
 
-                    # log it!
-                    key_h = (str(pos_to_fuzz), str(i), p_type)
-                    if key_h not in self.fuzz_history:
-                        self.fuzz_history[key_h] = []
-                    self.fuzz_history[key_h].append(par_val)
+                    row.append(((pos_to_fuzz, str(i), p_type), par_val))
                 else:
-                    self.hooker.set_unfuzzed_obj()
+                    batch.set_unfuzzed_obj()
 
+            if row and not novel:
+                # every fuzzed value was tried already
+                batch.discard_list()
+                continue
+            self.window_values.append(tried)
+
+            # log it!
+            for key_h, par_val in row:
+                if key_h not in self.fuzz_history:
+                    self.fuzz_history[key_h] = []
+                self.fuzz_history[key_h].append(par_val)
+
+        return self.upload_window(method, batch, times, len(params), fast_fuzz, single_call_fuzz, curr_call)
+
+    def upload_window(self, method, batch, times, nargs, fast_fuzz, single_call_fuzz=False, curr_call=0):
+        # returns the number of values prepared, which is less than times if
+        # some of them had been tried already
+        if len(batch) < times:
+            log.info("{} values already tried, not sent".format(str(times - len(batch))))
+            self.metrics.add('duplicates', times - len(batch))
+        if not len(batch):
+            return 0
+
+        self.hooker.prepare_new_fuzzing(method[0], method[1], len(batch), nargs, fast_fuzz, single_call_fuzz,
+                                        curr_call)
+        self.hooker.upload_batch(batch)
         log.info("Done.")
-        self.hooker.fuzz_prepare_done(True)
+        # with dedup, the lists must be used in order: only the first ones
+        # reaching the app are recorded as tried
+        self.hooker.fuzz_prepare_done(self.vals.dedup is None)
+        return len(batch)
+
+    def can_seed(self, method, pos_to_fuzz, fast_fuzz=False):
+        # with fast_fuzz the agent draws a whole window every time the method
+        # fires, and the host cannot tell how many values it drew
+        params = method[2]
+        return self.seeded_fuzz and not fast_fuzz and \
+            all([self.vals.get_seeded_spec(params[i]) for i in pos_to_fuzz])
+
+    def spawn_and_seed_param(self, method, times, pos_to_fuzz, fast_fuzz=False, single_call_fuzz=False, curr_call=0):
+        cls = method[0]
+        m = method[1]
+        params = method[2]
+
+        # the agent draws the values itself as the method fires,
+        # we only send the seed and the value kinds.
+        seed = self.seed_rng.getrandbits(32)
+        specs = [self.vals.get_seeded_spec(p_type) if i in pos_to_fuzz else None for i, p_type in enumerate(params)]
+        self.fuzz_history = {}
+        self.hook_new_methods([method])
+        log.info("Fuzzing the {}-th parameters of {}:{} with seed {}".format(
+            ', '.join(map(lambda x: str(x + 1), pos_to_fuzz)), cls, m, seed))
+        self.hooker.prepare_seeded_fuzzing(cls, m, times, len(params), seed, specs, self.vals.get_value_tables(),
+                                           fast_fuzz, single_call_fuzz, curr_call)
+        self.seeded_window = (method, pos_to_fuzz, seed)
+
+    def log_seeded_window(self, n_repeated):
+        # regenerate what the agent used, so that the run can be saved and replayed
+        method, pos_to_fuzz, seed = self.seeded_window
+        self.seeded_window = None
+        for i, p_type in enumerate(method[2]):
+            if i in pos_to_fuzz:
+                key_h = (pos_to_fuzz, str(i), p_type)
+                self.fuzz_history[key_h] = self.vals.create_seeded_values(p_type, seed, i, n_repeated)
 
     def spawn_and_replay_class_field(self, *kargs, **kwargs):
         log.error("Replay class fields is not implemented... yet")
@@ -270,8 +412,9 @@ class ArgFuzzer:
         cls = method[0]
         m = method[1]
         params = method[2]
-        traces = self.traces[str(method)][pos_to_fuzz]
-        pos_trace = self.pos_trace
+        # values not consumed by the previous window are replayed again
+        rows = self.replay_stream.peek(times)
+        times = len(rows)
         self.hook_new_methods([method])
         self.hooker.prepare_new_fuzzing(cls, m, times, len(params), fast_fuzz)
         log.info("Setting up {} different values for the {}-th parameters of {}:{}"
@@ -279,21 +422,22 @@ class ArgFuzzer:
                  ', '.join(map(lambda x: str(x + 1), pos_to_fuzz)),
                                                       cls, m))
 
-        for _ in xrange(times):
+        batch = self.hooker.new_batch()
+        for row in rows:
             # add new param list
-            self.hooker.next_param_list()
+            batch.next_param_list()
             for p, p_type in enumerate(params):
                 if p in pos_to_fuzz:
                     s_p = str(p)
-                    if s_p not in traces:
-                        self.hooker.set_unfuzzed_obj()
+                    if s_p not in row:
+                        batch.set_unfuzzed_obj()
                     else:
                         p_type = params[p]
                         if not self.is_known_type(p_type):
                             log.error("Replay non primitive fields not implemented..yet.")
                         else:
                             try:
-                                vals = traces[s_p][pos_trace].strip()
+                                vals = row[s_p].strip()
                                 if '[' in vals:
                                     vals = vals[1:-1].split(', ')
                             except:
@@ -323,77 +467,184 @@ class ArgFuzzer:
                                     par_val = []
 
                             # FIXME: check that javascript functions to create ad-hoc objects work here
-                            self.hooker.create_obj(base_type, self.is_primitive_type(p_type), par_val, nelem)
+                            batch.create_obj(base_type, self.is_primitive_type(p_type), par_val, nelem)
                 else:
-                    self.hooker.set_unfuzzed_obj()
-            pos_trace += 1
+                    batch.set_unfuzzed_obj()
 
+        self.hooker.upload_batch(batch)
         log.info("Done.")
         self.hooker.fuzz_prepare_done(False)
+        return times
+
+    def window_rows(self, method, pos_to_fuzz, n_values):
+        # values of the window just fuzzed, one row (position -> value) per call.
+        # None if they can not be replayed
+        if self.seeded_window is not None:
+            self.log_seeded_window(n_values)
+        columns = {}
+        for key, vals in self.fuzz_history.items():
+            if len(key) == 3 and key[0] == pos_to_fuzz:
+                columns[key[1]] = vals
+        if not columns or not all([self.is_known_type(method[2][int(pos)]) for pos in columns]):
+            return None
+        n = min([len(vals) for vals in columns.values()])
+        return [{pos: value_str(vals[i]) for pos, vals in columns.items()} for i in xrange(n)]
+
+    def replay_rows(self, method, pos_to_fuzz, rows, ran_fun, fast_fuzz=False):
+        # whether the values make the app crash again
+        self.replay_stream = ReplayStream({pos: iter([row[pos] for row in rows]) for pos in rows[0]})
+        self.metrics.add('minimize_runs')
+        try:
+            self.spawn_and_replay_param(method, len(rows), pos_to_fuzz, fast_fuzz=fast_fuzz)
+            self.replay(ran_fun, stop_on_repetition=True)
+        except ApkExploded:
+            return True
+        finally:
+            self.replay_stream = None
+        return False
+
+    def minimize_crash(self, method, pos_to_fuzz, ran_fun, n_values, fast_fuzz=False):
+        rows = self.window_rows(method, pos_to_fuzz, n_values)
+        if not rows:
+            log.info("The crashing values can not be replayed, not minimizing them")
+            return None
+
+        log.info("Minimizing the {} values of the crashing window".format(str(len(rows))))
+        minimizer = Minimizer(lambda r: self.replay_rows(method, pos_to_fuzz, r, ran_fun, fast_fuzz=fast_fuzz),
+                              max_runs=self.minimize_runs)
+        rows = minimizer.minimize(rows)
+        if rows is None:
+            log.info("Replaying the window did not crash the app again")
+            return None
+
+        path = self.save_crash(method, pos_to_fuzz, rows)
+        log.info("{} values reproduce the crash, saved to {}".format(str(len(rows)), path))
+        return path
+
+    def save_crash(self, method, pos_to_fuzz, rows):
+        # minimal reproducer, a trace that replay_trace runs again
+        counter = 0
+        name = self.fuzz_res_dir + CRASH_FILE_NAME.format(self.get_method_string(method), counter)
+        while os.path.isfile(name):
+            counter += 1
+            name = self.fuzz_res_dir + CRASH_FILE_NAME.format(self.get_method_string(method), counter)
+
+        writer = TraceWriter(name, method)
+        writer.start_window(1)
+        for row in rows:
+            for pos, val in sorted(row.items()):
+                writer.write_value(pos_to_fuzz, pos, method[2][int(pos)], val)
+        writer.close()
+        return name
 
     def terminate(self):
         self.kill_reran()
         raise FuzzTerminate("Stop")
 
+    def commit_window_values(self, n_tried):
+        # the first n_tried lists of the window reached the app
+        if self.vals.dedup is not None and not self.replaying:
+            self.vals.dedup.commit([kv for tried in self.window_values[:n_tried] for kv in tried])
+        self.window_values = []
+
+    def is_journaled(self):
+        return self.journal is not None and not self.replaying
+
     def do_fuzz(self, method, spawn_and_prepare_ran, ran_fun, remain_reps, *kargs, **kwargs):
+        # parameter combination or class field being fuzzed
+        unit = kargs[0] if kargs else None
+        self.unit_stats = {'fuzzed': 0, 'windows': 0, 'crashes': 0}
+        self.metrics.set_unit(method, unit)
+        if self.is_journaled() and self.journal.is_done(self.fuzz_list, method, unit):
+            log.info("Already fuzzed in a previous run, skipping it")
+            return True
+
         log.info("Fuzzing device with {} values".format(str(remain_reps)))
         tot_reps = 0
         unlimited = False
-        first_run = True
+        controller = self.get_window_controller(method)
+        # one crash per unit is minimized, each minimization replays the window many times
+        minimized = False
+        crashes_in_row = 0
 
         if 'single_call_fuzz' in kwargs and kwargs['single_call_fuzz']:
             # first execute one run to register the number
             # of calls
             kwargs['curr_call'] = 0
             self.hooker.start([method], force_hook=True)
-            self.reran_proc = ran_fun()
-            self.wait_for_reran()
+            self.replay(ran_fun)
             util_method_calls = self.hooker.get_n_repeated()
             log.info("Hooked function repeated {} times".format(str(util_method_calls)))
 
+        if self.is_journaled():
+            window = self.journal.get_window(self.fuzz_list, method, unit)
+            if window is not None:
+                log.info("Resuming from the last completed window")
+                remain_reps = window['remain_reps']
+                tot_reps = window['tot_reps']
+                set_rng_state(window['rng'], self.seed_rng)
+
         # set initial number or repetitions
         if remain_reps is None:
             remain_reps = 0
             unlimited = True
-            reps = WINDOW_FUZZ
-        else:
-            reps = min(remain_reps, WINDOW_FUZZ)
+        reps = controller.next_window(None if unlimited else remain_reps)
 
         while remain_reps > 0 or unlimited:
             try:
-                spawn_and_prepare_ran(method, reps, *kargs, **kwargs)
+                self.seeded_window = None
+                self.window_values = []
+                if self.vals.dedup is not None:
+                    self.vals.dedup.new_window()
+                # if the app crashes while the window is prepared
+                prepared = reps
+                prepared = spawn_and_prepare_ran(method, reps, *kargs, **kwargs)
+                if prepared is None:
+                    prepared = reps
+                if prepared == 0:
+                    log.info("No new values left to try")
+                    break
                 #reg_id = self.an.start_reg_run()
-                self.reran_proc = ran_fun()
-                self.wait_for_reran()
+                self.replay(ran_fun, stop_on_repetition=True)
+
+                # check how many times function has been executed
+                n_repeated = self.hooker.get_n_repeated()
+                log.info("Hooked function repeated {} times".format(str(n_repeated)))
+                if self.seeded_window is not None:
+                    self.log_seeded_window(n_repeated)
+
                 # check and save run results
                 #self.an.stop_reg_run(reg_id)
 
                 #if not self.an.verify_reg_run(reg_id):
                 #    log.info("Interesting run registered")
+                crashes_in_row = 0
                 self.save_run()
-
-                # check how many times function has been executed
-                n_repeated = self.hooker.get_n_repeated()
-                log.info("Hooked function repeated {} times".format(str(n_repeated)))
-                fuzzed_last_ran = min(n_repeated, reps)
+                fuzzed_last_ran = controller.update(prepared, n_repeated)
+                self.commit_window_values(fuzzed_last_ran)
                 remain_reps -= fuzzed_last_ran
+                self.metrics.add('windows')
+                self.metrics.add('generated', prepared)
+                self.metrics.add('consumed', fuzzed_last_ran)
 
                 # adaptive window
-                if first_run:
-                    reps = n_repeated
-                    first_run = False
-                if reps < n_repeated:
-                    reps = n_repeated
-                if not unlimited and reps > remain_reps:
-                    reps = remain_reps
+                reps = controller.next_window(None if unlimited else remain_reps)
 
                 tot_reps += fuzzed_last_ran
+                self.unit_stats['fuzzed'] = tot_reps
+                self.unit_stats['windows'] += 1
                 if self.replaying:
-                    self.pos_trace += fuzzed_last_ran
+                    self.replay_stream.consume(fuzzed_last_ran)
+                else:
+                    self.fuzz_counts[str(method)] = self.fuzz_counts.get(str(method), 0) + fuzzed_last_ran
 
                 if tot_reps == 0:
                     return False
 
+                if self.is_journaled():
+                    self.journal.record_window(self.fuzz_list, method, unit, None if unlimited else remain_reps,
+                                               tot_reps, get_rng_state(self.seed_rng))
+
                 if 'curr_call' in kwargs:
                     kwargs['curr_call'] = (kwargs['curr_call'] + 1) % util_method_calls
                     n = self.hooker.get_util_calls(method)
@@ -404,21 +655,74 @@ class ArgFuzzer:
                 log.info("Function fuzzed {} times.".format(str(tot_reps)))
             except ApkExploded as ae:
                 log.error("App exploded")
+                self.unit_stats['crashes'] += 1
+                self.metrics.add('crashes')
+                n_repeated = self.hooker.get_n_repeated()
+                # the values sent before the crash, and the crashing one, are spent
+                spent = max(min(n_repeated, prepared), 1)
+                self.commit_window_values(spent)
                 # we replayed the function once and the app exploded
                 # let's move on
-                if tot_reps <=1 and self.hooker.get_n_repeated() <= 1:
+                stop = tot_reps <= 1 and n_repeated <= 1
+                if self.minimize_crashes and not minimized and not self.replaying and \
+                        spawn_and_prepare_ran in (self.spawn_and_fuzz_param, self.spawn_and_seed_param):
+                    minimized = True
+                    self.minimize_crash(method, unit, ran_fun, prepared, fast_fuzz=kwargs.get('fast_fuzz', False))
+                if stop:
                     log.debug("Param or class field make the app crash. Stop fuzzing this one.")
                     break
 
+                crashes_in_row += 1
+                if not unlimited:
+                    remain_reps -= spent
+                    reps = controller.next_window(remain_reps)
+                if crashes_in_row >= MAX_CRASHES_IN_ROW:
+                    log.info("{} windows in a row crashed the app, moving on".format(str(crashes_in_row)))
+                    break
+
+        if self.is_journaled():
+            self.journal.record_done(self.fuzz_list, method, unit)
+        self.save_window_stats()
+        self.metrics.write()
         log.info("Fuzzing completed")
         return True
 
-    def get_combination(self, ls):
-        cmb = []
-        for s in range(0, len(ls) + 1):
-            for subset in itertools.combinations(ls, s):
-                cmb.append(subset)
-        return cmb
+    def wanted_combination(self, pos):
+        return self.pos_fun_param_to_fuzz is None or \
+            (pos in self.pos_fun_param_to_fuzz) or (pos == self.pos_fun_param_to_fuzz)
+
+    def wanted_combinations(self, n_params):
+        # the combinations asked for explicitly, of any size
+        if self.pos_fun_param_to_fuzz is None:
+            return []
+        pars = self.pos_fun_param_to_fuzz
+        pars = [pars] if isinstance(pars, tuple) else pars
+        return [tuple(sorted(p)) for p in pars
+                if isinstance(p, tuple) and p and all(0 <= x < n_params for x in p)]
+
+    def get_comb_scheduler(self, method):
+        return CombinationScheduler(len(method[2]), N_FUZZ, budget=self.comb_budget, accept=self.wanted_combination,
+                                    seeds=self.wanted_combinations(len(method[2])))
+
+    def get_param_combinations(self, method):
+        # the combinations every method gets: single positions, pairs and the wanted ones
+        return self.get_comb_scheduler(method).coverage
+
+    def get_fuzz_units(self, method):
+        # independent pieces of work start() would go through: parameter
+        # combinations, and None for the class fields
+        units = []
+        params = method[2]
+        if params and params[0] and self.fuzz_fun_params:
+            units += self.get_param_combinations(method)
+        if self.fuzz_class_fields:
+            units.append(None)
+        return units
+
+    def fuzz_param_combination(self, method, pos, ran_fun, fast_fuzz=False, single_call_fuzz=False, n_fuzz=N_FUZZ):
+        spawn_fun = self.spawn_and_seed_param if self.can_seed(method, pos, fast_fuzz) else self.spawn_and_fuzz_param
+        return self.do_fuzz(method, spawn_fun, ran_fun, n_fuzz, pos,
+                            fast_fuzz=fast_fuzz, single_call_fuzz=single_call_fuzz)
 
     def do_fuzz_params_function(self, method, ran_fun, fast_fuzz=False, single_call_fuzz=False):
         cls = method[0]
@@ -430,27 +734,42 @@ class ArgFuzzer:
         else:
             log.info("Fast fuzz is enabled")
 
-        cmb = self.get_combination(range(len(params)))
-        cmb = [x for x in cmb if x]
-
-        for pos in cmb:
-            if self.pos_fun_param_to_fuzz is not None:
-                if (pos not in self.pos_fun_param_to_fuzz) and (pos != self.pos_fun_param_to_fuzz):
-                    continue
-
-            fuzzed = self.do_fuzz(method, self.spawn_and_fuzz_param, ran_fun, N_FUZZ, pos,
-                                  fast_fuzz=fast_fuzz, single_call_fuzz=single_call_fuzz)
+        scheduler = self.get_comb_scheduler(method)
+        log.info("Fuzzing budget: {} values".format(str(scheduler.budget)))
+        # the scheduler goes through the same combinations again on resume,
+        # their journaled outcomes are given back to it rather than zeros
+        journaled = self.journal.get_combs(self.fuzz_list, method) if self.is_journaled() else []
+        for pos in scheduler:
+            if journaled and tuple(journaled[0]['comb']) == pos:
+                rec = journaled.pop(0)
+                log.info("Combination {} fuzzed in a previous run".format(str(pos)))
+                scheduler.record(pos, rec['fuzzed'], rec['windows'], rec['crashes'])
+                fuzzed = rec['ran']
+            else:
+                journaled = []
+                if scheduler.is_retry(pos) and self.is_journaled():
+                    # fuzzed already in this run: the journal would skip it
+                    self.journal.record_retry(self.fuzz_list, method, pos)
+                fuzzed = self.fuzz_param_combination(method, pos, ran_fun, fast_fuzz=fast_fuzz,
+                                                     single_call_fuzz=single_call_fuzz, n_fuzz=scheduler.round_size)
+                scheduler.record(pos, self.unit_stats['fuzzed'], self.unit_stats['windows'],
+                                 self.unit_stats['crashes'])
+                if self.is_journaled():
+                    self.journal.record_comb(self.fuzz_list, method, pos, fuzzed, self.unit_stats['fuzzed'],
+                                             self.unit_stats['windows'], self.unit_stats['crashes'])
             if not fuzzed:
                 log.debug("Reran finished and sweet spot was not encoutered.")
                 break
             log.info("Param fuzzed")
 
     # FIXME: handle single_call_fuzz and curr_call
-    def do_fuzz_class_fields(self, method, ran_fun, fast_fuzz=False, single_call_fuzz=False):
+    def do_fuzz_class_fields(self, method, ran_fun, fast_fuzz=False, single_call_fuzz=False, n_fuzz=N_FUZZ):
         # if methods take no argument, we will fuzz
         # every simple objects in its class
         cls = method[0]
         class_fields = self.get_class_fields(cls)
+        # outcome of all the fields
+        totals = {'fuzzed': 0, 'windows': 0, 'crashes': 0}
 
         if not fast_fuzz:
             log.info("Fuzzing might take a while, fast_fuzz is disabled."
@@ -464,12 +783,15 @@ class ArgFuzzer:
                 log.error("Field {} is not of a primitive type.. skipping this one. Implement me.".format(fname))
                 continue
 
-            fuzzed = self.do_fuzz(method, self.spawn_and_fuzz_class_field, ran_fun, fname,
-                            ftype_info, N_FUZZ, fast_fuzz=fast_fuzz)
+            fuzzed = self.do_fuzz(method, self.spawn_and_fuzz_class_field, ran_fun, n_fuzz, fname,
+                                  ftype_info, fast_fuzz=fast_fuzz)
+            for k in totals:
+                totals[k] += self.unit_stats[k]
             if not fuzzed:
                 log.debug("Reran finished and sweet spot was not encoutered.")
                 break
             log.info("Object fuzzed")
+        self.unit_stats = totals
 
     def register_normal_run(self, ran_fun):
         #self.an.start_normal_run()
@@ -478,29 +800,65 @@ class ArgFuzzer:
         #    log.error("Can't save pcap files to verify fuzzing results")
         pass
 
-    def get_res_complete_path(self, method):
+    def get_method_string(self, method):
         s_params = '_'.join(map(str, method[2]))
         m_string = '_'.join([str(method[0]), str(method[1]),s_params, str(method[3])]).replace('u\'', '')
-        m_string = m_string.replace('[]', '_array')
-        return self.fuzz_res_dir + FUZZ_RES_FILE_NAME.format(m_string)
+        return m_string.replace('[]', '_array')
 
-    def start(self, method, fast_fuzz=False, ran_fun=lambda *args: None, reg_run=True, single_call_fuzz=False, lifter=None):
-        self.lifter = lifter
+    def get_res_complete_path(self, method):
+        return self.fuzz_res_dir + FUZZ_RES_FILE_NAME.format(self.get_method_string(method))
 
+    def open_results(self, method):
         name = self.get_res_complete_path(method)
 
         counter = 1
         while os.path.isfile(name):
             name = '_'.join(name.split('_')[:-1]) + '_' + str(counter)
             counter += 1
-        self.fp = open(name, "w")
-
-        if reg_run:
-            self.register_normal_run(ran_fun)
+        self.fp = TraceWriter(name, method)
+        self.window_id = 0
 
         # start new fuzzing
         self.fuzz_history = {}
-        self.fp.write("\n*** Method: {}\n ***".format(str(method)))
+
+    def fuzz_unit(self, method, unit, ran_fun=lambda *args: None, fast_fuzz=False, single_call_fuzz=False,
+                  lifter=None, fuzz_list=None, n_fuzz=N_FUZZ):
+        # fuzz a single unit returned by get_fuzz_units, with n_fuzz values
+        # (per field for the class fields). Returns whether the method was
+        # reached, how many values were fuzzed and the window stats of the method
+        self.lifter = lifter
+        self.fuzz_list = fuzz_list
+        key = str(method)
+        before = self.fuzz_counts.get(key, 0)
+        fuzzed = True
+
+        self.open_results(method)
+        try:
+            if unit is None:
+                self.do_fuzz_class_fields(method, ran_fun, fast_fuzz=fast_fuzz, single_call_fuzz=single_call_fuzz,
+                                          n_fuzz=n_fuzz)
+            else:
+                fuzzed = self.fuzz_param_combination(method, unit, ran_fun, fast_fuzz=fast_fuzz,
+                                                     single_call_fuzz=single_call_fuzz, n_fuzz=n_fuzz)
+        except FuzzTerminate as ft:
+            log.info("Fuzz terminate")
+
+        self.fp.close()
+        return fuzzed, self.fuzz_counts.get(key, 0) - before, self.get_window_stats().get(key)
+
+    def start(self, method, fast_fuzz=False, ran_fun=lambda *args: None, reg_run=True, single_call_fuzz=False, lifter=None,
+              fuzz_list=None):
+        self.lifter = lifter
+        self.fuzz_list = fuzz_list
+
+        if self.is_journaled() and self.journal.is_done(fuzz_list, method):
+            log.info("Method {} already fuzzed in a previous run, skipping it".format(str(method)))
+            return
+
+        self.open_results(method)
+
+        if reg_run:
+            self.register_normal_run(ran_fun)
 
         try:
             params = method[2]
@@ -511,6 +869,8 @@ class ArgFuzzer:
             if self.fuzz_class_fields:
                 log.info("Fuzzing class fields")
                 self.do_fuzz_class_fields(method, ran_fun, fast_fuzz=fast_fuzz, single_call_fuzz=single_call_fuzz)
+            if self.is_journaled():
+                self.journal.record_done(fuzz_list, method)
         except FuzzTerminate as ft:
             log.info("Fuzz terminate")
 
@@ -519,22 +879,43 @@ class ArgFuzzer:
 
     def replay_trace(self, trace_file, fast_fuzz=False, ran_fun=lambda *args: None):
         self.replaying = True
-        self.parse_trace_file(trace_file)
-        # debug data structure
-
-        for s_method, r_info in self.traces.iteritems():
-            # extract method info from string
-            cls = s_method.split(', ')[0][1:].strip('\'')
-            m = s_method.split(', ')[1].strip('\'')
-            s_params = s_method.split(', [\'')[1].split('], \'')[0]
-            params = map(lambda x: x.strip('\''), s_params.split(', '))
-            ret = s_method.split(', ')[-1][:-1].strip('\'')
-            method = [cls, m, params, ret]
-
-            for comb, c_info in r_info.iteritems():
-                self.pos_trace = 0
-                times = len(c_info.values()[0])
-                self.do_fuzz(method, self.spawn_and_replay_param, ran_fun, times, comb, fast_fuzz=fast_fuzz)
+        try:
+            if is_trace_file(trace_file):
+                reader = TraceReader(trace_file)
+                try:
+                    method = reader.method
+                    for comb in reader.combinations():
+                        if comb is None:
+                            continue
+                        # values are read from the trace as the windows consume them
+                        self.replay_stream = reader.stream(comb)
+                        self.do_fuzz(method, self.spawn_and_replay_param, ran_fun, reader.count(comb), comb,
+                                     fast_fuzz=fast_fuzz)
+                finally:
+                    reader.close()
+                return
+
+            # text results of older versions
+            self.parse_trace_file(trace_file)
+            # debug data structure
+
+            for s_method, r_info in self.traces.iteritems():
+                # extract method info from string
+                cls = s_method.split(', ')[0][1:].strip('\'')
+                m = s_method.split(', ')[1].strip('\'')
+                s_params = s_method.split(', [\'')[1].split('], \'')[0]
+                params = map(lambda x: x.strip('\''), s_params.split(', '))
+                ret = s_method.split(', ')[-1][:-1].strip('\'')
+                method = [cls, m, params, ret]
+
+                for comb, c_info in r_info.iteritems():
+                    self.replay_stream = ReplayStream({pos: iter(vals) for pos, vals in c_info.items()})
+                    times = len(c_info.values()[0])
+                    self.do_fuzz(method, self.spawn_and_replay_param, ran_fun, times, comb, fast_fuzz=fast_fuzz)
+        finally:
+            # back to fuzzing, with the journal and dedup
+            self.replay_stream = None
+            self.replaying = False
 
 if __name__ == "__main__":
     from ui.core import ADBDriver
@@ -592,9 +973,7 @@ if __name__ == "__main__":
 
     if options.lifter:
         print "Building lifter"
-        apk_path = config["apk_path"]
-        android_sdk = config["android_sdk_platforms"]
-        lifter = Lifter(apk_path, input_format="apk", android_sdk=android_sdk)
+        lifter = get_lifter(config)
 
     if trace_file:
         af.replay_trace(trace_file, ran_fun=adbd.replay_ui_async)
@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import pickle
+import logging
+import functools
+from pcapreader.pcapreader import map_pcaps
+
+logging.basicConfig()
+log = logging.getLogger("FmtCache")
+log.setLevel(logging.DEBUG)
+
+FMT_CACHE_DIR = "/tmp/fmt_cache"
+INDEX_NAME = 'index.json'
+# bump when the extraction changes, so that cached entries are parsed again
+FMT_CACHE_VERSION = 3
+READ_CHUNK = 1 << 20
+# what FormattedValues extracts
+FMT_DATA = 'fmt'
+
+# entries already loaded by this process, by cache key
+_entries = {}
+
+
+class FmtCache:
+    """
+    Format strings and parameter values extracted from pcaps, cached on disk
+    per capture and per device IP. A capture is identified by its SHA-256,
+    which an index keeps by path, size and modification time: only new or
+    changed captures are hashed and parsed again.
+    """
+    def __init__(self, cache_dir=FMT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, INDEX_NAME)
+        self.index = self.load_index()
+        self.dirty = False
+
+    def load_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as fp:
+                return json.load(fp)
+        except Exception as e:
+            log.warning("Pcap index {} unusable: {}".format(self.index_path, str(e)))
+            return {}
+
+    def save_index(self):
+        if not self.dirty:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp = '{}.{}.tmp'.format(self.index_path, os.getpid())
+            with open(tmp, 'w') as fp:
+                json.dump(self.index, fp)
+            os.rename(tmp, self.index_path)
+            self.dirty = False
+        except Exception as e:
+            log.warning("Could not save the pcap index: " + str(e))
+
+    def digest(self, pcap_path):
+        pcap_path = os.path.abspath(pcap_path)
+        st = os.stat(pcap_path)
+        stamp = [st.st_size, st.st_mtime]
+        entry = self.index.get(pcap_path)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+
+        h = hashlib.sha256()
+        with open(pcap_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(READ_CHUNK), b''):
+                h.update(chunk)
+        self.index[pcap_path] = stamp + [h.hexdigest()]
+        self.dirty = True
+        return h.hexdigest()
+
+    def key(self, pcap_path, device_ip, name=FMT_DATA):
+        # name tells apart what different extract functions get from the same pcap
+        variant = hashlib.sha256('{}:{}:{}'.format(name, device_ip, FMT_CACHE_VERSION)).hexdigest()[:16]
+        return '{}_{}'.format(self.digest(pcap_path), variant)
+
+    def load(self, key):
+        if key in _entries:
+            return _entries[key]
+        path = os.path.join(self.cache_dir, key + '.pk')
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as fp:
+                data = pickle.load(fp)
+        except Exception as e:
+            log.warning("Pcap cache {} unusable: {}".format(path, str(e)))
+            return None
+        _entries[key] = data
+        return data
+
+    def store(self, key, data):
+        _entries[key] = data
+        path = os.path.join(self.cache_dir, key + '.pk')
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'wb') as fp:
+                pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except Exception as e:
+            log.warning("Could not cache {}: {}".format(path, str(e)))
+
+    def get(self, pcap_path, device_ip, extract, name=FMT_DATA):
+        # what extract(pcap_path, device_ip) returns, parsing the pcap only on a miss
+        return self.get_all([pcap_path], device_ip, extract, processes=1, name=name)[0][1]
+
+    def get_all(self, pcap_paths, device_ip, extract, processes=None, name=FMT_DATA):
+        # [(pcap_path, extract(pcap_path, device_ip))] in the order of the
+        # sorted paths. The captures missing from the cache are parsed in a
+        # pool of processes; extract must be picklable
+        keys = {path: self.key(path, device_ip, name) for path in pcap_paths}
+        results = {}
+        missing = []
+        for path in pcap_paths:
+            data = self.load(keys[path])
+            if data is None:
+                missing.append(path)
+            else:
+                results[path] = data
+
+        if missing:
+            log.info("Parsing {} pcaps".format(len(missing)))
+            for path, data in map_pcaps(functools.partial(extract, device_ip=device_ip), missing, processes):
+                self.store(keys[path], data)
+                results[path] = data
+        return [(path, results[path]) for path in sorted(pcap_paths)]
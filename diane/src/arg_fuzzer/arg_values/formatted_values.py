@@ -4,10 +4,91 @@ import random
 import os
 from random_values import RandomValues
 from pcapreader.pcapreader import PcapReader
+from fmt_cache import FmtCache, FMT_CACHE_DIR
 # from keyhunter.key_hunter import KeyHunter
 
 OPEN_PLACEHOLDER = '<<-<<'
 CLOSE_PLACEHOLDER = '>>->>'
+PLACEHOLDER_RE = re.compile('(' + OPEN_PLACEHOLDER + "(?:[ -~]*?)" + CLOSE_PLACEHOLDER + ')')
+
+
+def replace_hex_chars(s):
+    to_conv = list(set(re.findall('\\\\x[0-9A-Fa-f][0-9A-Fa-f]?', s)))
+    for elem in to_conv:
+        c = chr(int(elem.replace('\\x', ''), 16))
+        s = s.replace(elem, c)
+    return s
+
+
+def extract_fmt_data(pcap_file, device_ip):
+    # format strings of the HTTP requests sent to the device in a pcap, and
+    # the (placeholder, value) pairs of their parameters, in order
+    fmt_strs = []
+    params = []
+    reader = PcapReader(pcap_file)
+    for p in reader.get_http_packets():
+        if p.dst != device_ip:
+            # we are only interested in traffic
+            # generate for the device
+            continue
+
+        if p.method == 'GET':
+            # take the URI and extract the parameter values
+            # creating a single format string
+            tmp_uri = p.uri
+            for k, v in p.get_parameters().items():
+                par_key = OPEN_PLACEHOLDER + str(k) + CLOSE_PLACEHOLDER
+                s = tmp_uri.find(k + '=') + len(k) + 1
+                e = s + len(v)
+                tmp_uri = tmp_uri[:s] + par_key + tmp_uri[e:]
+                params.append((par_key, v))
+            fmt_strs.append(tmp_uri)
+
+        elif p.method == 'POST':
+            # post bodies might have a recursive structure.
+            # Therefore, we have to add a format string for
+            # each parameter (differently from the get method)
+            p.body = replace_hex_chars(p.body)
+            for k, v in p.get_parameters().items():
+                if not isinstance(v, basestring):
+                    # nested JSON values: StructuredValues mutates those bodies
+                    continue
+                # FIXME: handle CDATA[]
+                v = replace_hex_chars(v.encode('utf-8') if isinstance(v, unicode) else v)
+                if isinstance(k, tuple):
+                    # XML: (open tag, close tag) around the value
+                    s = p.body.find(k[0]) + len(k[0])
+                    e = p.body.find(k[1])
+                else:
+                    # JSON or url-encoded: the value follows its key
+                    k = k.encode('utf-8') if isinstance(k, unicode) else k
+                    key = json.dumps(k) if p.content_type == p.CONTENT_TYPE_JSON else k + '='
+                    s = p.body.find(key)
+                    s = p.body.find(v, s + len(key)) if s >= 0 else -1
+                    e = s + len(v)
+                if s < 0 or e < s:
+                    continue
+                par_key = OPEN_PLACEHOLDER + str(k) + CLOSE_PLACEHOLDER
+                tmp_body = p.body[:s] + par_key + p.body[e:]
+                params.append((par_key, v))
+                fmt_strs.append(tmp_body)
+    return fmt_strs, params
+
+
+class FormatTemplate:
+    """
+    A format string parsed once into literal segments and placeholder slots.
+    pars lists the placeholders in order of appearance, repeated ones included.
+    """
+    def __init__(self, fmt_str):
+        parts = PLACEHOLDER_RE.split(fmt_str)
+        self.pars = parts[1::2]
+        # the literals joined by %s, so that rendering is a single formatting
+        self.fmt = '%s'.join([lit.replace('%', '%%') for lit in parts[0::2]])
+
+    def render(self, vals):
+        # vals: placeholder -> value, every occurrence gets the same value
+        return self.fmt % tuple([vals[k] for k in self.pars])
 
 
 class FormattedValues:
@@ -19,66 +100,32 @@ class FormattedValues:
         self.device_ip = config['device_ip']
         self.fmt_data_keys = []
         self.params = {}
+        self.templates = []
         self.current_fmt_str = None
+        self.current_template = None
         self.par_to_replace = 0
         self.current_fmt_idx = 0
         self.populate_fmt_data(config)
 
     def replace_hex_chars(self, s):
-        to_conv = list(set(re.findall('\\\\x[0-9A-Fa-f][0-9A-Fa-f]?', s)))
-        for elem in to_conv:
-            c = chr(int(elem.replace('\\x', ''), 16))
-            s = s.replace(elem, c)
-        return s
+        return replace_hex_chars(s)
 
     def populate_fmt_data(self, config):
         if 'pcap_path' not in config:
             return
 
         pcap_dir = config['pcap_path']
-        for pcap_file in os.listdir(pcap_dir):
-            if not pcap_file.endswith('.pcap'):
-                continue
-
-            pcap_file = pcap_dir + '/' + pcap_file
-            reader = PcapReader(pcap_file)
-            for p in reader.get_http_packets():
-                if p.dst != self.device_ip:
-                    # we are only interested in traffic
-                    # generate for the device
-                    continue
-
-                if p.method == 'GET':
-                    # take the URI and extract the parameter values
-                    # creating a single format string
-                    params = p.get_parameters()
-                    tmp_uri = p.uri
-                    for k, v in params.items():
-                        par_key = OPEN_PLACEHOLDER + str(k) + CLOSE_PLACEHOLDER
-                        s = tmp_uri.find(k + '=') + len(k) + 1
-                        e = s + len(v)
-                        tmp_uri = tmp_uri[:s] + par_key + tmp_uri[e:]
-                        if par_key not in self.params:
-                            self.params[par_key] = []
-                        self.params[par_key].append(v)
-                    self.fmt_strs.append(tmp_uri)
-
-                elif p.method == 'POST':
-                    # post bodies might have a recursive structure.
-                    # Therefore, we have to add a format string for
-                    # each parameter (differently from the get method)
-                    p.body = self.replace_hex_chars(p.body)
-                    for k, v in p.get_parameters().items():
-                        # FIXME: handle CDATA[]
-                        v = self.replace_hex_chars(v)
-                        par_key = OPEN_PLACEHOLDER + str(k) + CLOSE_PLACEHOLDER
-                        s = p.body.find(k[0]) + len(k[0])
-                        e = p.body.find(k[1])
-                        tmp_body = p.body[:s] + par_key + p.body[e:]
-                        if par_key not in self.params:
-                            self.params[par_key] = []
-                        self.params[par_key].append(v)
-                        self.fmt_strs.append(tmp_body)
+        pcap_files = [pcap_dir + '/' + f for f in os.listdir(pcap_dir) if f.endswith('.pcap')]
+        cache = FmtCache(config.get('fmt_cache_dir', FMT_CACHE_DIR))
+        # merged in the order of the file names, the same on every run
+        extracted = cache.get_all(pcap_files, self.device_ip, extract_fmt_data, config.get('pcap_workers'))
+        for _, (fmt_strs, params) in extracted:
+            self.fmt_strs += fmt_strs
+            for par_key, v in params:
+                if par_key not in self.params:
+                    self.params[par_key] = []
+                self.params[par_key].append(v)
+        cache.save_index()
 
         # get additional data key from firmware, if present
         if 'fmt_data_keys' in config:
@@ -89,23 +136,28 @@ class FormattedValues:
         #         kh = KeyHunter(fw_dir, pcap_dir)
         #         self.fmt_data_keys = kh.get_potential_keywords()
 
+        self.templates = [FormatTemplate(fmt_str) for fmt_str in self.fmt_strs]
         self.current_fmt_str = self.fmt_strs[0] if self.fmt_strs else None
+        self.current_template = self.templates[0] if self.templates else None
 
     def next_fmt_string(self):
         self.par_to_replace = 0
         self.current_fmt_idx = (self.current_fmt_idx + 1) % len(self.fmt_strs)
         self.current_fmt_str = self.fmt_strs[self.current_fmt_idx]
+        self.current_template = self.templates[self.current_fmt_idx]
 
     def fuzz_java_lang_String(self, obj_creator, *kargs, **kwargs):
         if self.current_fmt_str is None:
             return None
 
-        pars = re.findall(OPEN_PLACEHOLDER + "(?:[ -~]*?)" + CLOSE_PLACEHOLDER, self.current_fmt_str)
-        final_str = self.current_fmt_str
+        pars = self.current_template.pars
+        vals = {}
         for i, k in enumerate(pars):
             # FIXME: default argument in rv
             val = random.choice(self.params[k]) if i != self.par_to_replace else self.rv.fuzz_java_lang_String(lambda *x, **y: None)
-            final_str = final_str.replace(k, val)
+            # a repeated placeholder keeps the value of its first occurrence
+            vals.setdefault(k, val)
+        final_str = self.current_template.render(vals)
         obj_creator('java.lang.String', False, final_str, 1, *kargs, **kwargs)
         self.par_to_replace += 1
         if self.par_to_replace >= len(pars):
@@ -116,7 +168,7 @@ class FormattedValues:
         s = self.fuzz_java_lang_String(lambda *a, **b: None)
         if s is None:
             return None
-        val = [int(elem.encode("hex"), 16) for elem in s]
+        val = bytearray(s.encode('latin-1') if isinstance(s, unicode) else s)
         if obj_creator is not None:
             obj_creator('byte', True, val, len(val), *kargs, **kwargs)
         return val
@@ -7,13 +7,22 @@ import subprocess
 from os.path import dirname, abspath
 sys.path.append(dirname(dirname(abspath(__file__))))
 
-from pcapreader.pcapreader import PcapReader
+from pcapreader.pcapreader import PcapReader, map_pcaps
 
 
 all_function_parameters_at_all_callsites = []
 all_strings_addr_len = []
 
 
+def get_pcap_keywords(pcap_file):
+    keywords = set()
+    pcap_reader = PcapReader(pcap_file)
+    for http_pkt in pcap_reader.get_http_packets():
+        # HTML arguments
+        keywords = keywords.union(set(http_pkt.get_parameters().keys()))
+    return keywords
+
+
 class LogFilter(object):
     def __init__(self, min_level, max_level):
         self.min_level = min_level
@@ -65,14 +74,9 @@ class KeyHunter:
     def _get_keywords_from_pcap(self):
         keywords_from_pcap = set()
         pcap_files = get_files_from_dir(self.pcap_dir, '*.pcap')
-        all_packets = None
-        for pcap_file in pcap_files:
-            pcap_reader = PcapReader(pcap_file)
-            for http_pkt in pcap_reader.get_http_packets():
-                # HTML arguments
-                parameters_from_http_packet = http_pkt.get_parameters()
-                keywords_from_http_packet = set(parameters_from_http_packet.keys())
-                keywords_from_pcap = keywords_from_pcap.union(keywords_from_http_packet)
+        # the captures are read in a pool of processes
+        for pcap_file, keywords_from_file in map_pcaps(get_pcap_keywords, pcap_files):
+            keywords_from_pcap = keywords_from_pcap.union(keywords_from_file)
             self.logger.info('Extracted keywords from %s pcap' % pcap_file)
 
             self.logger.info('Potential keywords in pcap %s: %s' % (pcap_file, str(keywords_from_pcap)))
@@ -1,5 +1,6 @@
 import json
 import re
+import zlib
 import urllib
 
 
@@ -177,6 +178,76 @@ class HttpPacket():
             self.content_type = raw_content_type
 
 
+class DpktHttpPacket(HttpPacket):
+    """
+    An HTTP message reassembled by PcapReader from a TCP stream and parsed by
+    dpkt, with the fields HttpPacket reads from the tshark dissection.
+    """
+    def __init__(self, msg, src, dst, sport, dport):
+        self.sport = str(sport)
+        self.dport = str(dport)
+        self.src = src
+        self.dst = dst
+        self.raw_pkt = msg
+        self.method = self.METHOD_UNKNOWN
+        self.type = self.TYPE_UNKNOWN
+        self.content_type = self.CONTENT_TYPE_UNKNOWN
+        self.query = ""
+        self.body = ""
+        self.response_code = 0
+
+        if 'content-type' in msg.headers:
+            self._set_content_type(header_value(msg.headers, 'content-type'))
+
+        body = decoded_body(msg)
+        if body:
+            self.body = urllib.unquote(body)
+
+        if hasattr(msg, 'method'):
+            self.type = self.TYPE_REQUEST
+            self.method = msg.method
+            if msg.uri.startswith('http://') or msg.uri.startswith('https://'):
+                self.uri = msg.uri
+            else:
+                self.uri = 'http://' + (header_value(msg.headers, 'host') or dst) + msg.uri
+            # as tshark request_uri_path and request_uri_query
+            path, sep, query = msg.uri.partition('?')
+            self.path = path
+
+            if self.method == self.METHOD_GET and sep:
+                self.query = urllib.unquote(query)
+                # Same horrible fix as HttpPacket. //FIXME
+                if self.content_type == self.CONTENT_TYPE_UNKNOWN:
+                    self.content_type = self.CONTENT_TYPE_URL_ENCODED
+
+        elif hasattr(msg, 'status'):
+            self.type = self.TYPE_RESPONSE
+            self.response_code = int(msg.status)
+
+
+def header_value(headers, name):
+    # dpkt makes a list of the values of repeated headers
+    val = headers.get(name, '')
+    return val[-1] if isinstance(val, list) else val
+
+
+def decoded_body(msg):
+    # the body as tshark shows it in file_data, decompressed
+    encoding = header_value(msg.headers, 'content-encoding').lower()
+    if not msg.body or encoding not in ('gzip', 'deflate'):
+        return msg.body
+    try:
+        if encoding == 'gzip':
+            return zlib.decompress(msg.body, 16 + zlib.MAX_WBITS)
+        try:
+            return zlib.decompress(msg.body)
+        except zlib.error:
+            # raw deflate, without the zlib header
+            return zlib.decompress(msg.body, -zlib.MAX_WBITS)
+    except zlib.error:
+        return msg.body
+
+
 # TODO: remove me. I am a duplicate of zeppolina.utils.merge_dicts()
 def merge_dicts(x, y):
     z = x.copy()
@@ -1,19 +1,246 @@
-import pyshark
+import socket
+import multiprocessing
+from io import BytesIO
+from collections import OrderedDict
+
+import dpkt
 
 import http
 
+# link types of the captures, see pcap-linktype(7)
+DLT_NULL = 0
+DLT_EN10MB = 1
+DLT_RAW = (12, 14, 101)
+DLT_LINUX_SLL = 113
+
+HTTP_METHODS = ('GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS', 'PATCH', 'TRACE', 'CONNECT')
+HEADER_END = '\r\n\r\n'
+# longest request line start that must show an HTTP method
+METHOD_PREFIX = 8
+SEQ_MOD = 1 << 32
+
+
+def map_pcaps(fun, pcap_files, processes=None):
+    # [(pcap_file, fun(pcap_file))] in the order of the sorted paths, whatever
+    # order the workers of the pool finish in. fun must be picklable
+    pcap_files = sorted(pcap_files)
+    processes = min(processes or multiprocessing.cpu_count(), len(pcap_files))
+    if processes <= 1 or multiprocessing.current_process().daemon:
+        # daemonic processes, e.g. the DevicePool workers, cannot have children
+        return [(f, fun(f)) for f in pcap_files]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return zip(pcap_files, pool.map(fun, pcap_files, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def open_capture(fp):
+    try:
+        return dpkt.pcap.Reader(fp)
+    except ValueError:
+        fp.seek(0)
+        return dpkt.pcapng.Reader(fp)
+
+
+def ip_packet(link_type, buf):
+    # the IP packet of a frame, None if it carries none
+    try:
+        if link_type == DLT_EN10MB:
+            ip = dpkt.ethernet.Ethernet(buf).data
+        elif link_type == DLT_LINUX_SLL:
+            ip = dpkt.sll.SLL(buf).data
+        elif link_type == DLT_NULL:
+            ip = dpkt.loopback.Loopback(buf).data
+        elif link_type in DLT_RAW and buf:
+            ip = dpkt.ip6.IP6(buf) if ord(buf[0]) >> 4 == 6 else dpkt.ip.IP(buf)
+        else:
+            return None
+    except (dpkt.UnpackError, dpkt.NeedData):
+        return None
+    return ip if isinstance(ip, (dpkt.ip.IP, dpkt.ip6.IP6)) else None
+
+
+def ip_to_str(ip, addr):
+    if isinstance(ip, dpkt.ip6.IP6):
+        return socket.inet_ntop(socket.AF_INET6, addr)
+    return socket.inet_ntoa(addr)
+
+
+def looks_like_http(buf):
+    if buf.startswith('HTTP/'):
+        return True
+    head = buf[:METHOD_PREFIX + 1]
+    if ' ' not in head:
+        # too short to tell
+        return len(head) <= METHOD_PREFIX and any([m.startswith(head) for m in HTTP_METHODS + ('HTTP/',)])
+    return head.split(' ', 1)[0] in HTTP_METHODS
+
+
+def parse_message(buf, final=False):
+    # (dpkt message, bytes it takes) or, if it is not complete yet, (None,
+    # bytes needed). Raises dpkt.UnpackError if buf does not start with HTTP
+    if not looks_like_http(buf):
+        raise dpkt.UnpackError('not HTTP')
+    hdr_end = buf.find(HEADER_END)
+    if hdr_end < 0:
+        return None, len(buf) + 1
+    hdr_end += len(HEADER_END)
+
+    f = BytesIO(buf[:hdr_end])
+    start = f.readline()
+    headers = dpkt.http.parse_headers(f)
+    is_response = start.startswith('HTTP/')
+    cls = dpkt.http.Response if is_response else dpkt.http.Request
+
+    if http.header_value(headers, 'transfer-encoding').lower() == 'chunked':
+        try:
+            msg = cls(buf)
+        except dpkt.NeedData:
+            return None, len(buf) + 1
+        return msg, len(buf) - len(msg.data)
+
+    if 'content-length' in headers:
+        try:
+            end = hdr_end + int(http.header_value(headers, 'content-length'))
+        except ValueError:
+            raise dpkt.UnpackError('invalid content length')
+        if len(buf) < end:
+            return None, end
+        return cls(buf[:end]), end
+
+    status = start.split(None, 2)[1] if is_response and len(start.split()) > 1 else ''
+    if not is_response or not status.isdigit() or int(status) < 200 or int(status) in (204, 304):
+        # no body
+        return cls(buf[:hdr_end]), hdr_end
+    if not final:
+        # the body ends with the connection
+        return None, len(buf) + 1
+    msg = cls(buf[:hdr_end])
+    msg.body = buf[hdr_end:]
+    return msg, len(buf)
+
+
+class TcpStream:
+    """
+    One direction of a TCP connection, reassembled in sequence order, and
+    the HTTP messages it carries.
+    """
+    def __init__(self, src, dst, sport, dport):
+        self.src = src
+        self.dst = dst
+        self.sport = sport
+        self.dport = dport
+        self.next_seq = None
+        # seq -> data of the segments received ahead of next_seq
+        self.pending = {}
+        self.chunks = []
+        self.size = 0
+        # bytes to have before trying to parse a message again
+        self.need = 0
+        self.fin = False
+        self.is_http = True
+
+    @property
+    def closed(self):
+        return self.fin and not self.pending
+
+    def add(self, tcp):
+        if tcp.flags & dpkt.tcp.TH_SYN:
+            self.next_seq = (tcp.seq + 1) % SEQ_MOD
+        elif self.next_seq is None:
+            # connection started before the capture
+            self.next_seq = tcp.seq
+        if tcp.flags & (dpkt.tcp.TH_FIN | dpkt.tcp.TH_RST):
+            self.fin = True
+        if not tcp.data or not self.is_http:
+            return
+
+        seq = tcp.seq if not tcp.flags & dpkt.tcp.TH_SYN else (tcp.seq + 1) % SEQ_MOD
+        if len(tcp.data) > len(self.pending.get(seq, '')):
+            self.pending[seq] = tcp.data
+        progressed = True
+        while progressed and self.pending:
+            progressed = False
+            for seq in list(self.pending):
+                # bytes of the segment already received, if it does not start ahead
+                done = (self.next_seq - seq) % SEQ_MOD
+                if done >= SEQ_MOD / 2:
+                    continue
+                data = self.pending.pop(seq)
+                if done < len(data):
+                    self.chunks.append(data[done:])
+                    self.size += len(data) - done
+                    self.next_seq = (self.next_seq + len(data) - done) % SEQ_MOD
+                progressed = True
+
+    def data(self):
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks[0] if self.chunks else ''
+
+    def http_packets(self, final=False):
+        # the HTTP messages completed by the data received so far; final
+        # when the stream is over
+        packets = []
+        while self.is_http and self.size and (self.size >= self.need or final):
+            buf = self.data()
+            try:
+                msg, used = parse_message(buf, final)
+            except (dpkt.UnpackError, dpkt.NeedData):
+                self.is_http = False
+                self.chunks = []
+                self.size = 0
+                break
+            if msg is None:
+                self.need = used
+                break
+            packets.append(http.DpktHttpPacket(msg, self.src, self.dst, self.sport, self.dport))
+            self.chunks = [buf[used:]] if used < len(buf) else []
+            self.size = len(buf) - used
+            self.need = 0
+        return packets
+
 
 class PcapReader():
+    """
+    HTTP messages of a capture. The TCP streams are reassembled with dpkt
+    while the capture is read, and every message is parsed once complete.
+    """
     def __init__(self, pcapfile):
         self.pcapfile = pcapfile
-        self.packets = pyshark.FileCapture(pcapfile)
         self.http_packets = []
 
+    def iter_http_packets(self):
+        streams = OrderedDict()
+        with open(self.pcapfile, 'rb') as fp:
+            reader = open_capture(fp)
+            link_type = reader.datalink()
+            for ts, buf in reader:
+                ip = ip_packet(link_type, buf)
+                if ip is None or not isinstance(ip.data, dpkt.tcp.TCP):
+                    continue
+                tcp = ip.data
+                key = (ip.src, ip.dst, tcp.sport, tcp.dport)
+                stream = streams.get(key)
+                if stream is None:
+                    stream = TcpStream(ip_to_str(ip, ip.src), ip_to_str(ip, ip.dst), tcp.sport, tcp.dport)
+                    streams[key] = stream
+                stream.add(tcp)
+                for pkt in stream.http_packets(final=stream.closed):
+                    yield pkt
+                if stream.closed:
+                    del streams[key]
+
+        # connections still open at the end of the capture
+        for stream in streams.values():
+            for pkt in stream.http_packets(final=True):
+                yield pkt
+
     def get_http_packets(self):
         if not self.http_packets:
-            for pkt in self.packets:
-                if "HTTP" in str(pkt.layers):
-                    self.http_packets.append(http.HttpPacket(pkt))
+            self.http_packets = list(self.iter_http_packets())
         return self.http_packets
 
     def get_http_responses(self):
@@ -36,4 +263,20 @@ class PcapReader():
             if pkt.is_request():
                 ret_lst.append(pkt)
 
-        return ret_lst
\ No newline at end of file
+        return ret_lst
+
+
+class PysharkPcapReader(PcapReader):
+    """
+    The HTTP messages of a capture as tshark dissects them, through pyshark.
+    Much slower than PcapReader, it also knows the protocols tshark does.
+    """
+    def __init__(self, pcapfile):
+        import pyshark
+        PcapReader.__init__(self, pcapfile)
+        self.packets = pyshark.FileCapture(pcapfile)
+
+    def iter_http_packets(self):
+        for pkt in self.packets:
+            if "HTTP" in str(pkt.layers):
+                yield http.HttpPacket(pkt)
@@ -5,10 +5,30 @@ import numpy
 
 MIN_INT_32 = -2147483648
 MAX_INT_32 = 2147483647
+PRINTABLE_CHARS = numpy.frombuffer(string.ascii_uppercase + string.digits, dtype=numpy.uint8)
+# tables whose arrays are generated as raw bytes
+BYTE_TABLES = ('byte', 'java.nio.ByteBuffer')
+
+# fuzz function name -> (value table, array, primitive), as passed to RandomValues.fuzz_type
+FUZZ_FUNCTIONS = {
+    'fuzz_int': ('int', False, True),
+    'fuzz_long': ('long', False, True),
+    'fuzz_float': ('float', False, True),
+    'fuzz_double': ('float', False, True),
+    'fuzz_boolean': ('boolean', False, True),
+    'fuzz_byte': ('byte', False, True),
+    'fuzz_byte_array': ('byte', True, True),
+    'fuzz_int_array': ('int', True, True),
+    'fuzz_java_lang_String': ('java.lang.String', False, False),
+    'fuzz_java_lang_Integer': ('java.lang.Integer', False, False),
+    'fuzz_java_lang_Float': ('java.lang.Float', False, False),
+    'fuzz_java_nio_ByteBuffer': ('java.nio.ByteBuffer', True, True),
+}
 
 
 class RandomValues:
     def __init__(self, *args, **kwargs):
+        self.rng = random
         self.proposed_vals = {
             'int': {
                 'fun': [self.low_pos, self.low_neg, self.null, self.big_pos, self.big_neg],
@@ -57,38 +77,46 @@ class RandomValues:
             }
         }
 
+    def pick(self, type_obj):
+        return numpy.random.choice(self.proposed_vals[type_obj]['fun'], p=self.proposed_vals[type_obj]['dist'])
+
+    def get_value_tables(self):
+        # kinds are shipped by name so that the agent can rebuild the same tables
+        return {k: {'fun': [f.__name__ for f in v['fun']], 'dist': v['dist']}
+                for k, v in self.proposed_vals.items()}
+
     def low_pos_array(self):
-        return random.randint(1, 255)
+        return self.rng.randint(1, 255)
 
     def low_pos(self):
-        return random.randint(0, 255)
+        return self.rng.randint(0, 255)
 
     def low_neg(self):
-        return random.randint(-255, 0)
+        return self.rng.randint(-255, 0)
 
     def big_pos_moderate_array(self):
-        return random.randint(500, 16384)
+        return self.rng.randint(500, 16384)
 
     def big_pos_moderate(self):
-        return random.randint(500, 16384)
+        return self.rng.randint(500, 16384)
 
     def big_pos(self):
-        return random.randint(MAX_INT_32 / 2, MAX_INT_32)
+        return self.rng.randint(MAX_INT_32 / 2, MAX_INT_32)
 
     def big_neg(self):
-        return random.randint(MIN_INT_32, MIN_INT_32 / 2)
+        return self.rng.randint(MIN_INT_32, MIN_INT_32 / 2)
 
     def low_pos_float(self):
-        return random.uniform(0.0, 255.0)
+        return self.rng.uniform(0.0, 255.0)
 
     def low_neg_float(self):
-        return random.uniform(-255.0, 0.0)
+        return self.rng.uniform(-255.0, 0.0)
 
     def big_pos_float(self):
-        return random.uniform(MAX_INT_32 / 2.0, float(MAX_INT_32))
+        return self.rng.uniform(MAX_INT_32 / 2.0, float(MAX_INT_32))
 
     def big_neg_float(self):
-        return random.uniform(float(MIN_INT_32), MIN_INT_32 / 2.0)
+        return self.rng.uniform(float(MIN_INT_32), MIN_INT_32 / 2.0)
 
     def null(self):
         return 0
@@ -100,18 +128,95 @@ class RandomValues:
         return False
 
     def printable_chars(self):
-        len = numpy.random.choice(self.proposed_vals['array']['fun'], p=self.proposed_vals['array']['dist'])()
+        len = self.pick('array')()
         # FIXME: find a way to use empty strings
         len += 1
-        return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(len))
+        return ''.join(self.rng.choice(string.ascii_uppercase + string.digits) for _ in range(len))
+
+    # the same kinds, n values at a time
+    def low_pos_array_batch(self, n):
+        return numpy.random.randint(1, 256, n, dtype=numpy.int64)
+
+    def low_pos_batch(self, n):
+        return numpy.random.randint(0, 256, n, dtype=numpy.int64)
+
+    def low_neg_batch(self, n):
+        return numpy.random.randint(-255, 1, n, dtype=numpy.int64)
+
+    def big_pos_moderate_array_batch(self, n):
+        return numpy.random.randint(500, 16385, n, dtype=numpy.int64)
+
+    def big_pos_moderate_batch(self, n):
+        return numpy.random.randint(500, 16385, n, dtype=numpy.int64)
+
+    def big_pos_batch(self, n):
+        return numpy.random.randint(MAX_INT_32 / 2, MAX_INT_32 + 1, n, dtype=numpy.int64)
+
+    def big_neg_batch(self, n):
+        return numpy.random.randint(MIN_INT_32, MIN_INT_32 / 2 + 1, n, dtype=numpy.int64)
+
+    def low_pos_float_batch(self, n):
+        return numpy.random.uniform(0.0, 255.0, n)
+
+    def low_neg_float_batch(self, n):
+        return numpy.random.uniform(-255.0, 0.0, n)
+
+    def big_pos_float_batch(self, n):
+        return numpy.random.uniform(MAX_INT_32 / 2.0, float(MAX_INT_32), n)
+
+    def big_neg_float_batch(self, n):
+        return numpy.random.uniform(float(MIN_INT_32), MIN_INT_32 / 2.0, n)
+
+    def null_batch(self, n):
+        return numpy.zeros(n, dtype=numpy.int64)
+
+    def true_batch(self, n):
+        return numpy.ones(n, dtype=bool)
+
+    def false_batch(self, n):
+        return numpy.zeros(n, dtype=bool)
+
+    def printable_chars_batch(self, n):
+        lengths = self.draw('array', n) + 1
+        chars = PRINTABLE_CHARS[numpy.random.randint(0, len(PRINTABLE_CHARS), int(lengths.sum()))].tostring()
+        ends = numpy.cumsum(lengths).tolist()
+        vals = numpy.empty(n, dtype=object)
+        vals[:] = [chars[end - l:end] for end, l in zip(ends, lengths.tolist())]
+        return vals
+
+    def draw(self, type_obj, n):
+        # n values of the table type_obj: the kind of every value is drawn
+        # first, then the values of each kind at once
+        funs = self.proposed_vals[type_obj]['fun']
+        if len(funs) == 1:
+            return getattr(self, funs[0].__name__ + '_batch')(n)
+
+        kinds = numpy.random.choice(len(funs), size=n, p=self.proposed_vals[type_obj]['dist'])
+        parts = []
+        for k, f in enumerate(funs):
+            mask = kinds == k
+            parts.append((mask, getattr(self, f.__name__ + '_batch')(int(mask.sum()))))
+        vals = numpy.empty(n, dtype=numpy.result_type(*[v.dtype for _, v in parts]))
+        for mask, v in parts:
+            vals[mask] = v
+        return vals
+
+    def generate(self, type_obj, n, array=False):
+        # n values as fuzz_type draws them, as lists ready to be sent to the agent,
+        # or bytearrays for byte arrays
+        if not array:
+            return self.draw(type_obj, n).tolist()
+        lengths = self.draw('array', n)
+        flat = self.draw(type_obj, int(lengths.sum()))
+        if type_obj in BYTE_TABLES:
+            data = flat.astype(numpy.uint8).tostring()
+            ends = numpy.cumsum(lengths).tolist()
+            return [bytearray(data[start:end]) for start, end in zip([0] + ends[:-1], ends)]
+        return [a.tolist() for a in numpy.split(flat, numpy.cumsum(lengths)[:-1])]
 
     def fuzz_type(self, type_obj, obj_creator, array, primitive, *kargs, **kwargs):
-        if array:
-            n = numpy.random.choice(self.proposed_vals['array']['fun'], p=self.proposed_vals['array']['dist'])()
-            val = [numpy.random.choice(self.proposed_vals[type_obj]['fun'], p=self.proposed_vals[type_obj]['dist'])() for i in range(0, n)]
-        else:
-            n = 1
-            val = numpy.random.choice(self.proposed_vals[type_obj]['fun'], p=self.proposed_vals[type_obj]['dist'])()
+        val = self.generate(type_obj, 1, array=array)[0]
+        n = len(val) if array else 1
 
         if obj_creator is not None:
             obj_creator(type_obj, primitive, val, n, *kargs, **kwargs)
@@ -0,0 +1,75 @@
+import math
+from random_values import RandomValues, FUZZ_FUNCTIONS
+
+# Deterministic counterpart of RandomValues. object_setter.js implements the same
+# PRNG (mulberry32) and value kinds, so the agent and the host draw the very same
+# sequence from a given seed.
+
+SEED_MIX = 0x9E3779B9
+
+# the agent can draw values for every fuzz function of RandomValues
+SEEDED_FUZZ_FUNCTIONS = FUZZ_FUNCTIONS
+
+
+def imul(a, b):
+    return (a * b) & 0xffffffff
+
+
+def mix_seed(seed, pos):
+    # every parameter position gets its own stream
+    return (seed ^ imul(pos + 1, SEED_MIX)) & 0xffffffff
+
+
+class SeededRandom:
+    def __init__(self, seed):
+        self.state = seed & 0xffffffff
+
+    def random(self):
+        self.state = (self.state + 0x6D2B79F5) & 0xffffffff
+        a = self.state
+        t = imul(a ^ (a >> 15), 1 | a)
+        t = ((t + imul(t ^ (t >> 7), 61 | t)) & 0xffffffff) ^ t
+        return ((t ^ (t >> 14)) & 0xffffffff) / 4294967296.0
+
+    def randint(self, a, b):
+        a = int(math.floor(a))
+        b = int(math.floor(b))
+        return a + int(math.floor(self.random() * (b - a + 1)))
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+    def choice(self, seq):
+        return seq[int(math.floor(self.random() * len(seq)))]
+
+
+class SeededValues(RandomValues):
+    def __init__(self, seed, *args, **kwargs):
+        RandomValues.__init__(self, *args, **kwargs)
+        self.rng = SeededRandom(seed)
+
+    def pick(self, type_obj):
+        r = self.rng.random()
+        acc = 0.0
+        funs = self.proposed_vals[type_obj]['fun']
+        for f, p in zip(funs, self.proposed_vals[type_obj]['dist']):
+            acc += p
+            if r < acc:
+                return f
+        return funs[-1]
+
+    def fuzz_type(self, type_obj, obj_creator, array, primitive, *kargs, **kwargs):
+        # one value at a time, in the order the agent draws them
+        if array:
+            n = self.pick('array')()
+            val = [self.pick(type_obj)() for i in range(0, n)]
+        else:
+            n = 1
+            val = self.pick(type_obj)()
+
+        if obj_creator is not None:
+            obj_creator(type_obj, primitive, val, n, *kargs, **kwargs)
+        return val
+
+    def generate(self, type_obj, n, array=False):
+        return [self.fuzz_type(type_obj, None, array, True) for _ in range(n)]
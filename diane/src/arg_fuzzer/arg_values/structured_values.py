@@ -0,0 +1,299 @@
+import os
+import re
+import copy
+import json
+import random
+import urllib
+import logging
+import xml.etree.cElementTree as ET
+from random_values import MAX_INT_32, MIN_INT_32
+from pcapreader.http import HttpPacket
+from pcapreader.pcapreader import PcapReader
+from fmt_cache import FmtCache, FMT_CACHE_DIR
+
+logging.basicConfig()
+log = logging.getLogger("StructuredValues")
+log.setLevel(logging.DEBUG)
+
+# what StructuredValues extracts, in the pcap cache
+STRUCTURED_DATA = 'structured'
+KIND_JSON = 'json'
+KIND_FORM = 'form'
+KIND_XML = 'xml'
+
+# nesting levels a mutated body may reach
+MAX_DEPTH = 8
+MAX_MUTATIONS = 3
+MAX_STRING_LEN = 1 << 16
+
+MAX_INT_64 = (1 << 63) - 1
+MIN_INT_64 = -(1 << 63)
+INT_BOUNDARIES = [0, 1, -1, 127, 128, -128, -129, 255, 256, 32767, 32768, -32768, -32769, 65535, 65536,
+                  MAX_INT_32, MAX_INT_32 + 1, MIN_INT_32, MIN_INT_32 - 1, 1 << 32, (1 << 53) + 1,
+                  MAX_INT_64, MAX_INT_64 + 1, MIN_INT_64, MIN_INT_64 - 1]
+FLOAT_BOUNDARIES = [0.0, -0.0, 0.5, 1e-308, 5e-324, 1.7976931348623157e308, -1.7976931348623157e308,
+                    float('inf'), float('-inf')]
+LONG_LENGTHS = [256, 1024, 4096, MAX_STRING_LEN]
+# characters devices often parse or encode badly
+SPECIAL_STRINGS = ['"', "'", '\\', '<', '>', '&', '=', '%', '%s%n%x', '\x00', '\r\n', '../', '{', '[',
+                   u'\xe9', u'\u4e2d\u6587', u'\U0001f4a9', u'\ufeff', u'\u202e']
+NUMBER_RE = re.compile(r'^-?\d+(\.\d+)?([eE][-+]?\d+)?$')
+
+
+def extract_structured_bodies(pcap_file, device_ip):
+    # [(kind, prefix, body)] of the requests sent to the device in a pcap: the
+    # JSON, url-encoded and XML bodies, and the queries of GET URIs
+    bodies = []
+    reader = PcapReader(pcap_file)
+    for p in reader.get_http_packets():
+        if p.dst != device_ip or not p.is_request():
+            continue
+        if p.method == HttpPacket.METHOD_GET:
+            if '=' in p.query:
+                bodies.append((KIND_FORM, p.uri.split('?', 1)[0] + '?', p.query))
+        elif p.body:
+            if p.content_type == HttpPacket.CONTENT_TYPE_JSON:
+                bodies.append((KIND_JSON, '', p.body))
+            elif p.content_type == HttpPacket.CONTENT_TYPE_URL_ENCODED:
+                bodies.append((KIND_FORM, '', p.body))
+            elif p.content_type == HttpPacket.CONTENT_TYPE_XML:
+                bodies.append((KIND_XML, '', p.body))
+    return bodies
+
+
+class JsonObject(list):
+    # the [key, value] pairs of a JSON object, in order and with duplicates
+    def __init__(self, pairs=()):
+        list.__init__(self, [list(p) for p in pairs])
+
+
+def dump_json(val):
+    if isinstance(val, JsonObject):
+        return '{' + ', '.join([json.dumps(k, ensure_ascii=False) + ': ' + dump_json(v) for k, v in val]) + '}'
+    if isinstance(val, list):
+        return '[' + ', '.join([dump_json(v) for v in val]) + ']'
+    return json.dumps(val, ensure_ascii=False)
+
+
+def height(val):
+    # nesting levels below a JSON value
+    if isinstance(val, JsonObject):
+        return 1 + max([height(v) for _, v in val] or [0])
+    if isinstance(val, list):
+        return 1 + max([height(v) for v in val] or [0])
+    return 0
+
+
+def xml_height(elem):
+    return 1 + max([xml_height(c) for c in elem] or [0])
+
+
+class StructuredValues:
+    """
+    Strings and byte arrays mutated from the structure of the HTTP bodies
+    the app sent to the device: the JSON, url-encoded or XML tree of a body
+    is parsed and a few of its nodes are mutated by type (numbers get
+    boundaries, strings length and encoding changes, keys are dropped or
+    duplicated, values nested), so that the values still get through the
+    parser of the device.
+    """
+    def __init__(self, config):
+        self.device_ip = config['device_ip']
+        self.max_depth = config.get('structured_max_depth', MAX_DEPTH)
+        self.seeds = []
+        self.seed_idx = 0
+        self.populate_seeds(config)
+
+    def populate_seeds(self, config):
+        if 'pcap_path' not in config:
+            return
+
+        pcap_dir = config['pcap_path']
+        pcap_files = [pcap_dir + '/' + f for f in os.listdir(pcap_dir) if f.endswith('.pcap')]
+        cache = FmtCache(config.get('fmt_cache_dir', FMT_CACHE_DIR))
+        extracted = cache.get_all(pcap_files, self.device_ip, extract_structured_bodies,
+                                  config.get('pcap_workers'), name=STRUCTURED_DATA)
+        cache.save_index()
+
+        seen = set()
+        for _, bodies in extracted:
+            for seed in bodies:
+                if seed in seen:
+                    continue
+                seen.add(seed)
+                try:
+                    self.parse(*seed)
+                except Exception as e:
+                    log.debug("Skipping a {} body: {}".format(seed[0], str(e)))
+                    continue
+                self.seeds.append(seed)
+        log.info("{} bodies to mutate".format(len(self.seeds)))
+
+    # bodies
+    @staticmethod
+    def parse(kind, prefix, body):
+        if kind == KIND_JSON:
+            return json.loads(body, object_pairs_hook=JsonObject)
+        if kind == KIND_FORM:
+            if isinstance(body, str):
+                body = body.decode('utf-8', 'replace')
+            return JsonObject([p.split('=', 1) if '=' in p else [p, None] for p in body.split('&') if p])
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        return ET.fromstring(body)
+
+    @staticmethod
+    def serialize(kind, prefix, body, tree):
+        if kind == KIND_JSON:
+            return prefix + dump_json(tree)
+        if kind == KIND_FORM:
+            return prefix + '&'.join([k if v is None else k + '=' + v for k, v in tree])
+        decl = body[:body.index('?>') + 2] if body.startswith('<?xml') else ''
+        return prefix + decl + ET.tostring(tree)
+
+    # scalars
+    @staticmethod
+    def mutate_number(v):
+        op = random.randint(0, 3)
+        if op == 0:
+            return random.choice(INT_BOUNDARIES)
+        if op == 1:
+            return random.choice(FLOAT_BOUNDARIES)
+        if op == 2:
+            return v + random.choice([-1, 1])
+        return -v if v else random.choice([MAX_INT_32, MIN_INT_32])
+
+    @staticmethod
+    def mutate_string(s):
+        op = random.randint(0, 5)
+        if op == 0:
+            return ''
+        if op == 1:
+            n = random.choice(LONG_LENGTHS)
+            return ((s or 'A') * (n / max(len(s), 1) + 1))[:n]
+        if op == 2:
+            return s[:random.randint(0, len(s))]
+        if op == 3:
+            pos = random.randint(0, len(s))
+            return s[:pos] + random.choice(SPECIAL_STRINGS) + s[pos:]
+        if op == 4:
+            # percent-encoded, once or twice
+            raw = s.encode('utf-8') if isinstance(s, unicode) else s
+            enc = urllib.quote(raw, safe='')
+            return enc if random.randint(0, 1) else urllib.quote(enc, safe='')
+        # non-ASCII characters in place of ASCII ones
+        return u''.join([random.choice(SPECIAL_STRINGS[-5:]) if c.isalpha() and random.randint(0, 3) == 0
+                         else c for c in (s.decode('utf-8', 'replace') if isinstance(s, str) else s)])
+
+    def mutate_scalar(self, v):
+        # JSON scalar of any type
+        if isinstance(v, bool):
+            return random.choice([not v, int(v), str(v).lower(), None])
+        if v is None:
+            return random.choice([0, '', False, [], JsonObject()])
+        if isinstance(v, (int, long, float)):
+            return self.mutate_number(v)
+        return self.mutate_text(v)
+
+    def mutate_text(self, s):
+        # text that may hold a number, as form values and XML texts do
+        if s is not None and NUMBER_RE.match(s) and random.randint(0, 1):
+            return str(self.mutate_number(float(s) if '.' in s or 'e' in s.lower() else int(s)))
+        return self.mutate_string(s or '')
+
+    # trees
+    def json_nodes(self, val, depth=0, nodes=None):
+        # (container, index, depth) of every value below val
+        nodes = [] if nodes is None else nodes
+        if isinstance(val, JsonObject):
+            for i, (_, v) in enumerate(val):
+                nodes.append((val, i, depth + 1))
+                self.json_nodes(v, depth + 1, nodes)
+        elif isinstance(val, list):
+            for i, v in enumerate(val):
+                nodes.append((val, i, depth + 1))
+                self.json_nodes(v, depth + 1, nodes)
+        return nodes
+
+    def mutate_json(self, tree, flat=False):
+        nodes = self.json_nodes(tree)
+        if not nodes:
+            return self.mutate_scalar(tree) if not isinstance(tree, list) else tree
+        container, i, depth = random.choice(nodes)
+        is_obj = isinstance(container, JsonObject)
+        val = container[i][1] if is_obj else container[i]
+
+        op = random.randint(0, 3)
+        if op == 1 and len(container) > 1:
+            # drop the key
+            del container[i]
+        elif op == 2:
+            # duplicate the key
+            container.insert(i + 1, copy.deepcopy(container[i]))
+        elif op == 3 and not flat and depth + height(val) < self.max_depth:
+            nested = [val] if random.randint(0, 1) else JsonObject([[container[i][0] if is_obj else 'value', val]])
+            if is_obj:
+                container[i][1] = nested
+            else:
+                container[i] = nested
+        elif not isinstance(val, list):
+            new = self.mutate_text(val) if flat else self.mutate_scalar(val)
+            if is_obj:
+                container[i][1] = new
+            else:
+                container[i] = new
+        return tree
+
+    def mutate_xml(self, root):
+        nodes = []
+        stack = [(None, root, 1)]
+        while stack:
+            parent, elem, depth = stack.pop()
+            nodes.append((parent, elem, depth))
+            stack.extend([(elem, c, depth + 1) for c in elem])
+        # the root can only be nested or have its text changed
+        parent, elem, depth = random.choice(nodes[1:] or nodes)
+
+        op = random.randint(0, 3)
+        if op == 1 and parent is not None and len(parent) > 1:
+            parent.remove(elem)
+        elif op == 2 and parent is not None:
+            parent.insert(list(parent).index(elem) + 1, copy.deepcopy(elem))
+        elif op == 3 and depth + xml_height(elem) <= self.max_depth:
+            elem.append(copy.deepcopy(elem))
+        elif elem.attrib and random.randint(0, 1):
+            k = random.choice(sorted(elem.attrib))
+            elem.set(k, self.mutate_text(elem.get(k)))
+        elif len(elem) == 0 or (elem.text and elem.text.strip()):
+            elem.text = self.mutate_text(elem.text)
+        return root
+
+    def next_body(self):
+        seed = self.seeds[self.seed_idx]
+        self.seed_idx = (self.seed_idx + 1) % len(self.seeds)
+        kind, prefix, body = seed
+        tree = self.parse(kind, prefix, body)
+        for _ in range(random.randint(1, MAX_MUTATIONS)):
+            if kind == KIND_XML:
+                tree = self.mutate_xml(tree)
+            else:
+                tree = self.mutate_json(tree, flat=kind == KIND_FORM)
+        # values are byte strings, as the traces and the journal expect
+        final = self.serialize(kind, prefix, body, tree)
+        return final.encode('utf-8') if isinstance(final, unicode) else final
+
+    def fuzz_java_lang_String(self, obj_creator, *kargs, **kwargs):
+        if not self.seeds:
+            return None
+        final_str = self.next_body()
+        obj_creator('java.lang.String', False, final_str, 1, *kargs, **kwargs)
+        return final_str
+
+    def fuzz_byte_array(self, obj_creator, *kargs, **kwargs):
+        s = self.fuzz_java_lang_String(lambda *a, **b: None)
+        if s is None:
+            return None
+        val = bytearray(s)
+        if obj_creator is not None:
+            obj_creator('byte', True, val, len(val), *kargs, **kwargs)
+        return val
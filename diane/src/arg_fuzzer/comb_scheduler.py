@@ -0,0 +1,95 @@
+import itertools
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("CombinationScheduler")
+log.setLevel(logging.DEBUG)
+
+# extra rounds granted to a method on top of its singles and pairs
+EXTRA_ROUNDS_PER_PARAM = 1
+# a crash weighs as much as this many values consumed per window
+ANOMALY_WEIGHT = 100
+
+
+class CombinationScheduler:
+    """
+    Decides which combinations of parameter positions to fuzz, and with how
+    many values, within a total budget of values per method.
+    Every single position and every pair is fuzzed first, with the combinations
+    asked for explicitly (seeds), whatever their size. The rest of the budget
+    goes to combinations which crashed the app, and to the supersets of the
+    combinations with the highest yield (values consumed per window).
+    """
+    def __init__(self, n_params, round_size, budget=None, accept=None, seeds=None):
+        self.n_params = n_params
+        self.round_size = round_size
+        self.accept = accept if accept else (lambda comb: True)
+
+        self.coverage = [c for s in (1, 2) for c in itertools.combinations(range(n_params), s) if self.accept(c)]
+        for comb in sorted(seeds or [], key=lambda c: (len(c), c)):
+            if comb not in self.coverage:
+                self.coverage.append(comb)
+        if budget is None:
+            budget = round_size * (len(self.coverage) + EXTRA_ROUNDS_PER_PARAM * n_params)
+        self.budget = budget
+        self.spent = 0
+
+        # fuzz less per combination rather than leaving pairs out
+        if self.coverage and self.budget < round_size * len(self.coverage):
+            self.round_size = max(1, self.budget // len(self.coverage))
+
+        self.pending = list(self.coverage)
+        self.stats = {}
+
+    def score(self, comb):
+        st = self.stats[comb]
+        return st['crashes'] * ANOMALY_WEIGHT + st['fuzzed'] / float(max(st['windows'], 1))
+
+    def record(self, comb, fuzzed, windows, crashes):
+        st = self.stats.setdefault(comb, {'fuzzed': 0, 'windows': 0, 'crashes': 0, 'rounds': 0})
+        st['fuzzed'] += fuzzed
+        st['windows'] += windows
+        st['crashes'] += crashes
+        st['rounds'] += 1
+        self.spent += self.round_size
+
+    def is_retry(self, comb):
+        return comb in self.stats
+
+    def candidates(self):
+        ranked = sorted(self.stats, key=lambda c: (-self.score(c), c))
+        cands = []
+        for comb in ranked:
+            st = self.stats[comb]
+            if st['fuzzed'] == 0:
+                continue
+            # grow the productive combinations one position at a time
+            for pos in range(self.n_params):
+                if pos in comb:
+                    continue
+                new = tuple(sorted(comb + (pos,)))
+                if new not in self.stats and new not in cands and self.accept(new):
+                    cands.append(new)
+            # go back to the ones that crashed the app
+            if st['crashes'] and st['rounds'] <= st['crashes']:
+                cands.append(comb)
+        return cands
+
+    def next(self):
+        # next combination to fuzz, or None when done
+        if self.spent + self.round_size > self.budget:
+            return None
+        if self.pending:
+            return self.pending.pop(0)
+
+        cands = self.candidates()
+        if not cands:
+            return None
+        log.debug("Budget left {}, next combination {}".format(self.budget - self.spent, str(cands[0])))
+        return cands[0]
+
+    def __iter__(self):
+        comb = self.next()
+        while comb is not None:
+            yield comb
+            comb = self.next()
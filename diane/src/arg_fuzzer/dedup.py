@@ -0,0 +1,147 @@
+import os
+import math
+import struct
+import hashlib
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("DedupFilter")
+log.setLevel(logging.DEBUG)
+
+DEDUP_DIR_NAME = "dedup"
+# values remembered per (method, position) at the given false positive rate
+DEDUP_CAPACITY = 100000
+DEDUP_FP_RATE = 0.01
+
+BLOOM_MAGIC = 'DBLM'
+BLOOM_HEADER = struct.Struct('<4sIII')
+
+
+class BloomFilter:
+    def __init__(self, n_bits, n_hashes, count=0, bits=None):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((n_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        n_bits = int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        n_hashes = max(1, int(round(n_bits / float(capacity) * math.log(2))))
+        return cls(n_bits, n_hashes)
+
+    def positions(self, item):
+        # double hashing on the two halves of an md5
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(item))
+
+    def add(self, item):
+        # True if the item was not in the filter
+        new = False
+        for p in self.positions(item):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                self.bits[p >> 3] |= 1 << (p & 7)
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def dump(self, path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.n_bits, self.n_hashes, self.count))
+            fp.write(self.bits)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fp:
+            magic, n_bits, n_hashes, count = BLOOM_HEADER.unpack(fp.read(BLOOM_HEADER.size))
+            if magic != BLOOM_MAGIC:
+                raise ValueError("{} is not a bloom filter".format(path))
+            bits = bytearray(fp.read())
+        if len(bits) != (n_bits + 7) // 8:
+            raise ValueError("{} is truncated".format(path))
+        return cls(n_bits, n_hashes, count, bits)
+
+
+class DedupFilter:
+    """
+    Values already sent to each (method, position), over all the runs of a
+    campaign. Every position has its own Bloom filter, stored in a file of
+    the campaign directory, so a value is only reported as new if it was
+    never tried; a few tried values can be mistaken for new ones. Values
+    drawn for a window are only recorded once the app received them.
+    """
+    def __init__(self, path, capacity=DEDUP_CAPACITY, fp_rate=DEDUP_FP_RATE):
+        self.path = path
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.filters = {}
+        self.dirty = set()
+        # values drawn for the current window, per key, not tried yet
+        self.claimed = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(method, pos, type_obj):
+        return repr((str(method), str(pos), str(type_obj)))
+
+    def filter_path(self, key):
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest() + '.bloom')
+
+    def get_filter(self, key):
+        if key not in self.filters:
+            path = self.filter_path(key)
+            bloom = None
+            if os.path.isfile(path):
+                try:
+                    bloom = BloomFilter.load(path)
+                except (IOError, ValueError, struct.error) as e:
+                    log.warning("Dropping dedup filter {}: {}".format(path, str(e)))
+            if bloom is None:
+                bloom = BloomFilter.for_capacity(self.capacity, self.fp_rate)
+            self.filters[key] = bloom
+        return self.filters[key]
+
+    @staticmethod
+    def value_repr(val):
+        if isinstance(val, bytearray):
+            # as the lists byte arrays were tried as in earlier runs
+            val = list(val)
+        return repr(val)
+
+    def claim(self, key, val):
+        # True if val was never tried for key, nor drawn for the current window
+        r = self.value_repr(val)
+        claimed = self.claimed.setdefault(key, set())
+        if r in claimed or r in self.get_filter(key):
+            return False
+        claimed.add(r)
+        return True
+
+    def add(self, key, val):
+        # True if val was never tried for key
+        new = self.get_filter(key).add(self.value_repr(val))
+        if new:
+            self.dirty.add(key)
+        return new
+
+    def new_window(self):
+        # the values drawn for the last window and not tried can be drawn again
+        self.claimed = {}
+
+    def commit(self, tried):
+        # the (key, value) of the current window the app received
+        for key, val in tried:
+            self.add(key, val)
+        self.save()
+
+    def save(self):
+        for key in self.dirty:
+            self.filters[key].dump(self.filter_path(key))
+        self.dirty = set()
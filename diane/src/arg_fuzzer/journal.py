@@ -0,0 +1,141 @@
+import os
+import json
+import random
+import numpy
+
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("FuzzJournal")
+log.setLevel(logging.DEBUG)
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+
+
+def get_rng_state(seed_rng):
+    np_state = numpy.random.get_state()
+    return {'random': random.getstate(),
+            'numpy': [np_state[0], np_state[1].tolist()] + list(np_state[2:]),
+            'seed': seed_rng.getstate()}
+
+
+def set_rng_state(state, seed_rng):
+    def to_tuple(s):
+        return (s[0], tuple(s[1]), s[2])
+
+    np_state = state['numpy']
+    random.setstate(to_tuple(state['random']))
+    numpy.random.set_state((np_state[0], numpy.array(np_state[1], dtype=numpy.uint32)) + tuple(np_state[2:]))
+    seed_rng.setstate(to_tuple(state['seed']))
+
+
+class FuzzJournal:
+    """
+    Append-only record of a fuzzing campaign. Every completed fuzzing window is
+    logged together with the RNG state, so that an interrupted campaign can be
+    resumed from its last completed window.
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.targets = None
+        self.windows = {}
+        self.done = set()
+        # units fuzzed by the power scheduler, in order
+        self.visits = []
+        # outcomes of the combinations fuzzed for each method, in order
+        self.combs = {}
+
+        if resume and os.path.isfile(path):
+            self.load()
+            log.info("Resuming campaign from " + path)
+        else:
+            self.append({'event': 'start'})
+
+    @staticmethod
+    def key(fuzz_list, method, unit=None):
+        return json.dumps([fuzz_list, method, unit])
+
+    def load(self):
+        line = '\n'
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # last record might be truncated by a crash
+                    log.warning("Skipping malformed journal record")
+                    continue
+
+                event = rec['event']
+                if event == 'start':
+                    # a new campaign started, forget the previous ones
+                    self.targets = None
+                    self.windows = {}
+                    self.done = set()
+                    self.visits = []
+                    self.combs = {}
+                elif event == 'targets':
+                    self.targets = rec['targets']
+                elif event == 'window':
+                    self.windows[self.key(rec['list'], rec['method'], rec['unit'])] = rec
+                elif event == 'done':
+                    self.done.add(self.key(rec['list'], rec['method'], rec['unit']))
+                elif event == 'retry':
+                    self.forget(self.key(rec['list'], rec['method'], rec['unit']))
+                elif event == 'visit':
+                    self.visits.append(rec['visit'])
+                elif event == 'comb':
+                    self.combs.setdefault(self.key(rec['list'], rec['method']), []).append(rec)
+
+        if not line.endswith('\n'):
+            # terminate the truncated record before appending new ones
+            with open(self.path, 'a') as fp:
+                fp.write('\n')
+
+    def append(self, rec):
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps(rec) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def record_targets(self, targets):
+        self.targets = targets
+        self.append({'event': 'targets', 'targets': targets})
+
+    def record_window(self, fuzz_list, method, unit, remain_reps, tot_reps, rng_state):
+        rec = {'event': 'window', 'list': fuzz_list, 'method': method, 'unit': unit,
+               'remain_reps': remain_reps, 'tot_reps': tot_reps, 'rng': rng_state}
+        self.windows[self.key(fuzz_list, method, unit)] = rec
+        self.append(rec)
+
+    def record_done(self, fuzz_list, method, unit=None):
+        self.done.add(self.key(fuzz_list, method, unit))
+        self.append({'event': 'done', 'list': fuzz_list, 'method': method, 'unit': unit})
+
+    def record_retry(self, fuzz_list, method, unit=None):
+        # the unit is fuzzed again from scratch
+        self.forget(self.key(fuzz_list, method, unit))
+        self.append({'event': 'retry', 'list': fuzz_list, 'method': method, 'unit': unit})
+
+    def forget(self, key):
+        self.done.discard(key)
+        self.windows.pop(key, None)
+
+    def record_visit(self, visit):
+        self.visits.append(visit)
+        self.append({'event': 'visit', 'visit': visit})
+
+    def record_comb(self, fuzz_list, method, comb, ran, fuzzed, windows, crashes):
+        rec = {'event': 'comb', 'list': fuzz_list, 'method': method, 'comb': comb, 'ran': ran,
+               'fuzzed': fuzzed, 'windows': windows, 'crashes': crashes}
+        self.combs.setdefault(self.key(fuzz_list, method), []).append(rec)
+        self.append(rec)
+
+    def get_combs(self, fuzz_list, method):
+        return list(self.combs.get(self.key(fuzz_list, method), []))
+
+    def is_done(self, fuzz_list, method, unit=None):
+        return self.key(fuzz_list, method, unit) in self.done
+
+    def get_window(self, fuzz_list, method, unit):
+        return self.windows.get(self.key(fuzz_list, method, unit))
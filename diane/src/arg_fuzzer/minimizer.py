@@ -0,0 +1,83 @@
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("Minimizer")
+log.setLevel(logging.DEBUG)
+
+# replays a single minimization may run
+MAX_MINIMIZE_RUNS = 64
+
+
+class Minimizer:
+    """
+    Delta debugging (ddmin) over the values of a window that crashed the app.
+    The values are split in chunks, and a chunk, or the rest of the values
+    without it, replaces the values whenever it still makes the app crash;
+    otherwise the chunks get smaller. test takes a list of values and
+    returns whether they reproduce the crash.
+    """
+    def __init__(self, test, max_runs=MAX_MINIMIZE_RUNS):
+        self.test = test
+        self.max_runs = max_runs
+        self.runs = 0
+        self.results = {}
+
+    def reproduces(self, rows, idx):
+        key = tuple(idx)
+        if key not in self.results:
+            self.runs += 1
+            self.results[key] = bool(self.test([rows[i] for i in idx]))
+            log.debug("Run {}: {} values, crash {}".format(self.runs, len(idx), self.results[key]))
+        return self.results[key]
+
+    def budget_left(self):
+        return self.runs < self.max_runs
+
+    @staticmethod
+    def split(idx, n):
+        size, extra = divmod(len(idx), n)
+        chunks = []
+        start = 0
+        for i in range(n):
+            end = start + size + (1 if i < extra else 0)
+            chunks.append(idx[start:end])
+            start = end
+        return chunks
+
+    def minimize(self, rows):
+        # the smallest list of values found that still crashes the app,
+        # None if the whole window does not
+        idx = range(len(rows))
+        if not self.reproduces(rows, idx):
+            return None
+
+        n = 2
+        while len(idx) >= 2 and self.budget_left():
+            chunks = self.split(idx, n)
+            reduced = False
+            for chunk in chunks:
+                if not self.budget_left():
+                    break
+                if self.reproduces(rows, chunk):
+                    idx, n, reduced = chunk, 2, True
+                    break
+
+            if not reduced and n > 2:
+                # with two chunks, the complements are the chunks themselves
+                for chunk in chunks:
+                    if not self.budget_left():
+                        break
+                    skip = set(chunk)
+                    rest = [i for i in idx if i not in skip]
+                    if self.reproduces(rows, rest):
+                        idx, n, reduced = rest, max(n - 1, 2), True
+                        break
+
+            if not reduced:
+                if n >= len(idx):
+                    break
+                n = min(len(idx), 2 * n)
+
+        if not self.budget_left():
+            log.info("Minimization stopped after {} runs".format(self.runs))
+        return [rows[i] for i in idx]
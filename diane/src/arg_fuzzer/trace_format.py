@@ -0,0 +1,248 @@
+import json
+import mmap
+import struct
+import logging
+from collections import deque
+
+logging.basicConfig()
+log = logging.getLogger("TraceFormat")
+log.setLevel(logging.DEBUG)
+
+# Fuzzing results of a method. After the magic, the file is a sequence of
+# records: kind (1 byte), body length (4 bytes), body.
+#   METHOD: json of the fuzzed method
+#   KEY:    key id (4 bytes), json of {'comb', 'pos', 'type'}; comb is None for class fields
+#   VALUE:  key id (4 bytes), value as saved by save_run
+#   WINDOW: window id (4 bytes), the values that follow were fuzzed in that window
+# The index (file name + INDEX_EXT) holds the keys with their number of values
+# and, for every combination, the spans of the file its values are in. It is rebuilt by scanning the file
+# when missing, e.g. after a crash.
+
+TRACE_MAGIC = 'DTRC\x01'
+INDEX_EXT = '.idx'
+RECORD_HEADER = struct.Struct('<BI')
+KEY_ID = struct.Struct('<I')
+WINDOW_ID = struct.Struct('<I')
+# bytes buffered before writing to the file
+FLUSH_SIZE = 1 << 16
+
+KIND_METHOD = 0
+KIND_KEY = 1
+KIND_VALUE = 2
+KIND_WINDOW = 3
+
+FIELDS_COMB = 'fields'
+
+
+def value_str(val):
+    # byte arrays are saved as the lists of ints they were before being sent as raw bytes
+    if isinstance(val, bytearray):
+        val = list(val)
+    return str(val)
+
+
+def comb_name(comb):
+    return FIELDS_COMB if comb is None else ','.join(map(str, comb))
+
+
+def comb_from_name(name):
+    return None if name == FIELDS_COMB else tuple(int(x) for x in name.split(',') if x)
+
+
+def is_trace_file(path):
+    with open(path, 'rb') as fp:
+        return fp.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+class TraceWriter:
+    def __init__(self, path, method):
+        self.path = path
+        self.fp = open(path, 'wb')
+        self.keys = {}
+        self.counts = {}
+        self.spans = {}
+        self.last_comb = None
+        self.buffer = []
+        self.buffered = 0
+        self.offset = 0
+
+        self.write(TRACE_MAGIC)
+        self.write_record(KIND_METHOD, json.dumps(method))
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.offset += len(data)
+        if self.buffered >= FLUSH_SIZE:
+            self.flush()
+
+    def write_record(self, kind, body):
+        self.write(RECORD_HEADER.pack(kind, len(body)) + body)
+
+    def start_window(self, window_id):
+        self.write_record(KIND_WINDOW, WINDOW_ID.pack(window_id))
+
+    def get_key_id(self, comb, pos, type_obj):
+        if comb is not None:
+            comb = tuple(comb)
+        key = (comb, str(pos), str(type_obj))
+        if key not in self.keys:
+            key_id = len(self.keys)
+            self.keys[key] = key_id
+            self.counts[key_id] = 0
+            self.write_record(KIND_KEY, KEY_ID.pack(key_id) +
+                              json.dumps({'comb': comb, 'pos': key[1], 'type': key[2]}))
+        return self.keys[key]
+
+    def write_value(self, comb, pos, type_obj, val):
+        key_id = self.get_key_id(comb, pos, type_obj)
+        name = comb_name(comb)
+        start = self.offset
+        self.write_record(KIND_VALUE, KEY_ID.pack(key_id) + value_str(val))
+        self.counts[key_id] += 1
+
+        spans = self.spans.setdefault(name, [])
+        if self.last_comb == name and spans and spans[-1][1] == start:
+            spans[-1][1] = self.offset
+        else:
+            spans.append([start, self.offset])
+        self.last_comb = name
+
+    def flush(self):
+        self.fp.write(''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+        self.fp.flush()
+
+    def write_index(self):
+        keys = [{'id': key_id, 'comb': comb, 'pos': pos, 'type': type_obj, 'count': self.counts[key_id]}
+                for (comb, pos, type_obj), key_id in self.keys.items()]
+        with open(self.path + INDEX_EXT, 'w') as fp:
+            json.dump({'size': self.offset, 'keys': keys, 'spans': self.spans}, fp)
+
+    def close(self):
+        self.flush()
+        self.write_index()
+        self.fp.close()
+
+
+class TraceReader:
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+            raise ValueError("{} is not a fuzzing trace".format(path))
+
+        kind, body, _ = self.read_record(len(TRACE_MAGIC))
+        self.method = json.loads(body)
+        self.keys = {}
+        self.spans = {}
+        if not self.load_index():
+            log.info("Indexing " + path)
+            self.scan()
+
+    def read_record(self, offset):
+        kind, length = RECORD_HEADER.unpack_from(self.mm, offset)
+        start = offset + RECORD_HEADER.size
+        return kind, self.mm[start:start + length], start + length
+
+    def load_index(self):
+        try:
+            with open(self.path + INDEX_EXT) as fp:
+                index = json.load(fp)
+        except (IOError, ValueError):
+            return False
+        if index['size'] != len(self.mm):
+            return False
+
+        for k in index['keys']:
+            self.keys[k['id']] = k
+        self.spans = index['spans']
+        return True
+
+    def scan(self):
+        offset = len(TRACE_MAGIC)
+        last_comb = None
+        while offset + RECORD_HEADER.size <= len(self.mm):
+            kind, length = RECORD_HEADER.unpack_from(self.mm, offset)
+            end = offset + RECORD_HEADER.size + length
+            if end > len(self.mm):
+                # truncated record
+                break
+
+            kind, body, _ = self.read_record(offset)
+            if kind == KIND_KEY:
+                key_id = KEY_ID.unpack_from(body)[0]
+                key = json.loads(body[KEY_ID.size:])
+                key['id'] = key_id
+                key['count'] = 0
+                self.keys[key_id] = key
+            elif kind == KIND_VALUE:
+                key = self.keys[KEY_ID.unpack_from(body)[0]]
+                key['count'] += 1
+                name = comb_name(key['comb'])
+                spans = self.spans.setdefault(name, [])
+                if last_comb == name and spans and spans[-1][1] == offset:
+                    spans[-1][1] = end
+                else:
+                    spans.append([offset, end])
+                last_comb = name
+            offset = end
+
+    def combinations(self):
+        return [comb_from_name(name) for name in self.spans]
+
+    def records(self, comb):
+        # (key, value) of the combination, in the order they were saved
+        for start, end in self.spans.get(comb_name(comb), []):
+            offset = start
+            while offset < end:
+                kind, body, offset = self.read_record(offset)
+                if kind == KIND_VALUE:
+                    yield self.keys[KEY_ID.unpack_from(body)[0]], body[KEY_ID.size:]
+
+    def positions(self, comb):
+        # position -> number of values
+        return {k['pos']: k['count'] for k in self.keys.values() if comb_name(k['comb']) == comb_name(comb)}
+
+    def iter_values(self, comb, pos):
+        for key, val in self.records(comb):
+            if key['pos'] == pos:
+                yield val
+
+    def stream(self, comb):
+        return ReplayStream({pos: self.iter_values(comb, pos) for pos in self.positions(comb)})
+
+    def count(self, comb):
+        # number of calls the combination was fuzzed with
+        counts = self.positions(comb).values()
+        return min(counts) if counts else 0
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+
+
+class ReplayStream:
+    """
+    Values of a fuzzed combination, one row (position -> value) per call.
+    Rows are read on demand and dropped once consumed, so only the current
+    window is held in memory.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.buffer = deque()
+        self.exhausted = False
+
+    def peek(self, n):
+        while len(self.buffer) < n and not self.exhausted:
+            try:
+                self.buffer.append({pos: next(vals) for pos, vals in self.columns.items()})
+            except StopIteration:
+                self.exhausted = True
+        return list(self.buffer)[:n]
+
+    def consume(self, n):
+        for _ in range(min(n, len(self.buffer))):
+            self.buffer.popleft()
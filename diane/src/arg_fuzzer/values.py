@@ -1,10 +1,20 @@
-from arg_values.random_values import RandomValues
+from arg_values.random_values import RandomValues, FUZZ_FUNCTIONS
 from arg_values.formatted_values import FormattedValues
+from arg_values.structured_values import StructuredValues
+from arg_values.seeded_values import SeededValues, SEEDED_FUZZ_FUNCTIONS, mix_seed
+
+
+# draws of a value already tried before giving up on a new one
+MAX_REDRAWS = 10
 
 
 class Values:
-    def __init__(self, config, generator=None):
+    def __init__(self, config, generator=None, dedup=None):
         self.config = config
+        # values already tried, see dedup.DedupFilter
+        self.dedup = dedup
+        # whether the last value created with a dedup key had been tried already
+        self.duplicate = False
         self.gen_vals = []
         if generator is not None:
             try:
@@ -15,6 +25,10 @@ class Values:
 
         if not self.gen_vals:
             self.gen_vals = [RandomValues(), FormattedValues(config)]
+            if config.get('structured_values', True):
+                self.gen_vals.append(StructuredValues(config))
+        # generator drawing many values at once, see create_values
+        self.batch_gen = next((g for g in self.gen_vals if hasattr(g, 'generate')), None)
 
         self.index = 0
 
@@ -27,6 +41,27 @@ class Values:
             return 'fuzz_' + vtype.replace('.', '_').replace('[]', '_array')
 
     def create_value(self, obj_type, frida_obj_creator, *kargs, **kwargs):
+        # with a dedup_key, values already tried for it are drawn again, up to
+        # MAX_REDRAWS times, before being handed to frida_obj_creator
+        dedup_key = kwargs.pop('dedup_key', None)
+        self.duplicate = False
+        if dedup_key is None or self.dedup is None:
+            return self.draw_value(obj_type, frida_obj_creator, *kargs, **kwargs)
+
+        calls = []
+        for _ in range(MAX_REDRAWS):
+            del calls[:]
+            val = self.draw_value(obj_type, lambda *a, **kw: calls.append((a, kw)), *kargs, **kwargs)
+            if val is None or self.dedup.claim(dedup_key, val):
+                break
+        else:
+            self.duplicate = True
+
+        for a, kw in calls:
+            frida_obj_creator(*a, **kw)
+        return val
+
+    def draw_value(self, obj_type, frida_obj_creator, *kargs, **kwargs):
         f_name = self.get_name_fuzz_function(obj_type)
         old_index = self.index
 
@@ -41,6 +76,68 @@ class Values:
             if old_index == self.index:
                 return None
 
+    def create_values(self, obj_type, n, *kargs, **kwargs):
+        # batch counterpart of create_value: n (value, frida_obj_creator calls,
+        # duplicate) to replay on the creator of the call they are used in
+        dedup_key = kwargs.pop('dedup_key', None)
+        dedup = self.dedup if dedup_key is not None else None
+        draws = [None] * n
+        todo = range(n)
+        for _ in range(MAX_REDRAWS if dedup is not None else 1):
+            for i, draw in zip(todo, self.draw_values(obj_type, len(todo), *kargs, **kwargs)):
+                draws[i] = draw
+            if dedup is None:
+                todo = []
+                break
+            todo = [i for i in todo if draws[i][0] is not None and not dedup.claim(dedup_key, draws[i][0])]
+            if not todo:
+                break
+
+        duplicates = set(todo)
+        return [(val, calls, i in duplicates) for i, (val, calls) in enumerate(draws)]
+
+    def draw_values(self, obj_type, n, *kargs, **kwargs):
+        # generators take turns as in draw_value, but the values of batch_gen
+        # are drawn all at once. Those the other generators have none for too
+        f_name = self.get_name_fuzz_function(obj_type)
+        spec = FUZZ_FUNCTIONS.get(f_name) if self.batch_gen is not None else None
+        draws = [None] * n
+        bulk = []
+        for i in xrange(n):
+            calls = []
+            if spec is None:
+                draws[i] = (self.draw_value(obj_type, lambda *a, **kw: calls.append((a, kw)), *kargs, **kwargs),
+                            calls)
+                continue
+
+            gen = self.gen_vals[self.index]
+            self.index = (self.index + 1) % len(self.gen_vals)
+            if gen is not self.batch_gen and hasattr(gen, f_name):
+                val = getattr(gen, f_name)(lambda *a, **kw: calls.append((a, kw)), *kargs, **kwargs)
+                if val is not None:
+                    draws[i] = (val, calls)
+                    continue
+            bulk.append(i)
+
+        if bulk:
+            type_obj, array, primitive = spec
+            for i, val in zip(bulk, self.batch_gen.generate(type_obj, len(bulk), array=array)):
+                nelem = len(val) if array else 1
+                draws[i] = (val, [((type_obj, primitive, val, nelem) + kargs, kwargs)])
+        return draws
+
+    def get_seeded_spec(self, obj_type):
+        # None if the agent cannot generate values of this type on its own
+        return SEEDED_FUZZ_FUNCTIONS.get(self.get_name_fuzz_function(obj_type))
+
+    def get_value_tables(self):
+        return RandomValues().get_value_tables()
+
+    def create_seeded_values(self, obj_type, seed, pos, count):
+        # regenerates the values the agent drew for the parameter in position pos
+        type_obj, array, _ = self.get_seeded_spec(obj_type)
+        return SeededValues(mix_seed(seed, pos)).generate(type_obj, count, array=array)
+
     def str_to_byte(self, b):
         return int(b)
 
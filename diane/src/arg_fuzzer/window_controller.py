@@ -0,0 +1,79 @@
+import math
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("WindowController")
+log.setLevel(logging.DEBUG)
+
+EWMA_ALPHA = 0.3
+# values prepared on top of the expected hits
+WINDOW_MARGIN = 0.2
+MIN_WINDOW = 5
+
+
+class WindowController:
+    """
+    Sizes the fuzzing windows of a method on the number of times a replay
+    calls it, tracked as an exponentially weighted moving average.
+    A window fully consumed only tells that the method might be called more
+    often, so in that case the estimate is pushed above the window size.
+    """
+    def __init__(self, initial, max_window, alpha=EWMA_ALPHA, margin=WINDOW_MARGIN, min_window=MIN_WINDOW):
+        self.initial = initial
+        self.max_window = max_window
+        self.min_window = min_window
+        self.alpha = alpha
+        self.margin = margin
+        self.ewma = None
+
+        self.windows = 0
+        self.prepared = 0
+        self.consumed = 0
+
+    def next_window(self, remaining=None):
+        if self.ewma is None:
+            size = self.initial
+        else:
+            size = int(math.ceil(self.ewma * (1 + self.margin)))
+        size = max(self.min_window, min(size, self.max_window))
+        if remaining is not None:
+            size = min(size, remaining)
+        return size
+
+    def update(self, prepared, hits):
+        consumed = min(prepared, hits)
+        self.windows += 1
+        self.prepared += prepared
+        self.consumed += consumed
+
+        observed = hits
+        if hits >= prepared:
+            observed = prepared * (1 + self.margin) + 1
+        if self.ewma is None:
+            self.ewma = float(observed)
+        else:
+            self.ewma = self.alpha * observed + (1 - self.alpha) * self.ewma
+
+        log.debug("Prepared {}, consumed {}, expected hits {:.1f}".format(prepared, consumed, self.ewma))
+        return consumed
+
+    def stats(self):
+        return {'windows': self.windows,
+                'prepared': self.prepared,
+                'consumed': self.consumed,
+                'efficiency': self.consumed / float(self.prepared) if self.prepared else 0.0,
+                'expected_hits': self.ewma}
+
+
+def merge_window_stats(a, b):
+    # sum the stats of the same method collected on different devices
+    merged = {}
+    for key in set(a) | set(b):
+        if key not in a or key not in b:
+            merged[key] = dict(a.get(key) or b.get(key))
+            continue
+        st = {k: a[key][k] + b[key][k] for k in ('windows', 'prepared', 'consumed')}
+        st['efficiency'] = st['consumed'] / float(st['prepared']) if st['prepared'] else 0.0
+        st['expected_hits'] = b[key]['expected_hits']
+        merged[key] = st
+    return merged
@@ -1,6 +1,7 @@
 rpc.exports = {
     runit: runIt,
     preparenewfuzz: prepareNewFuzz,
+    prepareseededfuzz: prepareSeededFuzz,
     resetlastmethods: resetLastMethods,
     resetlastinstances: resetLastInstaces,
     fuzzpreparedone: fuzzPrepareDone,
@@ -16,6 +17,8 @@ rpc.exports = {
     getseparators: getSeparators,
     stopargsfuzz: stopArgsFuzz,
     addknownobject: addKnownObject,
+    addparamslists: addParamsLists,
+    addfieldslists: addFieldsLists,
     addjavaniobytebuffer: addByteBuffer,
     addfieldvarjavaniobytebuffer: addFieldValByteBuffer,
     adhocconstructors: adHocConstructors,
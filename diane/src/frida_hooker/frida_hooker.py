@@ -5,6 +5,7 @@ import ast
 import json
 import signal
 import pickle
+import threading
 import types
 
 from optparse import OptionParser
@@ -16,6 +17,7 @@ import sys
 sys.path.append(dirname(dirname(abspath(__file__))))
 
 from node_filter.node_filter import NodeFilter
+from metrics import get_registry
 
 import logging
 
@@ -30,6 +32,12 @@ DUMP_RESULTS_PATH = "/tmp/frida_results.pickle"
 TIME_LOG = "/tmp/frida_time.log"
 WAIT_FOR_HOOK_SEC = 5
 WAIT_FOR_SPAWN_SEC = 50
+WAIT_FOR_JAVA_SEC = 1
+FUZZ_BATCH_SIZE = 50
+# fuzzed byte arrays travel as binary message data, at most this many bytes per message
+FUZZ_BLOB_MESSAGE_SIZE = 1 << 20
+BYTE_TYPES = ('byte', 'java.nio.ByteBuffer')
+EVENT_POLL_SEC = 0.5
 TYPE_DESCRIPTOR = {'short': 'S',
                      'int': 'I',
                      'double': 'D',
@@ -120,6 +128,68 @@ def FridaRunner(cls):
     return cls
 
 
+def constructor_name(adhoc_constructors, prefix, type_obj, default):
+    fname = prefix + type_obj.lower().replace('.', '')
+    return fname if fname in adhoc_constructors else default
+
+
+class FuzzBatch:
+    """
+    Local mirror of the agent fuzzing setters. Values are collected in memory
+    and sent to the agent in a few calls by FridaHooker.upload_batch.
+    """
+    def __init__(self, adhoc_constructors, fields=False):
+        self.adhoc_constructors = adhoc_constructors
+        self.fields = fields
+        self.lists = []
+        self.blobs = []
+
+    def __len__(self):
+        return len(self.lists)
+
+    def next_param_list(self):
+        self.lists.append([])
+
+    def next_fields_list(self):
+        self.lists.append([])
+
+    def discard_list(self):
+        self.lists.pop()
+
+    def pack_args(self, type_obj, kargs):
+        # kargs: val, len[, field_name]. Byte arrays are replaced by a reference
+        # to their raw bytes, which upload_batch sends out of the JSON lists
+        kargs = list(kargs)
+        if type_obj in BYTE_TYPES and len(kargs) > 1:
+            val = kargs[0]
+            if kargs[1] == 1:
+                # a single byte is a scalar for the agent
+                if isinstance(val, bytearray):
+                    kargs[0] = list(val)
+            elif isinstance(val, (list, bytearray)):
+                if not isinstance(val, bytearray):
+                    val = bytearray([v & 0xff for v in val])
+                kargs[0] = {'blob': len(self.blobs)}
+                self.blobs.append(val)
+        return kargs
+
+    def create_obj(self, type_obj, prim, *kargs):
+        fname = constructor_name(self.adhoc_constructors, 'add', type_obj,
+                                 'addprimitivetype' if prim else 'addobj')
+        self.lists[-1].append([fname, type_obj] + self.pack_args(type_obj, kargs))
+
+    def modify_class_field(self, type_obj, prim, *kargs):
+        fname = constructor_name(self.adhoc_constructors, 'addfieldvar', type_obj,
+                                 'addfieldvalprim' if prim else 'addfieldvalobj')
+        self.lists[-1].append([fname, type_obj] + self.pack_args(type_obj, kargs))
+
+    def set_unfuzzed_obj(self):
+        self.lists[-1].append('UNFUZZ')
+
+    def set_arg_simple_obj(self):
+        self.lists[-1].append('SIMPLEOBJ')
+
+
 class FridaHooker:
     __metaclass__ = FridaRunnerMeta
 
@@ -145,6 +215,7 @@ class FridaHooker:
 
         self.script = None
         self.script_cnt = None
+        self.adhoc_constructors = None
         self.frida_separators = {}
         self.last_methods_called = []
         self.last_methods_instances = []
@@ -154,6 +225,12 @@ class FridaHooker:
         self.method_repeat_done = False
         self.method_n_repeatitions = 0
         self.method_tot_repeatitions = -1
+        # notified on agent repetition messages, app death and replay exit
+        self.events = threading.Condition()
+        # while the main thread is in wait_event, signal_handler only records
+        # the exception it would raise, and wait_event raises it once out of events
+        self.waiting = False
+        self.signal_exc = None
 
         self.good_hooks = {}
         self.setup()
@@ -164,6 +241,11 @@ class FridaHooker:
                  " completely".format(str(WAIT_FOR_SPAWN_SEC)))
         time.sleep(WAIT_FOR_SPAWN_SEC)  # ten seconds to give reran time
 
+    @staticmethod
+    def wait_for_java():
+        with get_registry().timer('idle_time'):
+            time.sleep(WAIT_FOR_JAVA_SEC)  # Without it Java.perform silently fails
+
     @property
     def methods_called(self):
         return self.last_methods_called
@@ -176,17 +258,62 @@ class FridaHooker:
     def methods_call_time(self):
         return self.last_methods_call_time
 
+    @property
+    def exports(self):
+        # RPC calls to the agent, timed
+        return get_registry().timed(self.script.exports)
+
+    def notify_event(self):
+        with self.events:
+            self.events.notify_all()
+
+    def wait_event(self, predicate, timeout=None, metric='idle_time'):
+        # Return as soon as predicate holds, or False on timeout.
+        # Waits are bounded so that SIGUSR1 still reaches the main thread
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        done = False
+        self.waiting = True
+        try:
+            with self.events:
+                while self.signal_exc is None:
+                    if predicate():
+                        done = True
+                        break
+                    wait = EVENT_POLL_SEC
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.time())
+                        if wait <= 0:
+                            break
+                    self.events.wait(wait)
+        finally:
+            self.waiting = False
+            if metric:
+                get_registry().add(metric, time.time() - start)
+        self.raise_signal_exc()
+        return done
+
+    def raise_signal_exc(self):
+        exc, self.signal_exc = self.signal_exc, None
+        if exc is not None:
+            raise exc
+
+    def watch_process(self, proc):
+        # wake up the waiters as soon as proc exits
+        def watch():
+            proc.wait()
+            self.notify_event()
+
+        t = threading.Thread(target=watch)
+        t.daemon = True
+        t.start()
+        return proc
+
     def wait_for_destroy_signal(self):
-        debug_warning = 0
         try:
-            while True:
-                time.sleep(1)
-
-                debug_warning += 1
-                if debug_warning > 120:
-                    log.debug("Got stuck in waiting for destroy?")
-                    self.is_running = False
-                    break
+            if not self.wait_event(lambda: not self.is_running, timeout=120):
+                log.debug("Got stuck in waiting for destroy?")
+                self.is_running = False
         except:
             pass
         if self.is_running:
@@ -244,10 +371,12 @@ class FridaHooker:
                 if self.method_n_repeatitions >= self.method_tot_repeatitions > 0:
                     log.debug("Repetition done")
                     self.method_repeat_done = True
+                self.notify_event()
 
             elif message['payload'] == 'REPEATDONE':
                 log.debug("Repetition done")
                 self.method_repeat_done = True
+                self.notify_event()
 
             else:
                 log.warning("[*] {0}".format(message['payload']))
@@ -264,6 +393,7 @@ class FridaHooker:
         if log is not None and os is not None:
             log.debug("on_destroyed called")
             os.kill(os.getpid(), signal.SIGUSR1)
+            self.notify_event()
 
     def terminate(self):
         self.last_methods_called = []
@@ -278,12 +408,19 @@ class FridaHooker:
 
             # app exploded and wasn't stuck on a hook
             if not self.stuck and is_running:
-                raise ApkExploded("Crash")
+                self.signal_exc = ApkExploded("Crash")
             # app was stuck on a hook
-            if self.stuck:
-                raise ApkStuck("Intentionally killed")
+            elif self.stuck:
+                self.signal_exc = ApkStuck("Intentionally killed")
             # we killed it
-            raise ApkKilled("Killed")
+            else:
+                self.signal_exc = ApkKilled("Killed")
+
+            # raising while wait_event holds events would leave its lock half
+            # acquired: wait_event raises the exception when it returns
+            if not self.waiting:
+                self.raise_signal_exc()
+            return
 
         # unexpected :(
         raise Exception("Caugth signal " + str(sig))
@@ -292,7 +429,7 @@ class FridaHooker:
         signal.signal(signal.SIGUSR1, self.signal_handler)
 
         # setup frida
-        self.device = frida.get_device(self.device_id)
+        self.device = self.get_device()
         self.script_cnt = ''
         for name in SCRIPT_NAMES:
             path_script = os.path.dirname(__file__) + '/' + name
@@ -310,20 +447,24 @@ class FridaHooker:
         except:
             pass
 
+    def get_device(self):
+        return frida.get_device(self.device_id)
+
     def spawn_apk_in_device(self, to_hook=None, get_instances=False):
         try:
             if to_hook is None:
                 to_hook = []
             pid = self.device.spawn([self.proc_name])
             self.device.resume(pid)
-            time.sleep(1)  # Without it Java.perform silently fails
+            self.wait_for_java()
             session = self.device.attach(pid)
             self.script = session.create_script(self.script_cnt)
+            self.adhoc_constructors = None
             self.script.on('message', self.on_message)
             self.script.on('destroyed', self.on_destroyed)
             self.script.load()
-            self.frida_separators = self.script.exports.getseparators()
-            self.script.exports.runit(to_hook, get_instances)
+            self.frida_separators = self.exports.getseparators()
+            self.exports.runit(to_hook, get_instances)
         except Exception as e:
             self.is_running = False
             raise e
@@ -431,7 +572,8 @@ class FridaHooker:
 
         while not self.hook_done:
             last_hooking_function = self.hooking_method
-            time.sleep(WAIT_FOR_HOOK_SEC)
+            with get_registry().timer('idle_time'):
+                time.sleep(WAIT_FOR_HOOK_SEC)
 
             debug_counter += 1
             if debug_counter > 120:
@@ -450,39 +592,91 @@ class FridaHooker:
         self.method_repeat_done = False
         self.method_tot_repeatitions = n
         self.method_n_repeatitions = 0
-        self.script.exports.preparenewfuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call)
+        self.exports.preparenewfuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call)
+
+    def prepare_seeded_fuzzing(self, cls, m, n, nargs, seed, specs, tables, fast_fuzz=False,
+                               single_call_fuzz=False, curr_call=0):
+        self.method_repeat_done = False
+        self.method_tot_repeatitions = n
+        self.method_n_repeatitions = 0
+        adhoc = self.get_adhoc_constructors()
+        agent_specs = []
+        for spec in specs:
+            if spec is None:
+                agent_specs.append(None)
+                continue
+            type_obj, array, prim = spec
+            ctor = constructor_name(adhoc, 'add', type_obj, 'addprimitivetype' if prim else 'addobj')
+            agent_specs.append({'table': type_obj, 'array': array, 'ctor': ctor})
+        self.exports.prepareseededfuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call,
+                                              seed, agent_specs, tables)
 
     def get_n_repeated(self):
         return self.method_n_repeatitions
 
     def stop_args_fuzz(self):
-        self.script.exports.stopargsfuzz()
+        self.exports.stopargsfuzz()
 
     def next_param_list(self):
-        self.script.exports.nextparamlist()
+        self.exports.nextparamlist()
 
     def next_fields_list(self):
-        self.script.exports.nextfieldslist()
+        self.exports.nextfieldslist()
 
     def fuzz_prepare_done(self, shuffle=False):
-        self.script.exports.fuzzpreparedone(shuffle)
+        self.exports.fuzzpreparedone(shuffle)
 
     def get_util_calls(self, m):
-        return self.script.exports.getutilscalls(m)
+        return self.exports.getutilscalls(m)
 
     def clear_methods_called_cache(self):
         self.last_methods_called = []
         self.last_methods_instances = []
         self.last_methods_call_time = []
-        self.script.exports.resetlastmethods()
-        self.script.exports.resetlastinstances()
+        self.exports.resetlastmethods()
+        self.exports.resetlastinstances()
+
+    def get_adhoc_constructors(self):
+        # the list is fixed for a given agent, ask for it once per script
+        if self.adhoc_constructors is None:
+            self.adhoc_constructors = self.exports.adhocconstructors()
+        return self.adhoc_constructors
+
+    def new_batch(self, fields=False):
+        return FuzzBatch(self.get_adhoc_constructors(), fields=fields)
+
+    def upload_batch(self, batch):
+        # messages and RPCs are delivered in order: the byte arrays are
+        # stored by the agent before the lists referring to them arrive
+        blobs = []
+        size = 0
+        for blob in batch.blobs:
+            blobs.append(blob)
+            size += len(blob)
+            if size >= FUZZ_BLOB_MESSAGE_SIZE:
+                self.post_blobs(blobs)
+                blobs = []
+                size = 0
+        if blobs:
+            self.post_blobs(blobs)
+
+        f = self.exports.addfieldslists if batch.fields else self.exports.addparamslists
+        for i in xrange(0, len(batch.lists), FUZZ_BATCH_SIZE):
+            f(batch.lists[i:i + FUZZ_BATCH_SIZE])
+
+    def post_blobs(self, blobs):
+        data = bytes(bytearray().join(blobs))
+        self.script.post({'type': 'fuzzblobs', 'sizes': [len(b) for b in blobs]}, data=data)
+        get_registry().add('blob_bytes', len(data))
 
     def create_obj(self, type_obj, prim, *kargs, **kwargs):
         s = self.script
+        if kargs and isinstance(kargs[0], bytearray):
+            kargs = (list(kargs[0]),) + kargs[1:]
         fname = 'add' + type_obj.lower().replace('.', '')
 
         # first check if an ad-hoc contructor is provided
-        if fname in s.exports.adhocconstructors():
+        if fname in self.get_adhoc_constructors():
             f = getattr(s.exports, fname)
         else:
             f = s.exports.addprimitivetype if prim else s.exports.addobj
@@ -492,17 +686,17 @@ class FridaHooker:
         s = self.script
         fname = 'addfieldvar' + type_obj.lower().replace('.', '')
 
-        if fname in s.exports.adhocconstructors():
+        if fname in self.get_adhoc_constructors():
             f = getattr(s.exports, fname)
         else:
             f = s.exports.addfieldvalprim if prim else s.exports.addfieldvalobj
         f(type_obj, *kargs, **kwargs)
 
     def set_unfuzzed_obj(self):
-        self.script.exports.addunfuzzedobj()
+        self.exports.addunfuzzedobj()
 
     def set_arg_simple_obj(self):
-        self.script.exports.addsimpleobj()
+        self.exports.addsimpleobj()
 
     def get_vals_returned(self):
         return None
@@ -528,7 +722,7 @@ class FridaHooker:
                 self.setup_new_run()
                 to_hook = self.sanitize_hooks(to_hook)
                 self.hook_methods_sync(to_hook, get_instances=get_instances)
-                FridaHooker.wait_for_spawn()
+                self.wait_for_spawn()
                 self.register_good_hook(to_hook)
                 return True
 
@@ -637,7 +831,7 @@ class FridaHooker:
             pass
 
     def add_known_object(self, obj):
-        self.script.exports.addknownobject(obj)
+        self.exports.addknownobject(obj)
 
     def start(self, to_hook=None, lifter=None, leaves=False, force_hook=False, fast_hook=False, ignore=None, get_instances=False):
 
@@ -680,7 +874,7 @@ def parse_options():
 
 if __name__ == '__main__':
     import sys
-    from pysoot.lifter import Lifter
+    from lifter_utils import get_lifter
 
     config_path, methods, clss, show_vals = parse_options()
     if config_path is None:
@@ -698,8 +892,7 @@ if __name__ == '__main__':
 
     elif clss:
         leaves = False
-        lifter = Lifter(config['apk_path'], input_format="apk",
-                        android_sdk=config['android_sdk_platforms'])
+        lifter = get_lifter(config)
         classes = [c for c in lifter.classes.values()
                    if c.name in clss]
         methods = [[clx.name, m.name, list(m.params), m.ret]
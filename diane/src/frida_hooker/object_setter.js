@@ -1,4 +1,4 @@
-var fuzz = {'cls': 'none', 'm': 'none', 'n': 0, 'nargs': 0, 'args': [], 'fields': {}, 'i': -1, 'ready': false, 'fast_fuzz': false, 'ord': 0, 'tot': 0, 'single_call_fuzz': false, 'curr_call': 0};
+var fuzz = {'cls': 'none', 'm': 'none', 'n': 0, 'nargs': 0, 'args': [], 'fields': {}, 'i': -1, 'ready': false, 'fast_fuzz': false, 'ord': 0, 'tot': 0, 'single_call_fuzz': false, 'curr_call': 0, 'seeded': null};
 var functions_called = {};
 
 function getUtilsCalls(methodPath) {
@@ -78,8 +78,118 @@ function shuffle(array) {
 }
 
 function prepareNewFuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call) {
-    fuzz = {'cls': cls, 'm': m, 'n': n, 'nargs': nargs, 'args': [], 'fields':{}, 'i': -1, 'ready': false, 'fast_fuzz': fast_fuzz, 'ord': 0, 'tot': 0, 'single_call_fuzz': single_call_fuzz, 'curr_call': curr_call};
+    fuzz = {'cls': cls, 'm': m, 'n': n, 'nargs': nargs, 'args': [], 'fields':{}, 'i': -1, 'ready': false, 'fast_fuzz': fast_fuzz, 'ord': 0, 'tot': 0, 'single_call_fuzz': single_call_fuzz, 'curr_call': curr_call, 'seeded': null};
     fuzz['args'][0] = [];
+    fuzzBlobs = [];
+}
+
+// Seeded value generation. This mirrors arg_values/seeded_values.py: same PRNG,
+// same value kinds, and the value tables are sent by the host.
+var MAX_INT_32 = 2147483647;
+var MIN_INT_32 = -2147483648;
+var PRINTABLE_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789';
+var SEED_MIX = 0x9E3779B9;
+
+function SeededValues(seed, tables) {
+    this.state = seed | 0;
+    this.tables = tables;
+}
+
+SeededValues.prototype.random = function() {
+    // mulberry32
+    this.state = (this.state + 0x6D2B79F5) | 0;
+    var a = this.state;
+    var t = Math.imul(a ^ a >>> 15, 1 | a);
+    t = t + Math.imul(t ^ t >>> 7, 61 | t) ^ t;
+    return ((t ^ t >>> 14) >>> 0) / 4294967296;
+};
+
+SeededValues.prototype.randint = function(a, b) {
+    return a + Math.floor(this.random() * (b - a + 1));
+};
+
+SeededValues.prototype.uniform = function(a, b) {
+    return a + (b - a) * this.random();
+};
+
+SeededValues.prototype.pick = function(table) {
+    var r = this.random();
+    var acc = 0.0;
+    var funs = this.tables[table]['fun'];
+    var dist = this.tables[table]['dist'];
+    for (var i = 0; i < funs.length; i++) {
+        acc += dist[i];
+        if (r < acc) {
+            return funs[i];
+        }
+    }
+    return funs[funs.length - 1];
+};
+
+SeededValues.prototype.draw = function(table) {
+    return this[this.pick(table)]();
+};
+
+SeededValues.prototype.low_pos_array = function() { return this.randint(1, 255); };
+SeededValues.prototype.low_pos = function() { return this.randint(0, 255); };
+SeededValues.prototype.low_neg = function() { return this.randint(-255, 0); };
+SeededValues.prototype.big_pos_moderate_array = function() { return this.randint(500, 16384); };
+SeededValues.prototype.big_pos_moderate = function() { return this.randint(500, 16384); };
+SeededValues.prototype.big_pos = function() { return this.randint(Math.floor(MAX_INT_32 / 2), MAX_INT_32); };
+SeededValues.prototype.big_neg = function() { return this.randint(MIN_INT_32, Math.floor(MIN_INT_32 / 2)); };
+SeededValues.prototype.low_pos_float = function() { return this.uniform(0.0, 255.0); };
+SeededValues.prototype.low_neg_float = function() { return this.uniform(-255.0, 0.0); };
+SeededValues.prototype.big_pos_float = function() { return this.uniform(MAX_INT_32 / 2.0, MAX_INT_32); };
+SeededValues.prototype.big_neg_float = function() { return this.uniform(MIN_INT_32, MIN_INT_32 / 2.0); };
+SeededValues.prototype.null = function() { return 0; };
+SeededValues.prototype.true = function() { return true; };
+SeededValues.prototype.false = function() { return false; };
+
+SeededValues.prototype.printable_chars = function() {
+    var len = this.draw('array') + 1;
+    var s = '';
+    for (var i = 0; i < len; i++) {
+        s += PRINTABLE_CHARS[Math.floor(this.random() * PRINTABLE_CHARS.length)];
+    }
+    return s;
+};
+
+SeededValues.prototype.value = function(spec) {
+    // returns [value, len] as RandomValues.fuzz_type passes them to the object creator
+    if (spec['array']) {
+        var n = this.draw('array');
+        var vals = [];
+        for (var i = 0; i < n; i++) {
+            vals.push(this.draw(spec['table']));
+        }
+        return [vals, n];
+    }
+    return [this.draw(spec['table']), 1];
+};
+
+function prepareSeededFuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call, seed, specs, tables) {
+    prepareNewFuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call);
+    var gens = specs.map(function(spec, pos) {
+        return spec === null ? null : new SeededValues((seed ^ Math.imul(pos + 1, SEED_MIX)) >>> 0, tables);
+    });
+    fuzz['seeded'] = {'specs': specs, 'gens': gens};
+    // values are generated as the hooked method fires: no need to wait for the host
+    fuzz['ready'] = true;
+    functions_called = {};
+}
+
+function nextSeededParamsList(ord) {
+    fuzz['i'] = ord;
+    fuzz['args'][ord] = [];
+    fuzz['seeded']['specs'].forEach(function(spec, pos) {
+        if (spec === null) {
+            addUnfuzzedObj();
+        }
+        else {
+            var v = fuzz['seeded']['gens'][pos].value(spec);
+            rpc.exports[spec['ctor']](spec['table'], v[0], v[1]);
+        }
+    });
 }
 
 function stopArgsFuzz() {
@@ -134,6 +244,9 @@ function getNewArgs(args, ord, ctx) {
 
 function prepareFuzzedCall(ctx, args, ord) {
     var new_args = args;
+    if (fuzz['seeded'] !== null) {
+        nextSeededParamsList(ord);
+    }
     if (fuzz['nargs'] > 0) {
         new_args = getNewArgs(args, ord, ctx);
     }
@@ -188,6 +301,57 @@ function addSimpleObj() {
     fuzz['args'][fuzz['i']].push("SIMPLEOBJ");
 }
 
+// Byte arrays of the fuzzed values, sent by the host as the binary data of
+// 'fuzzblobs' messages ahead of the lists that refer to them as {'blob': index}.
+var fuzzBlobs = [];
+
+function onFuzzBlobs(message, data) {
+    recv('fuzzblobs', onFuzzBlobs);
+    var offset = 0;
+    message['sizes'].forEach(function(size) {
+        // views on the message data, Java.array copies them once
+        fuzzBlobs.push(new Int8Array(data, offset, size));
+        offset += size;
+    });
+}
+recv('fuzzblobs', onFuzzBlobs);
+
+function resolveBlob(arg) {
+    if (arg !== null && typeof(arg) === 'object' && arg['blob'] !== undefined) {
+        return fuzzBlobs[arg['blob']];
+    }
+    return arg;
+}
+
+function addFuzzEntry(entry) {
+    // entries are either a marker string or [constructor export name, args...]
+    if (entry === 'UNFUZZ') {
+        addUnfuzzedObj();
+    }
+    else if (entry === 'SIMPLEOBJ') {
+        addSimpleObj();
+    }
+    else {
+        rpc.exports[entry[0]].apply(null, entry.slice(1).map(resolveBlob));
+    }
+}
+
+function addParamsLists(lists) {
+    // bulk counterpart of nextParamsList followed by the add* calls
+    lists.forEach(function(entries) {
+        nextParamsList();
+        entries.forEach(addFuzzEntry);
+    });
+}
+
+function addFieldsLists(lists) {
+    // bulk counterpart of nextFieldsList followed by the addFieldVal* calls
+    lists.forEach(function(entries) {
+        nextFieldsList();
+        entries.forEach(addFuzzEntry);
+    });
+}
+
 function addFieldValPrim(prim_type, val, len, field_name) {
     if (Java.available) {
         Java.perform(function() {
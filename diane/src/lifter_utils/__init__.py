@@ -0,0 +1,3 @@
+from field_resolver import FieldResolver, get_field_resolver
+from lifter_cache import get_lifter, release_lifter, CachedLifter
+from class_index import ClassIndex, get_class_index
@@ -0,0 +1,281 @@
+import os
+import mmap
+import struct
+import logging
+
+from lifter_cache import get_lifter, cache_key, LIFTER_CACHE_DIR
+
+logging.basicConfig()
+log = logging.getLogger("ClassIndex")
+log.setLevel(logging.DEBUG)
+
+# Classes, fields and method signatures of an APK, without the method bodies.
+# Every string is stored once and referred to by id. Layout:
+#   header
+#   string offsets (n_strings + 1 x uint32), string data
+#   classes sorted by name (CLASS_REC), fields (FIELD_REC), methods (METHOD_REC)
+#   lists of string ids (uint32) for interfaces, attributes and parameters
+# The file is memory mapped and records are decoded when accessed.
+
+INDEX_MAGIC = 'DCIX\x01'
+HEADER = struct.Struct('<5s10I')
+CLASS_REC = struct.Struct('<10I')
+FIELD_REC = struct.Struct('<4I')
+METHOD_REC = struct.Struct('<6I')
+SID = struct.Struct('<I')
+NO_STRING = 0xffffffff
+
+
+class IndexedMethod:
+    __slots__ = ['name', 'class_name', 'params', 'ret', 'attrs']
+
+    def __init__(self, name, class_name, params, ret, attrs):
+        self.name = name
+        self.class_name = class_name
+        self.params = params
+        self.ret = ret
+        self.attrs = attrs
+
+
+class IndexedClass:
+    __slots__ = ['name', 'super_class', 'interfaces', 'attrs', 'fields', 'methods']
+
+    def __init__(self, name, super_class, interfaces, attrs, fields, methods):
+        self.name = name
+        self.super_class = super_class
+        self.interfaces = interfaces
+        self.attrs = attrs
+        self.fields = fields
+        self.methods = methods
+
+
+class IndexBuilder:
+    def __init__(self):
+        self.strings = {}
+        self.lists = []
+        self.fields = []
+        self.methods = []
+        self.classes = []
+
+    def sid(self, s):
+        if s is None:
+            return NO_STRING
+        s = str(s)
+        if s not in self.strings:
+            self.strings[s] = len(self.strings)
+        return self.strings[s]
+
+    def sid_list(self, ls):
+        off = len(self.lists)
+        self.lists += [self.sid(x) for x in ls]
+        return off, len(ls)
+
+    def add_class(self, clx):
+        fields_off = len(self.fields)
+        for f_name, f_info in clx.fields.items():
+            attrs = f_info[0] if isinstance(f_info[0], (list, tuple, set, frozenset)) else [f_info[0]]
+            self.fields.append((self.sid(f_name), self.sid(f_info[1])) + self.sid_list(attrs))
+
+        methods_off = len(self.methods)
+        for m in clx.methods:
+            self.methods.append((self.sid(m.name), self.sid(m.ret)) + self.sid_list(m.params) +
+                                self.sid_list(m.attrs))
+
+        self.classes.append((self.sid(clx.name), self.sid(clx.super_class)) +
+                            self.sid_list(getattr(clx, 'interfaces', [])) +
+                            self.sid_list(getattr(clx, 'attrs', [])) +
+                            (fields_off, len(self.fields) - fields_off, methods_off, len(self.methods) - methods_off))
+
+    def write(self, path):
+        strings = [None] * len(self.strings)
+        for s, i in self.strings.items():
+            strings[i] = s
+        self.classes.sort(key=lambda c: strings[c[0]])
+
+        str_offsets = [0]
+        for s in strings:
+            str_offsets.append(str_offsets[-1] + len(s))
+
+        str_off = HEADER.size
+        data_off = str_off + SID.size * len(str_offsets)
+        classes_off = data_off + str_offsets[-1]
+        fields_off = classes_off + CLASS_REC.size * len(self.classes)
+        methods_off = fields_off + FIELD_REC.size * len(self.fields)
+        lists_off = methods_off + METHOD_REC.size * len(self.methods)
+
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write(HEADER.pack(INDEX_MAGIC, len(strings), len(self.classes), len(self.fields), len(self.methods),
+                                 str_off, data_off, classes_off, fields_off, methods_off, lists_off))
+            fp.write(struct.pack('<{}I'.format(len(str_offsets)), *str_offsets))
+            fp.write(''.join(strings))
+            for rec in self.classes:
+                fp.write(CLASS_REC.pack(*rec))
+            for rec in self.fields:
+                fp.write(FIELD_REC.pack(*rec))
+            for rec in self.methods:
+                fp.write(METHOD_REC.pack(*rec))
+            fp.write(struct.pack('<{}I'.format(len(self.lists)), *self.lists))
+        os.rename(tmp, path)
+
+
+def build_class_index(lifter, path):
+    builder = IndexBuilder()
+    for clx in lifter.classes.values():
+        builder.add_class(clx)
+    builder.write(path)
+
+
+class ClassIndex:
+    """
+    Read side of the class index. It can stand for a lifter (index.classes)
+    wherever method bodies are not needed.
+    """
+    def __init__(self, path):
+        self.fp = open(path, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.mm, 0)
+        if header[0] != INDEX_MAGIC:
+            raise ValueError("{} is not a class index".format(path))
+        (self.n_strings, self.n_classes, self.n_fields, self.n_methods, self.str_off, self.data_off,
+         self.classes_off, self.fields_off, self.methods_off, self.lists_off) = header[1:]
+        self.classes = self
+
+    def string(self, sid):
+        if sid == NO_STRING:
+            return None
+        start, end = struct.unpack_from('<2I', self.mm, self.str_off + SID.size * sid)
+        return self.mm[self.data_off + start:self.data_off + end]
+
+    def strings(self, off, n):
+        return tuple(self.string(SID.unpack_from(self.mm, self.lists_off + SID.size * (off + i))[0])
+                     for i in range(n))
+
+    def class_name(self, i):
+        return self.string(SID.unpack_from(self.mm, self.classes_off + CLASS_REC.size * i)[0])
+
+    def find(self, cls):
+        # binary search on the sorted class names
+        lo, hi = 0, self.n_classes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.class_name(mid) < cls:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_classes and self.class_name(lo) == cls:
+            return lo
+        return None
+
+    def read_class(self, i):
+        (name, sup, if_off, n_if, at_off, n_at,
+         f_off, n_f, m_off, n_m) = CLASS_REC.unpack_from(self.mm, self.classes_off + CLASS_REC.size * i)
+        name = self.string(name)
+
+        fields = {}
+        for j in range(f_off, f_off + n_f):
+            f_name, f_type, fa_off, n_fa = FIELD_REC.unpack_from(self.mm, self.fields_off + FIELD_REC.size * j)
+            fields[self.string(f_name)] = (self.strings(fa_off, n_fa), self.string(f_type))
+
+        methods = []
+        for j in range(m_off, m_off + n_m):
+            m_name, ret, p_off, n_p, ma_off, n_ma = METHOD_REC.unpack_from(self.mm,
+                                                                           self.methods_off + METHOD_REC.size * j)
+            methods.append(IndexedMethod(self.string(m_name), name, self.strings(p_off, n_p), self.string(ret),
+                                         self.strings(ma_off, n_ma)))
+
+        return IndexedClass(name, self.string(sup), self.strings(if_off, n_if), self.strings(at_off, n_at),
+                            fields, methods)
+
+    # mapping interface, as lifter.classes
+    def __getitem__(self, cls):
+        i = self.find(cls) if cls is not None else None
+        if i is None:
+            raise KeyError(cls)
+        return self.read_class(i)
+
+    def __contains__(self, cls):
+        return self.find(cls) is not None
+
+    def __len__(self):
+        return self.n_classes
+
+    def get(self, cls, default=None):
+        try:
+            return self[cls]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [self.class_name(i) for i in range(self.n_classes)]
+
+    def itervalues(self):
+        for i in range(self.n_classes):
+            yield self.read_class(i)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return [(c.name, c) for c in self.itervalues()]
+
+    # queries of ArgFuzzer and NodeFilter
+    def get_hierarchy(self, cls):
+        hierarchy = []
+        while cls in self:
+            clx = self[cls]
+            hierarchy.append(clx)
+            cls = clx.super_class
+        return hierarchy
+
+    def dispatch_invoke(self, cls, mname, params):
+        for clx in self.get_hierarchy(cls):
+            for m in clx.methods:
+                if m.name == mname and m.params == tuple(params):
+                    return clx, m
+        return None, None
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+
+
+# indexes already opened by this process, by cache key
+_indexes = {}
+
+
+def get_class_index(config):
+    """
+    Class index of the APK in config, extracted from the (cached) lifter the
+    first time and stored next to the lifter cache.
+    """
+    key = cache_key(config['apk_path'], config['android_sdk_platforms'])
+    if key in _indexes:
+        return _indexes[key]
+
+    cache_dir = config.get('lifter_cache_dir', LIFTER_CACHE_DIR)
+    path = os.path.join(cache_dir, key + '.cidx')
+    if not os.path.isfile(path):
+        log.info("Extracting the class index")
+        # only needed for the extraction: not kept in the lifter cache
+        lifter = get_lifter(config, keep=False)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        build_class_index(lifter, path)
+
+    _indexes[key] = ClassIndex(path)
+    return _indexes[key]
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    if len(sys.argv) < 2:
+        print "Usage: python class_index.py <config_path>"
+        sys.exit(1)
+
+    with open(sys.argv[1]) as fp:
+        config = json.load(fp)
+    index = get_class_index(config)
+    print "{} classes indexed".format(len(index))
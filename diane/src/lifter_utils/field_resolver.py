@@ -0,0 +1,58 @@
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("FieldResolver")
+log.setLevel(logging.DEBUG)
+
+# attribute of a lifter holding its resolver
+RESOLVER_ATTR = 'field_resolver'
+
+
+def get_field_resolver(lifter):
+    # one resolver per lifter, i.e. per APK. It is kept on the lifter, so
+    # that nothing else keeps the lifter alive
+    resolver = getattr(lifter, RESOLVER_ATTR, None)
+    if resolver is None:
+        resolver = FieldResolver(lifter)
+        setattr(lifter, RESOLVER_ATTR, resolver)
+    return resolver
+
+
+def drop_field_resolver(lifter):
+    if getattr(lifter, RESOLVER_ATTR, None) is not None:
+        setattr(lifter, RESOLVER_ATTR, None)
+
+
+class FieldResolver:
+    """
+    Fields of the classes of an APK, with the names Frida uses for them: a
+    field named after a method of its class gets an underscore prefix.
+    The own and the inherited fields of a class are computed once.
+    """
+    def __init__(self, lifter):
+        self.lifter = lifter
+        self.own = {}
+        self.flat = {}
+
+    def own_fields(self, cls):
+        if cls not in self.own:
+            # raises KeyError for classes the lifter does not know
+            clx = self.lifter.classes[cls]
+            m_names = set(str(m.name) for m in clx.methods)
+            self.own[cls] = [('_' + f_name if f_name in m_names else f_name, f_info)
+                             for f_name, f_info in clx.fields.items()]
+        return self.own[cls]
+
+    def get_fields(self, cls, extended=True):
+        # [(frida field name, field info)]
+        if not extended:
+            return list(self.own_fields(cls))
+
+        if cls not in self.flat:
+            fields = list(self.own_fields(cls))
+            sup = self.lifter.classes[cls].super_class
+            while sup and sup != 'java.lang.Object':
+                fields += self.own_fields(sup)
+                sup = self.lifter.classes[sup].super_class
+            self.flat[cls] = fields
+        return list(self.flat[cls])
@@ -0,0 +1,122 @@
+import os
+import sys
+import hashlib
+import pickle
+import logging
+from field_resolver import drop_field_resolver
+
+logging.basicConfig()
+log = logging.getLogger("LifterCache")
+log.setLevel(logging.DEBUG)
+
+LIFTER_CACHE_DIR = "/tmp/lifter_cache"
+# soot IR objects are deeply nested
+PICKLE_RECURSION_LIMIT = 100000
+READ_CHUNK = 1 << 20
+
+# lifters already loaded by this process, by cache key
+_lifters = {}
+# APK digests, by path, size and modification time
+_digests = {}
+
+
+class CachedLifter:
+    """
+    Classes lifted from an APK, as loaded from the cache. It stands for a
+    pysoot Lifter wherever only its classes are needed.
+    """
+    def __init__(self, classes, apk_path=None, android_sdk=None):
+        self.classes = classes
+        self.apk_path = apk_path
+        self.android_sdk = android_sdk
+
+
+def apk_digest(apk_path):
+    st = os.stat(apk_path)
+    stamp = (apk_path, st.st_size, st.st_mtime)
+    if stamp not in _digests:
+        h = hashlib.sha256()
+        with open(apk_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(READ_CHUNK), b''):
+                h.update(chunk)
+        _digests[stamp] = h.hexdigest()
+    return _digests[stamp]
+
+
+def sdk_version(android_sdk):
+    # the platforms soot can resolve the framework classes against
+    platforms = sorted(os.listdir(android_sdk)) if android_sdk and os.path.isdir(android_sdk) else []
+    return hashlib.sha256(str(android_sdk) + ':' + ','.join(platforms)).hexdigest()[:16]
+
+
+def cache_key(apk_path, android_sdk):
+    return '{}_{}'.format(apk_digest(apk_path), sdk_version(android_sdk))
+
+
+def save_classes(path, classes):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, PICKLE_RECURSION_LIMIT))
+    try:
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            pickle.dump(classes, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def load_classes(path):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, PICKLE_RECURSION_LIMIT))
+    try:
+        with open(path, 'rb') as fp:
+            return pickle.load(fp)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def get_lifter(config, keep=True):
+    """
+    Lifter of the APK in config. Lifting runs at most once per APK and SDK:
+    the classes are cached on disk (config['lifter_cache_dir']), keyed by the
+    SHA-256 of the APK and the SDK platforms. Unless keep is False, the
+    lifter also stays in memory until release_lifter.
+    """
+    apk_path = config['apk_path']
+    android_sdk = config['android_sdk_platforms']
+    key = cache_key(apk_path, android_sdk)
+    if key in _lifters:
+        return _lifters[key]
+
+    cache_dir = config.get('lifter_cache_dir', LIFTER_CACHE_DIR)
+    path = os.path.join(cache_dir, key + '.pk')
+    lifter = None
+    if os.path.isfile(path):
+        log.info("Loading lifted classes from " + path)
+        try:
+            lifter = CachedLifter(load_classes(path), apk_path, android_sdk)
+        except Exception as e:
+            log.warning("Lifter cache {} unusable: {}".format(path, str(e)))
+
+    if lifter is None:
+        from pysoot.lifter import Lifter
+        log.info("Building lifter")
+        lifter = Lifter(apk_path, input_format="apk", android_sdk=android_sdk)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            save_classes(path, lifter.classes)
+            log.info("Lifted classes cached in " + path)
+        except Exception as e:
+            log.warning("Could not cache the lifter: " + str(e))
+
+    if keep:
+        _lifters[key] = lifter
+    return lifter
+
+
+def release_lifter(config):
+    # the lifter is freed once its users drop it too
+    lifter = _lifters.pop(cache_key(config['apk_path'], config['android_sdk_platforms']), None)
+    if lifter is not None:
+        drop_field_resolver(lifter)
@@ -29,7 +29,7 @@ N_PACKETS = 50
 
 @FridaRunner
 class SendFinder:
-    def __init__(self, config, hooker=None, sniffer=None, bltlog_analyzer=None):
+    def __init__(self, config, hooker=None, sniffer=None, bltlog_analyzer=None, adb_driver=None):
         self.hooker = hooker if hooker else FridaHooker(config)
         self.sniffer = sniffer if sniffer else Sniffer(config)
         self.bltlog_analyzer = bltlog_analyzer if bltlog_analyzer else BltLogAnalyzer()
@@ -39,7 +39,7 @@ class SendFinder:
         self.superset_senders = []
         self.run_fun = None
         self.proc_reran = None
-        self.adb_driver = ADBDriver()
+        self.adb_driver = adb_driver if adb_driver else ADBDriver()
 
     def terminate(self):
         self.hooker.terminate()
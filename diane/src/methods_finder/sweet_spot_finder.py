@@ -7,8 +7,8 @@ import sys
 sys.path.append(dirname(dirname(abspath(__file__))))
 
 from frida_hooker.frida_hooker import FridaHooker, ApkExploded, ApkKilled, ApkStuck, FridaRunner
-from pysoot.lifter import Lifter
 from node_filter.node_filter import NodeFilter
+from lifter_utils import get_field_resolver, get_lifter
 from androguard.core.bytecodes.dvm_types import TYPE_DESCRIPTOR
 import turi
 from turi.utils import walk_all_statements
@@ -18,7 +18,6 @@ import pysoot
 import pickle
 from enum import Enum
 
-LIFTER_PICKLE = "/tmp/lifter.pk"
 logging.basicConfig()
 log = logging.getLogger("SweetSpotFinder")
 log.setLevel(logging.DEBUG)
@@ -363,15 +362,10 @@ class SweetSpotFinder:
     def set_known_obj_for_funs(self, methods):
         params = list(set([tuple(x[2]) for x in methods]))
         params = [x for y in params for x in y]
+        resolver = get_field_resolver(self.lifter)
         for par in params:
             if par in self.p.classes:
-                clx = self.p.classes[par]
-                fields = []
-                for f_name, f_info in clx.fields.items():
-                    if f_name in [m.name for m in clx.methods]:
-                        # frida internal naming
-                        f_name = '_' + f_name
-                    fields.append([f_info[1], f_name])
+                fields = [[f_info[1], f_name] for f_name, f_info in resolver.get_fields(par, extended=False)]
                 self.hooker.add_known_object({par: fields})
 
     def get_obj_bigget_entropy_prim(self, obj):
@@ -674,15 +668,17 @@ class SweetSpotFinder:
                 new_ss.append(ss)
         self.sweet_spots = list(new_ss)
 
+    def release_lifter(self):
+        # start gets it again
+        self.lifter = None
+        self.p = None
+
     def start(self, sender, ran_fun=lambda *args: None, lifter=None):
         if not self.lifter:
             if lifter is not None:
                 self.lifter = lifter
             if self.lifter is None:
-                log.debug("Building Lifter")
-                self.lifter = Lifter(self.config['apk_path'], input_format="apk",
-                                android_sdk=self.config['android_sdk_platforms'])
-                log.debug("Lifter pickled in " + LIFTER_PICKLE)
+                self.lifter = get_lifter(self.config)
         self.p = turi.Project(self.apk_path, input_format='apk',
                               android_sdk=self.config['android_sdk_platforms'], lifter=self.lifter)
         if not self.nf:
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("Metrics")
+log.setLevel(logging.DEBUG)
+
+METRICS_INTERVAL_SEC = 10
+METRICS_PREFIX = "diane_"
+
+# name -> (OpenMetrics type, help)
+METRICS = {
+    'generated': ('counter', 'Values generated for the fuzzed method'),
+    'consumed': ('counter', 'Values the fuzzed method was actually called with'),
+    'windows': ('counter', 'Fuzzing windows'),
+    'crashes': ('counter', 'App crashes while fuzzing'),
+    'duplicates': ('counter', 'Values not sent because they had been tried already'),
+    'minimize_runs': ('counter', 'Replays of crashing values run to minimize them'),
+    'rpcs': ('counter', 'Frida RPC calls'),
+    'blob_bytes': ('counter', 'Bytes of fuzzed byte arrays sent to the agent as binary data'),
+    'replays': ('counter', 'UI replays started'),
+    'rpc_time': ('counter', 'Seconds spent in Frida RPC calls'),
+    'replay_time': ('counter', 'Seconds spent replaying the UI'),
+    'idle_time': ('counter', 'Seconds spent waiting for the app or the agent'),
+    'adb_time': ('counter', 'Seconds spent in synchronous adb commands'),
+}
+
+
+class Timer:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.registry.add(self.name, time.time() - self.start)
+        return False
+
+
+class TimedProxy:
+    # times every call made through an object, e.g. Frida script exports
+    def __init__(self, obj, registry, time_name, count_name):
+        self.obj = obj
+        self.registry = registry
+        self.time_name = time_name
+        self.count_name = count_name
+
+    def __getattr__(self, name):
+        fun = getattr(self.obj, name)
+
+        def timed(*args, **kwargs):
+            with self.registry.timer(self.time_name):
+                ret = fun(*args, **kwargs)
+            self.registry.add(self.count_name, 1)
+            return ret
+        return timed
+
+
+class MetricsRegistry:
+    """
+    Counters and timers per fuzzed (method, combination). Components record
+    against the unit currently being fuzzed, set by the ArgFuzzer. The
+    registry is rewritten as JSON and OpenMetrics text every interval seconds.
+    """
+    def __init__(self):
+        self.units = {}
+        self.unit = ('', '')
+        self.path = None
+        self.interval = METRICS_INTERVAL_SEC
+        self.last_write = 0
+        self.started = time.time()
+
+    def configure(self, path, interval=METRICS_INTERVAL_SEC):
+        # path without extension, .json and .prom are written
+        self.path = path
+        self.interval = interval
+
+    def set_unit(self, method, comb):
+        # comb: fuzzed parameter positions, or the name of a fuzzed class field
+        if isinstance(comb, (tuple, list)):
+            comb = ','.join(map(str, comb))
+        self.unit = (str(method), 'fields' if comb is None else str(comb))
+
+    def add(self, name, value=1):
+        metrics = self.units.setdefault(self.unit, {})
+        metrics[name] = metrics.get(name, 0) + value
+        if self.path and time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def timed(self, obj, time_name='rpc_time', count_name='rpcs'):
+        return TimedProxy(obj, self, time_name, count_name)
+
+    def per_method(self, name):
+        totals = {}
+        for (method, _), metrics in self.units.items():
+            if method:
+                totals[method] = totals.get(method, 0) + metrics.get(name, 0)
+        return totals
+
+    def snapshot(self):
+        now = time.time()
+        units = []
+        totals = {}
+        for (method, comb), metrics in sorted(self.units.items()):
+            unit = {'method': method, 'comb': comb}
+            unit.update(metrics)
+            consumed_time = metrics.get('replay_time', 0)
+            if consumed_time:
+                unit['execs_per_sec'] = metrics.get('consumed', 0) / consumed_time
+            units.append(unit)
+            for name, value in metrics.items():
+                totals[name] = totals.get(name, 0) + value
+        totals['elapsed_time'] = now - self.started
+        return {'updated': now, 'totals': totals, 'units': units}
+
+    def to_openmetrics(self, snapshot):
+        def label(s):
+            return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = []
+        for name in sorted(METRICS):
+            m_type, m_help = METRICS[name]
+            full = METRICS_PREFIX + name
+            lines.append('# TYPE {} {}'.format(full, m_type))
+            lines.append('# HELP {} {}'.format(full, m_help))
+            for unit in snapshot['units']:
+                if name in unit:
+                    lines.append('{}_total{{method="{}",comb="{}"}} {}'.format(
+                        full, label(unit['method']), label(unit['comb']), unit[name]))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        if not self.path:
+            return
+        self.last_write = time.time()
+        snapshot = self.snapshot()
+        try:
+            for ext, content in (('.json', json.dumps(snapshot, indent=2)),
+                                 ('.prom', self.to_openmetrics(snapshot))):
+                tmp = self.path + ext + '.tmp'
+                with open(tmp, 'w') as fp:
+                    fp.write(content)
+                os.rename(tmp, self.path + ext)
+        except (IOError, OSError) as e:
+            log.warning("Could not write the metrics: " + str(e))
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
@@ -1,9 +1,14 @@
 #TODO: add also methods containing functions that share messages/signals. io.reactivex.FlowableEmitter
 #FIXME: this class needs refactory and consistence
 import os
+import sys
 import pickle
-from pysoot.lifter import Lifter
 import itertools
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from lifter_utils import get_lifter
 
 import logging
 
@@ -19,6 +24,7 @@ CLASSES_TO_IGNORE = ['proxy']
 
 class NodeFilter:
     def __init__(self, config, lifter=None, lazy_execution=False, reload=False):
+        self.config = config
         self.methods_black_list = []
         self.should_not_contain_method = config['bad_functions']
         self.apk_path = config['apk_path']
@@ -36,8 +42,8 @@ class NodeFilter:
             self.start(reload=reload)
 
     def setup_lifter(self):
-        # pysoot
-        self.lifter = Lifter(self.apk_path, input_format="apk", android_sdk=self.android_sdk)
+        # pysoot, through the lifter cache
+        self.lifter = get_lifter(self.config)
 
     def get_filter_reason(self, method):
         key = method if type(method[2]) == tuple else (method[0], method[1], tuple(method[2]))
@@ -0,0 +1,3 @@
+from device_pool import DevicePool
+from backend import DeviceBackend
+from power_scheduler import PowerScheduler
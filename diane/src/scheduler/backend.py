@@ -0,0 +1,42 @@
+import sys
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from lifter_utils import get_lifter
+
+
+def sniffer_config(config):
+    return {'android_ip': config['android_ip'],
+            'device_ip': config['device_ip'],
+            'ip_hot_spot': config['ip_hot_spot'],
+            'pass_ap': config['pass_ap']}
+
+
+class DeviceBackend:
+    """
+    Builds the components that talk to the phone and to the network: Frida
+    hooker, adb/RERAN driver, sniffer. A backend instance is also a
+    DevicePool backend_factory.
+    """
+    def lifter(self, config):
+        return get_lifter(config)
+
+    def hooker(self, config, node_filter=None):
+        from frida_hooker.frida_hooker import FridaHooker
+        return FridaHooker(config, node_filter=node_filter)
+
+    def adb_driver(self, config, f_path=None):
+        from ui.core import ADBDriver
+        return ADBDriver(f_path=f_path, device_id=config['device_id'])
+
+    def sniffer(self, config):
+        from sniffer.sniffer import Sniffer
+        return Sniffer(sniffer_config(config))
+
+    def bltlog_analyzer(self, config):
+        from sniffer.bltlog_analyzer import BltLogAnalyzer
+        return BltLogAnalyzer()
+
+    def __call__(self, config):
+        return self.hooker(config), self.adb_driver(config, f_path=config['reran_record_path'])
@@ -0,0 +1,264 @@
+import os
+import copy
+import time
+import signal
+import logging
+import multiprocessing
+from functools import reduce
+import sys
+from os.path import dirname, abspath
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from arg_fuzzer.window_controller import merge_window_stats
+from backend import DeviceBackend
+
+logging.basicConfig()
+log = logging.getLogger("DevicePool")
+log.setLevel(logging.DEBUG)
+
+READY_TIMEOUT = 300
+RESULT_TIMEOUT = 5
+
+
+def unit_key(*args):
+    # methods are lists, hence not hashable
+    return repr(args)
+
+
+def default_backend(config):
+    return DeviceBackend()(config)
+
+
+def device_config(config, device_id):
+    # every device gets its own frida/adb target and its own results directory
+    dev_config = copy.deepcopy(config)
+    dev_config['device_id'] = device_id
+    dev_config['results_path'] = os.path.join(config['results_path'], device_id)
+    # dedup filters are per device too: their files are not shared between processes
+    if config.get('dedup_path'):
+        dev_config['dedup_path'] = os.path.join(config['dedup_path'], device_id)
+    return dev_config
+
+
+def device_worker(config, lifter, backend_factory, tasks, results):
+    # the parent handles SIGINT and terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    from arg_fuzzer.arg_fuzzer import ArgFuzzer
+
+    device_id = config['device_id']
+    try:
+        hooker, adbd = backend_factory(config)
+        arg_fuzzer = ArgFuzzer(config, hooker=hooker)
+    except Exception as e:
+        log.error("Device {} could not be set up: {}".format(device_id, str(e)))
+        results.put(('failed', device_id, None))
+        return
+
+    results.put(('ready', device_id, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        fuzz_list, method, unit, fast_fuzz, n_fuzz = task
+        # n_fuzz is set by the power scheduler
+        kwargs = {'n_fuzz': n_fuzz} if n_fuzz is not None else {}
+        log.info("Device {} fuzzing {} {}".format(device_id, str(method), str(unit)))
+        fuzzed, count, stats = arg_fuzzer.fuzz_unit(method, unit, ran_fun=adbd.replay_ui_async,
+                                                    fast_fuzz=fast_fuzz, lifter=lifter, fuzz_list=fuzz_list, **kwargs)
+        results.put(('done', device_id, (task, fuzzed, count, stats, arg_fuzzer.unit_stats)))
+
+    hooker.terminate()
+
+
+class DevicePool:
+    """
+    Fuzzes a list of targets over several devices. Every (method, parameter
+    combination) is an independent unit handed out to the first idle device;
+    fuzz counts are merged as units complete.
+    """
+    def __init__(self, config, device_ids, arg_fuzzer, lifter=None, backend_factory=default_backend):
+        self.config = config
+        self.device_ids = device_ids
+        # local fuzzer, used to split the targets in units and for its journal
+        self.arg_fuzzer = arg_fuzzer
+        self.journal = arg_fuzzer.journal
+        self.lifter = lifter
+        self.backend_factory = backend_factory
+        self.fuzz_counts = {}
+        # latest window stats of every device, they are cumulative per device
+        self.device_window_stats = {}
+        self.workers = {}
+        self.tasks = {}
+        self.results = multiprocessing.Queue()
+        # set on SIGINT: no more units are handed out
+        self.stopped = False
+
+    def spawn_worker(self, device_id):
+        tasks = multiprocessing.Queue()
+        p = multiprocessing.Process(target=device_worker,
+                                    args=(device_config(self.config, device_id), self.lifter, self.backend_factory,
+                                          tasks, self.results))
+        p.daemon = True
+        p.start()
+        self.workers[device_id] = p
+        self.tasks[device_id] = tasks
+
+    def start_workers(self):
+        for device_id in self.device_ids:
+            self.spawn_worker(device_id)
+
+        ready = []
+        while len(ready) < len(self.workers):
+            try:
+                msg, device_id, _ = self.results.get(timeout=READY_TIMEOUT)
+            except Empty:
+                break
+            if msg == 'ready':
+                ready.append(device_id)
+            elif msg == 'failed':
+                self.workers.pop(device_id).join()
+                self.tasks.pop(device_id)
+
+        log.info("Devices ready: {}".format(str(ready)))
+        return ready
+
+    def get_units(self, targets):
+        units = []
+        for fuzz_list, method, fast_fuzz in targets:
+            for unit in self.arg_fuzzer.get_fuzz_units(method):
+                if self.journal and self.journal.is_done(fuzz_list, method, unit):
+                    continue
+                units.append((fuzz_list, method, unit, fast_fuzz, None))
+        return units
+
+    def record_result(self, device_id, task, fuzzed, count, stats, unreached):
+        fuzz_list, method, unit = task[:3]
+        key = str(method)
+        self.fuzz_counts[key] = self.fuzz_counts.get(key, 0) + count
+        if stats:
+            self.device_window_stats.setdefault(device_id, {})[key] = stats
+        if not fuzzed:
+            # no reason to try the other combinations of a method that is never called
+            unreached.add(unit_key(fuzz_list, method))
+        if self.journal:
+            self.journal.record_done(fuzz_list, method, unit)
+
+    def check_workers(self, busy, pending, retried):
+        # a device died: its unit goes back to the queue once
+        for device_id, p in list(self.workers.items()):
+            if p.is_alive():
+                continue
+            log.error("Device {} died".format(device_id))
+            self.workers.pop(device_id)
+            self.tasks.pop(device_id)
+            task = busy.pop(device_id, None)
+            if task is not None and unit_key(*task) not in retried:
+                retried.add(unit_key(*task))
+                pending.insert(0, task)
+
+    def run(self, targets):
+        # targets: list of (fuzz_list, method, fast_fuzz)
+        pending = self.get_units(targets)
+        if not self.workers:
+            self.start_workers()
+
+        busy = {}
+        idle = [d for d in self.device_ids if d in self.workers]
+        unreached = set()
+        retried = set()
+
+        while (pending or busy) and self.workers and not self.stopped:
+            while pending and idle:
+                task = pending.pop(0)
+                if unit_key(task[0], task[1]) in unreached:
+                    continue
+                device_id = idle.pop(0)
+                busy[device_id] = task
+                self.tasks[device_id].put(task)
+
+            try:
+                msg, device_id, data = self.results.get(timeout=RESULT_TIMEOUT)
+            except Empty:
+                self.check_workers(busy, pending, retried)
+                idle = [d for d in idle if d in self.workers]
+                continue
+
+            if msg == 'done':
+                task, fuzzed, count, stats, _ = data
+                busy.pop(device_id, None)
+                self.record_result(device_id, task, fuzzed, count, stats, unreached)
+                idle.append(device_id)
+
+        if self.stopped:
+            log.info("Fuzzing stopped, {} units not fuzzed".format(len(pending) + len(busy)))
+        elif pending or busy:
+            log.error("No device left, {} units not fuzzed".format(len(pending) + len(busy)))
+        return self.fuzz_counts
+
+    def run_scheduled(self, scheduler):
+        # units are handed out as the power scheduler picks them
+        if not self.workers:
+            self.start_workers()
+
+        busy = {}
+        started = {}
+        idle = [d for d in self.device_ids if d in self.workers]
+        pending = []
+        retried = set()
+
+        while self.workers and not self.stopped:
+            while idle:
+                task = pending.pop(0) if pending else scheduler.next()
+                if task is None:
+                    break
+                device_id = idle.pop(0)
+                busy[device_id] = task
+                started[device_id] = time.time()
+                self.tasks[device_id].put(task)
+            if not busy:
+                break
+
+            try:
+                msg, device_id, data = self.results.get(timeout=RESULT_TIMEOUT)
+            except Empty:
+                self.check_workers(busy, pending, retried)
+                idle = [d for d in idle if d in self.workers]
+                continue
+
+            if msg == 'done':
+                task, fuzzed, count, stats, unit_stats = data
+                busy.pop(device_id, None)
+                self.record_result(device_id, task, fuzzed, count, stats, set())
+                scheduler.record(task, fuzzed, count, unit_stats, time.time() - started.pop(device_id))
+                idle.append(device_id)
+
+        if self.stopped:
+            log.info("Fuzzing stopped")
+        elif not scheduler.done():
+            log.error("No device left, fuzzing budget not spent")
+        return self.fuzz_counts
+
+    def get_window_stats(self):
+        return reduce(merge_window_stats, self.device_window_stats.values(), {})
+
+    def stop(self):
+        # safe from a signal handler: run and run_scheduled return within
+        # RESULT_TIMEOUT, the workers are left to terminate
+        self.stopped = True
+
+    def terminate(self):
+        for device_id, tasks in self.tasks.items():
+            tasks.put(None)
+        for device_id, p in self.workers.items():
+            p.join(RESULT_TIMEOUT)
+            if p.is_alive():
+                p.terminate()
+        self.workers = {}
+        self.tasks = {}
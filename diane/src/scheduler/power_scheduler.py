@@ -0,0 +1,185 @@
+import json
+import logging
+
+logging.basicConfig()
+log = logging.getLogger("PowerScheduler")
+log.setLevel(logging.DEBUG)
+
+# values a unit is first fuzzed with, to tell whether the replay reaches it
+PROBE_ENERGY = 100
+# values an average unit gets per cycle
+ROUND_ENERGY = 500
+MIN_ENERGY = 50
+MAX_ENERGY = 4000
+# bounds of the hit rate and replay cost factors, relative to the average unit
+MIN_FACTOR = 0.25
+MAX_FACTOR = 4.0
+# a crash every 100 values doubles the energy of a unit
+ANOMALY_WEIGHT = 100
+# separates the list of a unit from the visit number in its journal key
+VISIT_SEP = '#'
+
+
+def clamp(x, low, high):
+    return max(low, min(x, high))
+
+
+def unit_id(fuzz_list, method, unit, fast_fuzz):
+    return json.dumps([fuzz_list, method, unit, fast_fuzz])
+
+
+def task_id(task):
+    return json.dumps(list(task))
+
+
+def visit_list(fuzz_list, visit):
+    # every visit of a unit is journaled as a unit of its own
+    return fuzz_list if visit == 0 else '{}{}{}'.format(fuzz_list, VISIT_SEP, visit)
+
+
+class PowerScheduler:
+    """
+    Shares a global budget of fuzzed values among units (fuzz list, method,
+    parameter combination or class fields), as AFL shares executions among
+    its queue entries. Units are fuzzed in cycles: every unit is first probed
+    with a few values, then, at each cycle, gets energy in proportion to its
+    hit rate (values consumed per window), its replay cost (seconds per value
+    consumed) and its anomaly yield (crashes per value), compared to the
+    average unit. Units the replays never reach are dropped.
+    """
+    def __init__(self, units, budget, round_size=ROUND_ENERGY, probe=PROBE_ENERGY, journal=None):
+        # units: (fuzz_list, method, unit, fast_fuzz)
+        self.units = {}
+        self.active = []
+        for task in units:
+            uid = unit_id(*task)
+            if uid not in self.units:
+                self.units[uid] = task
+                self.active.append(uid)
+        self.budget = budget
+        self.round_size = round_size
+        self.probe = probe
+        self.journal = journal
+
+        self.stats = {uid: {'visits': 0, 'fuzzed': 0, 'windows': 0, 'crashes': 0, 'seconds': 0.0}
+                      for uid in self.units}
+        self.spent = 0
+        self.cycle = 0
+        self.queue = []
+        # task_id of the visits being fuzzed -> (unit_id, energy)
+        self.in_flight = {}
+
+        if journal is not None:
+            for rec in journal.visits:
+                if rec['id'] in self.units:
+                    self.update(rec['id'], rec['energy'], rec['fuzzed'], rec['count'], rec['windows'],
+                                rec['crashes'], rec['seconds'])
+            if journal.visits:
+                log.info("Restored {} visits, budget left {}".format(len(journal.visits), self.budget - self.spent))
+
+    def reached(self):
+        return [uid for uid in self.active if self.stats[uid]['fuzzed']]
+
+    def hit_rate(self, uid):
+        st = self.stats[uid]
+        return st['fuzzed'] / float(max(st['windows'], 1))
+
+    def cost(self, uid):
+        st = self.stats[uid]
+        return max(st['seconds'], 1e-3) / st['fuzzed']
+
+    def anomaly_yield(self, uid):
+        st = self.stats[uid]
+        return st['crashes'] / float(st['fuzzed'])
+
+    def score(self, uid):
+        if not self.stats[uid]['fuzzed']:
+            return 1.0
+        reached = self.reached()
+        mean_hit = sum([self.hit_rate(u) for u in reached]) / len(reached)
+        mean_cost = sum([self.cost(u) for u in reached]) / len(reached)
+        hit = clamp(self.hit_rate(uid) / mean_hit, MIN_FACTOR, MAX_FACTOR)
+        cost = clamp(mean_cost / self.cost(uid), MIN_FACTOR, MAX_FACTOR)
+        anomaly = 1 + min(ANOMALY_WEIGHT * self.anomaly_yield(uid), MAX_FACTOR)
+        return hit * cost * anomaly
+
+    def energy(self, uid):
+        if not self.stats[uid]['visits']:
+            return self.probe
+        return int(clamp(self.round_size * self.score(uid), MIN_ENERGY, MAX_ENERGY))
+
+    def budget_left(self):
+        return self.budget - self.spent - sum([e for _, e in self.in_flight.values()])
+
+    def next(self):
+        # next visit (fuzz_list, method, unit, fast_fuzz, n_fuzz), None if
+        # nothing can be fuzzed until a visit in flight is recorded, or at all
+        busy = set([uid for uid, _ in self.in_flight.values()])
+        self.queue = [uid for uid in self.queue if uid in self.active]
+        if not self.queue:
+            if busy:
+                # the cycle ends once its last visits are recorded
+                return None
+            self.cycle += 1
+            self.queue = sorted(self.active, key=lambda u: -self.score(u))
+            if self.queue:
+                log.debug("Cycle {}: {} units, budget left {}".format(self.cycle, len(self.queue),
+                                                                      self.budget_left()))
+
+        for uid in self.queue:
+            if uid in busy:
+                continue
+            energy = min(self.energy(uid), self.budget_left())
+            if energy <= 0:
+                return None
+            self.queue.remove(uid)
+            fuzz_list, method, unit, fast_fuzz = self.units[uid]
+            task = (visit_list(fuzz_list, self.stats[uid]['visits']), method, unit, fast_fuzz, energy)
+            self.in_flight[task_id(task)] = (uid, energy)
+            return task
+        return None
+
+    def done(self):
+        return not self.in_flight and (not self.active or self.budget_left() <= 0)
+
+    def drop(self, uid):
+        if uid in self.active:
+            self.active.remove(uid)
+
+    def update(self, uid, energy, fuzzed, count, windows, crashes, seconds):
+        st = self.stats[uid]
+        st['visits'] += 1
+        st['fuzzed'] += count
+        st['windows'] += windows
+        st['crashes'] += crashes
+        st['seconds'] += seconds
+        # class fields consume the energy once per field
+        self.spent += max(energy, count)
+
+        if not fuzzed:
+            # the method is never called: none of its units is worth fuzzing
+            fuzz_list, method = self.units[uid][:2]
+            for u in list(self.active):
+                if self.units[u][0] == fuzz_list and self.units[u][1] == method:
+                    self.drop(u)
+        elif not count:
+            self.drop(uid)
+
+    def record(self, task, fuzzed, count, unit_stats, seconds):
+        uid, energy = self.in_flight.pop(task_id(task))
+        unit_stats = unit_stats or {}
+        windows = unit_stats.get('windows', 0)
+        crashes = unit_stats.get('crashes', 0)
+        self.update(uid, energy, fuzzed, count, windows, crashes, seconds)
+        if self.journal is not None:
+            self.journal.record_visit({'id': uid, 'energy': energy, 'fuzzed': fuzzed, 'count': count,
+                                       'windows': windows, 'crashes': crashes, 'seconds': seconds})
+        log.debug("Unit {} fuzzed {} times in {:.1f}s, budget left {}".format(uid, count, seconds,
+                                                                               self.budget_left()))
+
+    def __iter__(self):
+        # single device: every visit is recorded before asking for the next one
+        task = self.next()
+        while task is not None:
+            yield task
+            task = self.next()
@@ -0,0 +1,5 @@
+from app import SimulatedApp, DEFAULT_PROFILE, get_profile
+from device import SimulatedDevice
+from replay import SimulatedADBDriver
+from network import SimulatedSniffer, SimulatedBltLogAnalyzer
+from backend import SimulatedBackend, SimulatedHooker
@@ -0,0 +1,133 @@
+import os
+import copy
+import pickle
+import hashlib
+import logging
+import sys
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from lifter_utils.lifter_cache import CachedLifter, cache_key, save_classes
+from lifter_utils.class_index import IndexedClass, IndexedMethod, build_class_index
+
+logging.basicConfig()
+log = logging.getLogger("SimulatedApp")
+log.setLevel(logging.DEBUG)
+
+SIM_CLASS = 'com.diane.sim.DeviceClient'
+
+# Companion app and device behaviour. Any key can be overridden by the
+# 'simulator' entry of the config. Latencies are in seconds.
+DEFAULT_PROFILE = {
+    'proc_name': 'com.diane.sim',
+    # methods of the app, as [class, method, params, ret]
+    'methods': [[SIM_CLASS, 'sendCommand', ['java.lang.String', 'int'], 'void'],
+                [SIM_CLASS, 'sendPayload', ['byte[]'], 'boolean'],
+                [SIM_CLASS, 'buildRequest', ['java.lang.String', 'java.lang.String', 'int'], 'java.lang.String'],
+                [SIM_CLASS, 'setLight', ['int', 'boolean'], 'void']],
+    # methods that put a packet on the network when called
+    'senders': [[SIM_CLASS, 'sendCommand', ['java.lang.String', 'int'], 'void'],
+                [SIM_CLASS, 'sendPayload', ['byte[]'], 'boolean']],
+    'sweet_spots': [[SIM_CLASS, 'buildRequest', ['java.lang.String', 'java.lang.String', 'int'], 'java.lang.String']],
+    # class -> field -> type
+    'fields': {SIM_CLASS: {'host': 'java.lang.String', 'port': 'int', 'token': 'java.lang.String'}},
+
+    'spawn_sec': 0.05,
+    'java_sec': 0.01,
+    'hook_sec': 0.0005,
+    'rpc_sec': 0.0005,
+    'kill_sec': 0.01,
+    # a UI replay is a sequence of events, every event calls each hooked
+    # method up to calls_per_event times, each call with probability hit_rate
+    'replay_events': 40,
+    'event_sec': 0.005,
+    'calls_per_event': 5,
+    'hit_rate': 0.8,
+    # 'class.method' -> hit rate, overrides hit_rate
+    'hit_rates': {},
+    # probability that a call with fuzzed values kills the app
+    'crash_rate': 0.0,
+    'packet_len': 200,
+    'keepalive_len': 60,
+    'keepalive_sec': 0.5,
+    'seed': None,
+}
+
+
+def get_profile(config):
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    profile.update(config.get('simulator', {}))
+    return profile
+
+
+def method_key(method):
+    return '{}.{}'.format(method[0], method[1])
+
+
+class SimulatedApp:
+    """
+    The app under test, as seen by the simulated device: its classes and
+    methods, which methods send packets and how often a replay reaches them.
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.proc_name = profile['proc_name']
+        self.methods = [list(m) for m in profile['methods']]
+        self.senders = [list(m) for m in profile['senders']]
+        self.sweet_spots = [list(m) for m in profile['sweet_spots']]
+        self.fields = profile['fields']
+
+    def hit_rate(self, method):
+        return self.profile['hit_rates'].get(method_key(method), self.profile['hit_rate'])
+
+    def is_sender(self, method):
+        return any(method_key(method) == method_key(s) and len(method[2]) == len(s[2]) for s in self.senders)
+
+    def classes(self):
+        classes = {}
+        for cls in set([m[0] for m in self.methods] + list(self.fields)):
+            methods = [IndexedMethod(m[1], cls, tuple(m[2]), m[3], ()) for m in self.methods if m[0] == cls]
+            fields = dict((f_name, ((), f_type)) for f_name, f_type in self.fields.get(cls, {}).items())
+            classes[cls] = IndexedClass(cls, 'java.lang.Object', (), (), fields, methods)
+        return classes
+
+    def lifter(self):
+        return CachedLifter(self.classes())
+
+    def install(self, config, work_dir):
+        """
+        Set config up to fuzz this app: a placeholder APK with its lifted
+        classes and class index already cached, the leaves pickle, the
+        senders and sweet spots.
+        """
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+
+        apk_path = os.path.join(work_dir, self.proc_name + '.apk')
+        with open(apk_path, 'wb') as fp:
+            fp.write(hashlib.sha256(repr(self.profile)).hexdigest())
+
+        cache_dir = os.path.join(work_dir, 'lifter_cache')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        key = cache_key(apk_path, config.get('android_sdk_platforms'))
+        lifter = self.lifter()
+        save_classes(os.path.join(cache_dir, key + '.pk'), lifter.classes)
+        build_class_index(lifter, os.path.join(cache_dir, key + '.cidx'))
+
+        leaf_pickle = os.path.join(work_dir, 'leaves_' + self.proc_name)
+        with open(leaf_pickle, 'wb') as fp:
+            pickle.dump([self.methods, {}], fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+        config['proc_name'] = self.proc_name
+        config['apk_path'] = apk_path
+        config['lifter_cache_dir'] = cache_dir
+        config['leaf_pickle'] = leaf_pickle
+        config['send_functions'] = self.senders
+        config['sweet_spots'] = self.sweet_spots
+        config['results_path'] = os.path.join(work_dir, 'results')
+        config['reran_record_path'] = os.path.join(work_dir, 'reran.log')
+        config['frida_hooker_pickle'] = os.path.join(work_dir, 'frida_hooker.pickle')
+        log.info("Simulated app installed in " + work_dir)
+        return config
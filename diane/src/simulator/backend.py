@@ -0,0 +1,74 @@
+import time
+import logging
+import sys
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from frida_hooker.frida_hooker import FridaHooker
+from lifter_utils import get_lifter
+from app import SimulatedApp, get_profile
+from device import SimulatedDevice
+from replay import SimulatedADBDriver
+from network import SimulatedSniffer, SimulatedBltLogAnalyzer
+
+logging.basicConfig()
+log = logging.getLogger("SimulatedBackend")
+log.setLevel(logging.DEBUG)
+
+
+class SimulatedHooker(FridaHooker):
+    # FridaHooker attached to a simulated device, with its spawn latencies
+    def __init__(self, config, device, node_filter=None):
+        self.sim_device = device
+        FridaHooker.__init__(self, config, node_filter=node_filter)
+
+    def get_device(self):
+        return self.sim_device
+
+    def wait_for_spawn(self):
+        time.sleep(self.sim_device.profile['spawn_sec'])
+
+    def wait_for_java(self):
+        time.sleep(self.sim_device.profile['java_sec'])
+
+
+class SimulatedBackend:
+    """
+    Drop-in for scheduler.DeviceBackend that needs no phone, Frida server,
+    RERAN or hotspot. The app and the device behaviour (latencies, hook hit
+    rates, crash rate) come from the 'simulator' entry of the config, see
+    simulator.app.DEFAULT_PROFILE.
+    """
+    def __init__(self, config):
+        self.profile = get_profile(config)
+        self.app = SimulatedApp(self.profile)
+        self.devices = {}
+
+    def device(self, config):
+        device_id = config['device_id']
+        if device_id not in self.devices:
+            self.devices[device_id] = SimulatedDevice(device_id, self.app)
+        return self.devices[device_id]
+
+    def install(self, config, work_dir):
+        return self.app.install(config, work_dir)
+
+    def lifter(self, config):
+        # served by the lifter cache install() filled
+        return get_lifter(config)
+
+    def hooker(self, config, node_filter=None):
+        return SimulatedHooker(config, self.device(config), node_filter=node_filter)
+
+    def adb_driver(self, config, f_path=None):
+        return SimulatedADBDriver(self.device(config), f_path=f_path)
+
+    def sniffer(self, config):
+        return SimulatedSniffer(config, self.device(config))
+
+    def bltlog_analyzer(self, config):
+        return SimulatedBltLogAnalyzer(self.device(config))
+
+    def __call__(self, config):
+        return self.hooker(config), self.adb_driver(config, f_path=config['reran_record_path'])
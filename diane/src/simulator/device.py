@@ -0,0 +1,367 @@
+import time
+import random
+import threading
+import logging
+from collections import deque
+import sys
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from frida import ProcessNotFoundError
+from frida_hooker.frida_hooker import TYPE_DESCRIPTOR
+
+logging.basicConfig()
+log = logging.getLogger("SimulatedDevice")
+log.setLevel(logging.DEBUG)
+
+# as in base_script.js
+SEPARATORS = {'cls': ['<CLS>', '</CLS>'],
+              'met': ['<MET>', '</MET>'],
+              'par': ['<PARS>', '</PARS>'],
+              'new_par': '<NEWPAR>',
+              'ret': ['<RETTYPE>', '</RETTYPE>'],
+              'next_entry': '<NEXT_ENTRY>',
+              'new_class_field': '<NEW_CLS_FIELD>',
+              'class_field': ['<CLS_FIELD>', '</CLS_FIELD>'],
+              'field_name': ['<NAME>', '</NAME>'],
+              'field_value': ['<VAL>', '</VAL>']}
+MAX_LAST_METHODS = 10
+ADHOC_CONSTRUCTORS = ['addjavaniobytebuffer', 'addfieldvarjavaniobytebuffer']
+FIRST_PID = 10000
+# packets remembered by the device, for the Bluetooth log
+MAX_SENT_PACKETS = 1000
+
+
+def frida_type(arg):
+    if arg.endswith('[]'):
+        if arg[:-2] in TYPE_DESCRIPTOR:
+            return '[' + TYPE_DESCRIPTOR[arg[:-2]]
+        return '[L' + arg[:-2] + ';'
+    return arg
+
+
+def frida_method(method):
+    # [class, method, params, ret] as the agent gets it from runit
+    return [method[0], '$init' if method[1] == '<init>' else method[1],
+            [frida_type(p) for p in method[2]], frida_type(method[3])]
+
+
+def method_to_string(method):
+    s = SEPARATORS
+    return s['cls'][0] + method[0] + s['cls'][1] + \
+        s['met'][0] + method[1] + s['met'][1] + \
+        s['par'][0] + s['new_par'].join(method[2]) + s['par'][1] + \
+        s['ret'][0] + method[3] + s['ret'][1]
+
+
+class RpcProxy:
+    # script.exports: every call costs a round trip to the device
+    def __init__(self, agent, latency):
+        self.agent = agent
+        self.latency = latency
+
+    def __getattr__(self, name):
+        fun = getattr(self.agent, name)
+
+        def call(*args, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            return fun(*args, **kwargs)
+        return call
+
+
+class SimulatedAgent:
+    """
+    Python counterpart of the Frida agent (base_script.js, object_setter.js,
+    exports.js), as far as the host can tell: same RPC exports, same
+    messages. Values are only counted, the simulated app ignores them.
+    """
+    def __init__(self, script, app, rng):
+        self.script = script
+        self.app = app
+        self.profile = app.profile
+        self.rng = rng
+        self.lock = threading.RLock()
+        self.hooked = []
+        self.last_methods = deque(maxlen=MAX_LAST_METHODS)
+        self.functions_called = {}
+        self.fuzz = None
+        self.values = 0
+        self.preparenewfuzz('none', 'none', 0, 0, False, False, 0)
+
+    def send(self, payload):
+        self.script.post_message({'type': 'send', 'payload': payload})
+
+    # exports
+    def getseparators(self):
+        return SEPARATORS
+
+    def adhocconstructors(self):
+        return list(ADHOC_CONSTRUCTORS)
+
+    def runit(self, apk_hooks, get_instances=False):
+        app_methods = [frida_method(m) for m in self.app.methods]
+        for m in apk_hooks:
+            self.send('HOOKING' + method_to_string(m))
+            if self.profile['hook_sec']:
+                time.sleep(self.profile['hook_sec'])
+            if list(m) not in app_methods:
+                # Java.use fails on what the app does not have
+                self.send('ERRORED' + method_to_string(m))
+                continue
+            with self.lock:
+                self.hooked.append(list(m))
+        self.send('HOOKDONE')
+
+    def preparenewfuzz(self, cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call):
+        with self.lock:
+            self.fuzz = {'cls': cls, 'm': m, 'n': n, 'nargs': nargs, 'ready': False, 'fast_fuzz': fast_fuzz,
+                         'tot': 0, 'single_call_fuzz': single_call_fuzz, 'curr_call': curr_call}
+            self.values = 0
+            self.blobs = 0
+
+    def prepareseededfuzz(self, cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call, seed, specs, tables):
+        self.preparenewfuzz(cls, m, n, nargs, fast_fuzz, single_call_fuzz, curr_call)
+        with self.lock:
+            self.fuzz['ready'] = True
+            self.functions_called = {}
+
+    def fuzzpreparedone(self, shuffle=False):
+        with self.lock:
+            self.fuzz['ready'] = True
+            self.functions_called = {}
+
+    def stopargsfuzz(self):
+        with self.lock:
+            self.fuzz['ready'] = False
+
+    def add_value(self, *args, **kwargs):
+        self.values += 1
+
+    def add_lists(self, lists):
+        self.values += sum(len(l) for l in lists)
+
+    def fuzzblobs(self, message, data):
+        # recv handler of onFuzzBlobs
+        if sum(message['sizes']) != len(data):
+            log.error("Fuzz blobs of {} bytes, {} expected".format(len(data), sum(message['sizes'])))
+        self.blobs += len(message['sizes'])
+
+    nextparamlist = nextfieldslist = addunfuzzedobj = addsimpleobj = add_value
+    addprimitivetype = addobj = addfieldvalprim = addfieldvalobj = add_value
+    addjavaniobytebuffer = addfieldvarjavaniobytebuffer = add_value
+    addparamslists = addfieldslists = add_lists
+
+    def addknownobject(self, obj):
+        pass
+
+    def resetlastmethods(self):
+        with self.lock:
+            self.last_methods.clear()
+
+    def resetlastinstances(self):
+        pass
+
+    def getvaluereturn(self):
+        return ''
+
+    def getutilscalls(self, method):
+        with self.lock:
+            return self.functions_called.get((method[0], method[1]), 0)
+
+    # app side
+    def ui_event(self):
+        # the hooked methods one UI event of the replay goes through
+        with self.lock:
+            hooked = list(self.hooked)
+        for m in hooked:
+            rate = self.app.hit_rate(m)
+            for _ in range(self.profile['calls_per_event']):
+                if not self.alive():
+                    return False
+                if self.rng.random() < rate:
+                    self.call(m)
+        return True
+
+    def alive(self):
+        return self.script.device.processes[self.script.pid].alive
+
+    def call(self, m):
+        # execFunction of object_setter.js
+        sign = (m[0], m[1])
+        self.last_methods.append(method_to_string(m))
+        self.send('METHODS' + SEPARATORS['next_entry'].join(self.last_methods))
+
+        with self.lock:
+            fuzz = self.fuzz
+            called = self.functions_called.get(sign, 0)
+            fuzzed = []
+            if m[0] == fuzz['cls'] and m[1] == fuzz['m'] and fuzz['ready'] and \
+                    not (fuzz['single_call_fuzz'] and called != fuzz['curr_call']):
+                if fuzz['fast_fuzz']:
+                    fuzzed = range(1, fuzz['n'] + 1)
+                else:
+                    fuzz['tot'] += 1
+                    fuzzed = [fuzz['tot']]
+            self.functions_called[sign] = called + 1
+
+        for n_rep in fuzzed:
+            if self.rng.random() < self.profile['crash_rate']:
+                self.script.device.crash(self.script.pid)
+                return
+            self.send('NREP:' + str(n_rep))
+        if not fuzzed:
+            self.send('NREP:' + str(called))
+
+        if self.app.is_sender(self.app_method(m)):
+            self.script.device.emit_packet(self.profile['packet_len'])
+
+    def app_method(self, m):
+        for method in self.app.methods:
+            if frida_method(method) == list(m):
+                return method
+        return m
+
+
+class SimulatedScript:
+    def __init__(self, device, pid, source):
+        self.device = device
+        self.pid = pid
+        self.source = source
+        self.handlers = {}
+        self.agent = None
+        self.loaded = False
+        self.destroyed = False
+
+    def on(self, signal_name, callback):
+        self.handlers.setdefault(signal_name, []).append(callback)
+
+    def load(self):
+        self.agent = SimulatedAgent(self, self.device.app, self.device.rng)
+        self.loaded = True
+
+    @property
+    def exports(self):
+        return RpcProxy(self.agent, self.device.profile['rpc_sec'])
+
+    def post(self, message, data=None):
+        # from the host to the recv handlers of the agent
+        if message.get('type') == 'fuzzblobs':
+            self.agent.fuzzblobs(message, data)
+
+    def post_message(self, message, data=None):
+        for callback in self.handlers.get('message', []):
+            callback(message, data)
+
+    def destroy(self):
+        if self.destroyed:
+            return
+        self.destroyed = True
+        for callback in self.handlers.get('destroyed', []):
+            callback()
+
+
+class SimulatedSession:
+    def __init__(self, device, pid):
+        self.device = device
+        self.pid = pid
+
+    def create_script(self, source):
+        script = SimulatedScript(self.device, self.pid, source)
+        self.device.processes[self.pid].scripts.append(script)
+        return script
+
+    def detach(self):
+        pass
+
+
+class SimulatedProcess:
+    def __init__(self, pid, name):
+        self.pid = pid
+        self.name = name
+        self.alive = True
+        self.resumed = False
+        self.scripts = []
+
+
+class SimulatedDevice:
+    """
+    A frida.core.Device running the simulated app. It also plays the UI
+    replays on the app and collects the packets the app sends.
+    """
+    def __init__(self, device_id, app):
+        self.id = device_id
+        self.app = app
+        self.profile = app.profile
+        self.rng = random.Random(self.profile['seed'])
+        self.processes = {}
+        self.next_pid = FIRST_PID
+        self.lock = threading.Lock()
+        # (time, length) of the packets sent by the app
+        self.sent = deque(maxlen=MAX_SENT_PACKETS)
+        # set by a sniffer while it is capturing
+        self.packet_sink = None
+
+    def spawn(self, program):
+        name = program[0] if isinstance(program, (list, tuple)) else program
+        with self.lock:
+            pid = self.next_pid
+            self.next_pid += 1
+            self.processes[pid] = SimulatedProcess(pid, name)
+        return pid
+
+    def resume(self, pid):
+        self.get_alive(pid).resumed = True
+
+    def attach(self, pid):
+        self.get_alive(pid)
+        return SimulatedSession(self, pid)
+
+    def get_alive(self, pid):
+        proc = self.processes.get(pid)
+        if proc is None or not proc.alive:
+            raise ProcessNotFoundError("unable to find process with pid {}".format(pid))
+        return proc
+
+    def get_process(self, name):
+        for proc in sorted(self.processes.values(), key=lambda p: -p.pid):
+            if proc.alive and proc.name == name:
+                return proc
+        raise ProcessNotFoundError("unable to find process with name '{}'".format(name))
+
+    def kill(self, pid):
+        self.terminate_process(self.get_alive(pid), self.profile['kill_sec'])
+
+    def crash(self, pid):
+        proc = self.processes.get(pid)
+        if proc is not None and proc.alive:
+            log.debug("Simulated app {} crashed".format(pid))
+            self.terminate_process(proc, 0)
+
+    def terminate_process(self, proc, delay):
+        proc.alive = False
+        # Frida reports the detach from its own thread
+        for script in proc.scripts:
+            t = threading.Timer(delay, script.destroy)
+            t.daemon = True
+            t.start()
+
+    def current_agent(self):
+        try:
+            proc = self.get_process(self.app.proc_name)
+        except ProcessNotFoundError:
+            return None
+        scripts = [s for s in proc.scripts if s.loaded]
+        return scripts[-1].agent if scripts else None
+
+    def ui_event(self):
+        agent = self.current_agent()
+        if agent is not None:
+            agent.ui_event()
+
+    def emit_packet(self, length):
+        self.sent.append((time.time(), length))
+        sink = self.packet_sink
+        if sink is not None:
+            sink(length)
@@ -0,0 +1,128 @@
+import os
+import time
+import fcntl
+import errno
+import select
+import struct
+import threading
+import logging
+import sys
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from sniffer.sniffer import Sniffer, StopCapturing
+from scheduler.backend import sniffer_config
+
+logging.basicConfig()
+log = logging.getLogger("SimulatedSniffer")
+log.setLevel(logging.DEBUG)
+
+# pcap global header: magic, version 2.4, no time zone, 65535 snaplen, ethernet
+PCAP_HEADER = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+TCPDUMP_LINE = "{} IP {}.{} > {}.80: Flags [P.], seq {}:{}, ack 1, win 229, length {}: HTTP\n"
+SRC_PORT = 40000
+
+
+class SimulatedSniffer(Sniffer):
+    """
+    Sniffer fed by a simulated device: every packet the app sends becomes a
+    tcpdump line in a pipe, which sniff_packets reads like the hotspot fifo.
+    The device also sends a keepalive packet every keepalive_sec.
+    """
+    def __init__(self, config, device):
+        profile = device.profile
+        Sniffer.__init__(self, sniffer_config(config), keepalive_timeout_sec=profile['keepalive_sec'] * 10)
+        self.device = device
+        self.profile = profile
+        self.pipe = None
+        self.seq = 1
+        self.keepalive = None
+
+    def write_packet(self, length):
+        now = time.time()
+        line = TCPDUMP_LINE.format(time.strftime('%H:%M:%S', time.localtime(now)) + '{:.6f}'.format(now % 1)[1:],
+                                   self.android_ip, SRC_PORT, self.device_ip, self.seq, self.seq + length, length)
+        self.seq += length
+        pipe = self.pipe
+        if pipe is None:
+            return
+        try:
+            os.write(pipe[1], line.encode())
+        except OSError as e:
+            # full pipe or capture stopped: the packet is lost, as with tcpdump
+            if e.errno not in (errno.EAGAIN, errno.EBADF):
+                raise
+
+    def send_keepalives(self, stop):
+        while not stop.wait(self.profile['keepalive_sec']):
+            self.write_packet(self.profile['keepalive_len'])
+
+    def start_capturing_traffic(self):
+        r, w = os.pipe()
+        fcntl.fcntl(w, fcntl.F_SETFL, fcntl.fcntl(w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.pipe = (r, w)
+        self.device.packet_sink = self.write_packet
+        stop = threading.Event()
+        t = threading.Thread(target=self.send_keepalives, args=(stop,))
+        t.daemon = True
+        t.start()
+        self.keepalive = stop
+
+    def sniff_packets(self, sniffing_time=60 * 30, n_packets=None):
+        log.info("Sniffing simulated packets (max sniffing time: {} sec)".format(str(sniffing_time)))
+        self.start_capturing_traffic()
+        self.sniffing = True
+        deadline = time.time() + sniffing_time
+        counter = 0
+        buf = b''
+        while True:
+            if n_packets and counter == n_packets:
+                log.info("Sniffed {} packets".format(str(n_packets)))
+                self.terminate()
+            while b'\n' not in buf:
+                wait = deadline - time.time()
+                if wait <= 0 or not select.select([self.pipe[0]], [], [], wait)[0]:
+                    self.terminate()
+                buf += os.read(self.pipe[0], 4096)
+            line, buf = buf.split(b'\n', 1)
+            counter += 1
+            yield line.decode() + '\n'
+
+    def dump_all_traffic_to_pcap(self, pcap_path):
+        with open(pcap_path, 'wb') as fp:
+            fp.write(PCAP_HEADER)
+
+    def get_opened_tcpdumps(self):
+        return []
+
+    def clean(self):
+        self.device.packet_sink = None
+        if self.keepalive is not None:
+            self.keepalive.set()
+            self.keepalive = None
+        if self.pipe is not None:
+            for fd in self.pipe:
+                os.close(fd)
+            self.pipe = None
+
+    def terminate(self, *args, **kwargs):
+        if self.sniffing:
+            self.sniffing = False
+            raise StopCapturing
+        self.clean()
+
+
+class SimulatedBltLogAnalyzer:
+    # Bluetooth log of a simulated device: the packets its app sent
+    def __init__(self, device):
+        self.device = device
+
+    def detect_keep_alives(self):
+        pass
+
+    def get_new_sent_packet_ts(self, start_ts):
+        for ts, _ in list(self.device.sent):
+            if ts > start_ts:
+                return ts
+        return None
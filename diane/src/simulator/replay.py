@@ -0,0 +1,65 @@
+import os
+import time
+import threading
+import subprocess
+import logging
+import sys
+from os.path import dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from metrics import get_registry
+
+logging.basicConfig()
+log = logging.getLogger("SimulatedADBDriver")
+log.setLevel(logging.DEBUG)
+
+# the replay process outlives its last event by this much
+REPLAY_TAIL_SEC = 0.01
+
+
+class SimulatedADBDriver:
+    """
+    ADBDriver of a simulated device. A UI replay is a real process, so the
+    callers can wait on it and kill its process group as with RERAN, while a
+    thread plays its events on the app.
+    """
+    def __init__(self, device, f_path=None):
+        self.device = device
+        self.profile = device.profile
+        self.f_path = f_path
+
+    def replay_duration(self):
+        return self.profile['replay_events'] * self.profile['event_sec'] + REPLAY_TAIL_SEC
+
+    def play(self, proc):
+        for _ in range(self.profile['replay_events']):
+            time.sleep(self.profile['event_sec'])
+            if proc.poll() is not None:
+                # killed
+                return
+            self.device.ui_event()
+
+    def replay_ui_async(self):
+        get_registry().add('replays')
+        proc = subprocess.Popen(['sleep', '{:.3f}'.format(self.replay_duration())], preexec_fn=os.setsid)
+        t = threading.Thread(target=self.play, args=(proc,))
+        t.daemon = True
+        t.start()
+        return proc
+
+    def replay_ui(self):
+        self.replay_ui_async().wait()
+
+    def record_ui(self, events_log_path):
+        with open(events_log_path, 'w'):
+            pass
+
+    def translate_events_log(self, f_path):
+        self.f_path = f_path
+
+    def adb_cmd(self, args, cmd_wait_time=None):
+        return '', ''
+
+    def adb_su_cmd(self, args, cmd_wait_time=None):
+        return '', ''
@@ -1,6 +1,7 @@
 import pyshark
 import logging
 import os
+import sys
 from os.path import dirname, abspath
 import contextlib
 
@@ -21,7 +22,7 @@ class BltLogAnalyzer:
 
     @contextlib.contextmanager
     def _log_file(self):
-        self.adb_driver.adb_su_cmd(f'cp {self.remote_logfile_path} /sdcard/my_blt_log')
+        self.adb_driver.adb_su_cmd('cp {} /sdcard/my_blt_log'.format(self.remote_logfile_path))
         self.adb_driver.adb_cmd(['pull', '/sdcard/my_blt_log', self.local_logfile_path])
         try:
             yield self.local_logfile_path
@@ -11,6 +11,12 @@ logging.basicConfig()
 log = logging.getLogger("Sniffer")
 log.setLevel(logging.DEBUG)
 
+SNIFF_SCRIPT = "sniff.sh"
+ALL_TRAFFIC_PCAP_SCRIPT = "dump_to_pcap.sh"
+FIFO_PIPE = "/tmp/sniff_data"
+SNIFFING_TIME_SEC = 60 * 30
+SYNC_SNIFFING = False
+
 
 class StopCapturing(Exception):
     pass
@@ -18,7 +24,7 @@ class StopCapturing(Exception):
 
 class Sniffer:
     def __init__(self, config, sniff_script="./sniff.sh", all_traffic_pcap_script="./dump_to_pcap.sh",
-                 fifo_pipe="/tmp/sniff_data", sniffing_time_sec=60 * 30, keepalive_timeout_sec=60 * 1,
+                 fifo_pipe=FIFO_PIPE, sniffing_time_sec=SNIFFING_TIME_SEC, keepalive_timeout_sec=60 * 1,
                  keepalive_threshold=0.5):
         self.android_ip = config['android_ip']
         self.device_ip = config['device_ip']
@@ -48,14 +54,14 @@ class Sniffer:
             return True
             
     def execute_killall(self, process_name):
-        cmd = f"killall -s 9 {process_name}"
+        cmd = "killall -s 9 {}".format(process_name)
         while True:
             p = sp.Popen(cmd, stdin=sp.PIPE, stderr=sp.PIPE, shell=True)
             _, e = p.communicate()
             if e:
                 break
 
-     def clean(self):
+    def clean(self):
         # Some cleaning
         if self.timer is not None and self.timer.is_alive():
             self.timer.terminate()
@@ -66,13 +72,13 @@ class Sniffer:
         # kill remote tcpdump
         if not self.pids:
             log.debug("Killing all tcpdump processes")
-            cmd = f'sshpass -p {self.pass_ap} ssh root@{self.ip_hotspot} "killall tcpdump"'
+            cmd = 'sshpass -p {} ssh root@{} "killall tcpdump"'.format(self.pass_ap, self.ip_hotspot)
             p = sp.Popen(cmd, stdin=sp.PIPE, stderr=sp.PIPE, shell=True)
             p.communicate()
         else:
             for p in self.pids:
-                log.debug(f"Killing tcpdump pid: {p}")
-                cmd = f'sshpass -p {self.pass_ap} ssh root@{self.ip_hotspot} "kill -9 {p}"'
+                log.debug("Killing tcpdump pid: {}".format(p))
+                cmd = 'sshpass -p {} ssh root@{} "kill -9 {}"'.format(self.pass_ap, self.ip_hotspot, p)
                 while True:
                     p = sp.Popen(cmd, stdin=sp.PIPE, stderr=sp.PIPE, shell=True)
                     _, e = p.communicate()
@@ -95,17 +101,17 @@ class Sniffer:
                     if eth_len not in sizes:
                         sizes[eth_len] = 0
                     sizes[eth_len] += 1
-                    log.info(f"Packet of length {eth_len} sniffed")
+                    log.info("Packet of length {} sniffed".format(eth_len))
 
             tot_bytes = sum([x for x in sizes.values()])
             for eth_len, count in sizes.items():
                 if count / float(tot_bytes) < self.keepalive_threshold:
                     continue
-                filter_ = f"'(greater {eth_len + 1} or less {eth_len - 1})'"
+                filter_ = "'(greater {} or less {})'".format(eth_len + 1, eth_len - 1)
                 if filter_ not in self.keep_alive_filters:
                     self.keep_alive_filters.append(filter_)
         except Exception as e:
-            log.error(f"Error detecting keepalive: {str(e)}")
+            log.error("Error detecting keepalive: {}".format(str(e)))
             self.clean()
             raise
     def apply_keepalive_filters(self):
@@ -3,9 +3,15 @@ import signal
 import os
 import os.path
 import json
+import sys
+from os.path import dirname, abspath
 
 from config import *
 
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from metrics import get_registry
+
 class UITimeoutError(Exception):
     def __init__(self, msg):
         self.msg = msg
@@ -80,8 +86,9 @@ class ADBDriver:
     def adb_cmd(self, args, cmd_wait_time=CMD_WAIT_TIME):
         cmd = self.build_adb_cmd(args, device_id=self.device_id)
         print('Executing ' + ' '.join(cmd))
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
+        with get_registry().timer('adb_time'):
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.communicate()
         return out, err
 
     def adb_su_cmd(self, args, cmd_wait_time=CMD_WAIT_TIME):
@@ -96,7 +103,8 @@ class ADBDriver:
             signalset = True
 
         try:
-            out, err = p.communicate()
+            with get_registry().timer('adb_time'):
+                out, err = p.communicate()
             if signalset:
                 signal.alarm(0)
                 signal.signal(signal.SIGALRM, signal.SIG_DFL)
@@ -139,6 +147,7 @@ class ADBDriver:
 
     def replay_ui_async(self):
         print('RERAN replaying (async)')
+        get_registry().add('replays')
         return self.adb_su_cmd_async([REPLAY_REMOTE_PATH, '/sdcard/translatedEvents.txt'])
 
     def start_monkey(self, package=None, seed=None, throttle=THROTTLE,